@@ -1,133 +1,123 @@
 from gym.core import Env
 from gym.spaces.box import Box
 from gym.spaces.discrete import Discrete
+from baselines.PyGameMultiAgent.mapstore import load_world
 from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent import shmtransport
 import numpy as np
 import pygame
 import pygame.locals
 import socket
 import select
 import random
-from baselines.PyGameMultiAgent.bot import Bot
+from baselines.PyGameMultiAgent.reward import calculate_reward_batch, closest_bot_batch, projection_blocking_distance_batch
 import time
 
+
 class ZombieChasePlayerEnv(Env):
 
-    def __init__(self):
+    # wire_protocol: protocol.OBS (the server computes observation and reward), protocol.BINARY
+    #                or protocol.TEXT (debugging) for pose updates the env computes them from
+    # room: GameServer room to join, None for protocol.DEFAULT_ROOM
+    # transport: shmtransport.AUTO (shared memory if the server is on this host), SHM or UDP
+    # timeout, retries: a step or reset resends its command after timeout seconds without an answer, up to retries
+    #                   times. A step that still gets none returns the last observation with info['stale'] set,
+    #                   a reset raises socket.timeout. timeout=None waits forever.
+    def __init__(self, wire_protocol=protocol.OBS, room=None, transport=shmtransport.AUTO, timeout=0.5, retries=4):
+        self.wire_protocol = wire_protocol
+        self.timeout = timeout
+        self.retries = retries
+        # see protocol.py, requests
+        self.request_seq = 0
+        self.discarded_updates = 0
+        self.stale_steps = 0
         self.map_index = 0
-        self.world = StaticWorld('Maps/map_0.csv')
+        # the obs protocol needs no map, render loads it
+        self.world = load_world(0) if wire_protocol != protocol.OBS else None
         self.clientport = random.randrange(8000, 8999)
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.conn.bind(("127.0.0.1", self.clientport))
         self.addr = "127.0.0.1"
         self.serverport = 9009
-        self.conn.sendto("cz".encode('utf-8'), (self.addr, self.serverport))
+        self.conn = shmtransport.client_socket(self.addr, self.clientport, transport)
+        self.conn.sendto(protocol.connect_message("z", wire_protocol, room, shmtransport.channel_path(self.conn)).encode('utf-8'),
+                         (self.addr, self.serverport))
 
         self.action_space = Discrete(4)
-        self.observation_space = Box(low = 0, high=3, shape=(self.world.radar_length, 1), dtype=np.float)
+        self.observation_space = Box(low = 0, high=3, shape=(StaticWorld.radar_blocks * 2, 1), dtype=np.float)
 
         self.saved_self_pose = None
         self.saved_all_zombie_pose = None
         self.saved_rew = 0.0
+        self.saved_obs = np.zeros(self.observation_space.shape)
 
         self.screen = None
 
         self.stepcount = 0
 
 
-    #block if no data received
-    def _fetch_pos_from_server(self):
-        msg, addr = self.conn.recvfrom(2048)
-        msg = msg.decode('utf-8')  # Coordinates of all players
-
-        splitted_msg = msg.split('|')
-        x, y, a, _ = splitted_msg[0].split(',')
-        x = float(x)
-        y = float(y)
-        a = float(a)
-        self_pos = (x, y, a)
-
-        AllZombiePose = []
-        for position in splitted_msg[1:-1]:
-            x, y, angle, tag = position.split(',')
-            x = float(x)
-            y = float(y)
-            angle = float(angle)
-            tag = int(tag)
-            AllZombiePose.append((x, y, angle, tag))
-
-        map_index = int(splitted_msg[-1])
-
-        return self_pos, AllZombiePose, map_index
+    # blocks until the update answering request_seq arrives (any update for request_seq=None or text updates),
+    # drops the older ones that arrive meanwhile. socket.timeout after self.timeout seconds.
+    def _fetch_pos_from_server(self, request_seq=None):
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout('timed out')
+                self.conn.settimeout(remaining)
+            msg, addr = self.conn.recvfrom(2048)
+            ack = protocol.decode_ack(msg)
+            if request_seq is None or ack is None or protocol.request_seq_diff(request_seq, ack) >= 0:
+                break
+            self.discarded_updates += 1
+        self_pos, AllZombiePose, map_index, _ = protocol.decode_update(msg)  # Coordinates of all players
+        return self_pos, AllZombiePose, map_index, msg
+
+    # returns (self_pos, AllZombiePos, obs, rew, done), reward and done measured from the saved poses
+    def _receive_step(self, request_seq=None):
+        self_pos, AllZombiePos, server_map_index, msg = self._fetch_pos_from_server(request_seq)
+        if self.wire_protocol == protocol.OBS:
+            self.map_index = server_map_index
+            obs, rew, done = protocol.decode_obs(msg)
+            return self_pos, AllZombiePos, obs, rew, done
 
+        if self.map_index != server_map_index:
+            self.world = load_world(server_map_index)
+            self.map_index = server_map_index
+        rew, done = self._calculate_reward(self_pos, AllZombiePos, self.saved_self_pose, self.saved_all_zombie_pose)
+        return self_pos, AllZombiePos, self.world.to_local_radar_obs(self_pos, AllZombiePos), rew, done
+
+    # sends cmd as a new request and returns the _receive_step of its answer, resending it on timeouts
+    def _request(self, cmd):
+        self.request_seq = (self.request_seq + 1) & 0xFFFF
+        msg = protocol.request_message(cmd, self.request_seq).encode('utf-8')
+        for attempt in range(self.retries + 1):
+            self.conn.sendto(msg, (self.addr, self.serverport))
+            try:
+                return self._receive_step(self.request_seq)
+            except socket.timeout:
+                if attempt == self.retries:
+                    raise
+
+    # scalar interface of calculate_reward_batch
     def _calculate_reward(self, self_pos, AllZombiePose, last_self_pose, last_allZombiePose):
         if last_allZombiePose is None:
             return 0, False
 
-        old_distance, _ = self._get_closest_bot_distance(last_self_pose, last_allZombiePose)
-        curr_distance, _ = self._get_closest_bot_distance(self_pos, AllZombiePose)
-
-        rew = 0
-
-        # reward for approaching target
-        if max(old_distance, curr_distance) < self.world.perception_grids:
-            if curr_distance < old_distance:
-                rew += (old_distance - curr_distance) * 0.01
-
-        # reward for moving , weight 0.1 => 0.05
-        # old_x, old_y, _ = last_self_pose
-        # x, y, _ = self_pos
-        # dist = np.sqrt(np.square(x - old_x) + np.square(y - old_y))
-        # rew += dist * 0.01   # range[0, 0.05]
-
-        # reward for staying near
-        if curr_distance < Bot.alertRadius:
-            blocked_distance = self._projection_blocking_distance(self_pos, AllZombiePose)
-            clipped_curr_distance = max(2, curr_distance)
-
-            rew += 2 / clipped_curr_distance * (curr_distance - blocked_distance) / curr_distance
-
-        # reward for catching
-        if curr_distance < 2:
-            rew += 10
-            return rew, True
-
-        return rew, False
+        rew, done = calculate_reward_batch([self_pos], np.reshape(AllZombiePose, (1, -1, 4)), [last_self_pose],
+                                           np.reshape(last_allZombiePose, (1, -1, 4)), self.world.perception_grids)
+        return float(rew[0]), bool(done[0])
 
     def _projection_blocking_distance(self, self_pos, allActorPose):
-        x, y, angle = self_pos
-        distance, target = self._get_closest_bot_distance(self_pos, allActorPose)
-        if distance > self.world.perception_grids or target is None:
-            return 0
-
-        target_x, target_y, _, _ = target
-        me_to_target = np.asarray([target_x - x, target_y - y])
-        me_to_target_unit = me_to_target / np.linalg.norm(me_to_target)
-
-        maximum_proj_length = 0
-
-        for actor in allActorPose:
-            ax, ay, aa, atag = actor
-            if atag == 0 and (x != ax or y != ay):
-                actor_to_target = np.asarray([target_x - ax, target_y - ay])
-                if np.linalg.norm(actor_to_target) < Bot.alertRadius:
-                    actor_proj_len = np.dot(me_to_target_unit, actor_to_target)
-                    if 0 < actor_proj_len < distance:
-                        maximum_proj_length = max(maximum_proj_length, actor_proj_len)
-        return maximum_proj_length
+        self_poses = np.asarray(self_pos, dtype=np.float64).reshape(1, 3)
+        actors = np.asarray(allActorPose, dtype=np.float64).reshape(1, -1, 4)
+        distance, target, has_target = closest_bot_batch(self_poses, actors)
+        return float(projection_blocking_distance_batch(self_poses, actors, distance, target, has_target, self.world.perception_grids)[0])
 
     def _get_closest_bot_distance(self, self_pos, allZombiePose):
-        x, y, _ = self_pos
-        closest_dist_sqr = 100000000
-        target_actor = None
-        for actor in allZombiePose:
-            ax, ay, _, atag = actor
-            if atag == 1:
-                dist_sqr = (ax - x)**2 + (ay - y)**2
-                if dist_sqr < closest_dist_sqr:
-                    closest_dist_sqr = dist_sqr
-                    target_actor = actor
-        return np.sqrt(closest_dist_sqr), target_actor
+        actors = np.asarray(allZombiePose, dtype=np.float64).reshape(1, -1, 4)
+        distance, target, has_target = closest_bot_batch(np.asarray(self_pos, dtype=np.float64).reshape(1, 3), actors)
+        return float(distance[0]), (actors[0, target[0]] if has_target[0] else None)
 
     #returns (obs, reward, finish)
     def step(self, action):
@@ -151,18 +141,16 @@ class ZombieChasePlayerEnv(Env):
         #     cmd = input('please input cmd')
         # else:
         #     cmd = 'ui'
-        self.conn.sendto(cmd.encode('utf-8'), (self.addr, self.serverport))
-
-        self_pos, AllZombiePos, server_map_index = self._fetch_pos_from_server()
-        if self.map_index != server_map_index:
-            del self.world
-            self.world = StaticWorld("Maps/map_{0}.csv".format(server_map_index))
-            self.map_index = server_map_index
-
-        rew, done = self._calculate_reward(self_pos, AllZombiePos, self.saved_self_pose, self.saved_all_zombie_pose)
+        try:
+            self_pos, AllZombiePos, obs, rew, done = self._request(cmd)
+        except socket.timeout:
+            # no answer from the server: the last observation again instead of blocking the vec env
+            self.stale_steps += 1
+            return self.saved_obs, 0.0, False, {'episode': {'r': 0.0, 'l': self.stepcount}, 'stale': True}
         self.saved_self_pose = self_pos
         self.saved_all_zombie_pose = AllZombiePos
         self.saved_rew = rew
+        self.saved_obs = obs
 
         #if done or self.stepcount == 4000:
         #    self.reset()
@@ -172,28 +160,32 @@ class ZombieChasePlayerEnv(Env):
         self.stepcount += 1
 
         # return self.world.to_local_obs(self_pos, AllZombiePos), rew, done, {'episode': {'r':rew, 'l':self.stepcount}}
-        return self.world.to_local_radar_obs(self_pos, AllZombiePos), rew, done, {'episode': {'r': rew, 'l': self.stepcount}}
+        return obs, rew, done, {'episode': {'r': rew, 'l': self.stepcount}, 'stale': False}
 
     def reset(self):
-        self.conn.sendto("r".encode('utf-8'), (self.addr, self.serverport))
-        self_pos, AllZombiePos, server_map_index = self._fetch_pos_from_server()
-        if self.map_index != server_map_index:
-            del self.world
-            self.world = StaticWorld("Maps/map_{0}.csv".format(server_map_index))
-            self.map_index = server_map_index
+        _, _, obs, _, _ = self._request("r")
+        self.saved_obs = obs
 
         self.stepcount = 0
-        return self.world.to_local_radar_obs(self_pos, AllZombiePos)
+        return obs
 
     metadata = {'render.modes': ['human', 'rgb_array']}
 
+    # rgb_array: the egocentric grid as a (local_length * zoom, local_width * zoom, 3) frame, needs no display
     def render(self, mode='human'):
+        if mode == 'rgb_array':
+            world = load_world(self.map_index)
+            if self.saved_self_pose is None:
+                return np.zeros((world.local_length * world.zoom, world.local_width * world.zoom, 3), dtype=np.uint8)
+            return world.to_local_rgb(self.saved_self_pose, self.saved_all_zombie_pose)
+
         if self.saved_self_pose is not None:
             if mode == 'human':
+                world = load_world(self.map_index)
                 if self.screen == None:
                     self.screen = pygame.display.set_mode(
-                        (self.world.local_width * self.world.zoom, self.world.local_length * self.world.zoom))
-                self.world.draw_local(self.screen, self.saved_self_pose, self.saved_all_zombie_pose)
+                        (world.local_width * world.zoom, world.local_length * world.zoom))
+                world.draw_local(self.screen, self.saved_self_pose, self.saved_all_zombie_pose)
                 pygame.display.update()
                 return
         else:
@@ -201,6 +193,7 @@ class ZombieChasePlayerEnv(Env):
 
     def close(self):
         self.conn.sendto("d".encode('utf-8'), (self.addr, self.serverport))
+        self.conn.close()
         if self.screen is not None:
             pygame.quit()
 
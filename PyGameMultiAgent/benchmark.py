@@ -0,0 +1,268 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import tracemalloc
+from math import pi as PI
+import numpy as np
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent.gameserver import GameServer, place_players
+from baselines.PyGameMultiAgent.bot import Bot, escape_policy_batch
+
+# Throughput benchmarks of the hot paths of the zombie chase stack
+#
+#   python -m baselines.PyGameMultiAgent.benchmark --maps 0 1 7 --actors 2 8 32 --out results.json
+#   python -m baselines.PyGameMultiAgent.benchmark --baseline results.json     (exit status 1 on a regression)
+#
+#  Every case runs on every map and actor count (where they apply) and reports calls per second, the p50 / p99
+#  latency of one call and the peak memory one call allocates (tracemalloc, measured in a separate pass so that
+#  tracing does not slow down the timed calls).
+#  A case regresses when its calls per second fall more than --tolerance below the baseline's.
+#
+#  env_step needs a free port 9009 (a GameServer and a Bot are started in this process), --cases leaves it out.
+
+SERVER_PORT = 9009
+
+
+# free points of world to put poses and actors on
+def _free_points(world):
+    return np.concatenate([points for points in world.spawn_points if len(points)])
+
+
+def _random_poses(world, count, rng):
+    points = _free_points(world)
+    chosen = points[rng.randint(len(points), size=count)]
+    return np.column_stack([chosen, rng.random_sample(count) * 2 * PI])
+
+
+# count actors (x, y, angle, tag) on free points within the perception of pos, zombies and bots alternating
+def _random_actors(world, pos, count, rng):
+    points = _free_points(world)
+    distance = np.abs(points - pos[:2]).max(axis=1)
+    near = points[(distance <= StaticWorld.perception_grids) & (distance > 0)]
+    chosen = near[rng.randint(len(near), size=count)] if len(near) else points[rng.randint(len(points), size=count)]
+    return np.column_stack([chosen, rng.random_sample(count) * 2 * PI, np.arange(count) % 2])
+
+
+# timings and allocations of fn(i) for i in range(repeat)
+def measure(fn, repeat, warmup=5, alloc_repeat=20):
+    for i in range(min(warmup, repeat)):
+        fn(i)
+
+    latencies = np.empty(repeat)
+    start = time.perf_counter()
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - t
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for i in range(min(alloc_repeat, repeat)):
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:  # Python < 3.9, restarting resets the peak too
+            tracemalloc.stop()
+            tracemalloc.start()
+        current, _ = tracemalloc.get_traced_memory()
+        fn(i)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {'calls_per_s': repeat / elapsed,
+            'p50_us': float(np.percentile(latencies, 50) * 1e6),
+            'p99_us': float(np.percentile(latencies, 99) * 1e6),
+            'alloc_peak_bytes': int(np.median(peaks))}
+
+
+def bench_raycast(map_index, actor_count, repeat, rng):
+    world = load_world(map_index)
+    poses = _random_poses(world, repeat, rng)
+    angles = np.degrees(poses[:, 2])
+    return measure(lambda i: world.rayCastWall(poses[i, :2], angles[i]), repeat)
+
+
+def bench_radar_obs(map_index, actor_count, repeat, rng):
+    world = load_world(map_index)
+    poses = _random_poses(world, repeat, rng)
+    actors = [_random_actors(world, pos, actor_count, rng) for pos in poses]
+    return measure(lambda i: world.to_local_radar_obs(poses[i], actors[i]), repeat)
+
+
+def bench_local_obs(map_index, actor_count, repeat, rng):
+    world = load_world(map_index)
+    poses = _random_poses(world, repeat, rng)
+    actors = [_random_actors(world, pos, actor_count, rng) for pos in poses]
+    return measure(lambda i: world.to_local_obs(poses[i], actors[i]), repeat)
+
+
+# one pose per call like Bot.run, see escape_policy_batch for many
+def bench_escape_policy(map_index, actor_count, repeat, rng):
+    world = load_world(map_index)
+    # dummy_escape_policy only needs the world, not the connection of a Bot
+    bot = Bot.__new__(Bot)
+    bot.world = world
+    poses = _random_poses(world, repeat, rng)
+    zombies = [_random_actors(world, pos, actor_count, rng)[:, :3] for pos in poses]
+    return measure(lambda i: bot.dummy_escape_policy(tuple(poses[i]), zombies[i]), repeat)
+
+
+# actor_count bots of one BotPool round
+def bench_escape_policy_batch(map_index, actor_count, repeat, rng):
+    world = load_world(map_index)
+    poses = [_random_poses(world, actor_count, rng) for _ in range(repeat)]
+    zombies = [np.stack([_random_actors(world, pos, 4, rng)[:, :3] for pos in bot_poses]) for bot_poses in poses]
+    return measure(lambda i: escape_policy_batch(world, poses[i], zombies[i]), repeat)
+
+
+# GameServer.tick_once with actor_count synthetic clients (obs protocol zombies and bots, rooms of 4)
+# sending one command per tick, without sockets
+def bench_server_tick(map_index, actor_count, repeat, rng):
+    server = GameServer(port=None, visualize=False)
+    world = load_world(map_index)
+    clients = []
+    for i in range(actor_count):
+        room_id = str(i // 4)
+        kind, wire_protocol = ('z', protocol.OBS) if i % 2 == 0 else ('b', protocol.BINARY)
+        server.handle_message(protocol.connect_message(kind, wire_protocol, room_id), ('127.0.0.1', i), lockstep=False)
+        clients.append(('127.0.0.1', i))
+
+    # every room on the benchmarked map
+    for room in server.rooms.values():
+        room.map_index, room.world = map_index, world
+        for player, start in zip(list(room.players_pose), place_players(world, len(room.players_pose), rng)):
+            room.players_pose[player] = start + (room.players_pose[player][3],)
+            room.actors.update(player, room.players_pose[player])
+
+    moves = ['uu', 'ul0.3', 'uu', 'ur0.3']
+
+    def tick(i):
+        for j, client in enumerate(clients):
+            server.handle_message(moves[(i + j) % 4], client, lockstep=False)
+        server.tick_once()
+    return measure(tick, repeat)
+
+
+# ZombieChasePlayerEnv.step (obs protocol) against a GameServer and a Bot in this process.
+# The map is whatever the server picks, actor_count is always 2.
+def bench_env_step(map_index, actor_count, repeat, rng):
+    from baselines.PyGameMultiAgent.MyEnv import ZombieChasePlayerEnv
+
+    server = GameServer(port=SERVER_PORT, visualize=False)
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+    bot = Bot(serverport=SERVER_PORT)
+    bot_thread = threading.Thread(target=bot.run, daemon=True)
+    bot_thread.start()
+    time.sleep(0.2)
+    env = ZombieChasePlayerEnv()
+    env.reset()
+
+    def step(i):
+        _, _, done, _ = env.step(i % 4)
+        if done:
+            env.reset()
+    try:
+        return measure(step, repeat)
+    finally:
+        # the port is free again for the next run
+        bot.running = False
+        env.close()
+        server.stop()
+        bot_thread.join()
+        server_thread.join()
+        bot.conn.close()
+        server.close()
+
+
+# name: (function, runs per map, runs per actor count, repeat)
+CASES = {
+    'raycast': (bench_raycast, True, False, 2000),
+    'radar_obs': (bench_radar_obs, True, True, 500),
+    'local_obs': (bench_local_obs, True, True, 500),
+    'escape_policy': (bench_escape_policy, True, True, 500),
+    'escape_policy_batch': (bench_escape_policy_batch, True, True, 200),
+    'server_tick': (bench_server_tick, True, True, 200),
+    'env_step': (bench_env_step, False, False, 1000),
+}
+
+
+# list of result dicts: case, map, actors and the measure() numbers
+def run(cases=None, maps=(0, 1), actor_counts=(2, 8, 32), repeat_scale=1.0, seed=0, verbose=True):
+    results = []
+    for name in cases or list(CASES):
+        fn, per_map, per_actor_count, repeat = CASES[name]
+        for map_index in (maps if per_map else [None]):
+            for actor_count in (actor_counts if per_actor_count else [None]):
+                rng = np.random.RandomState(seed)
+                result = fn(map_index if map_index is not None else 0, actor_count or 2,
+                            max(1, int(repeat * repeat_scale)), rng)
+                result.update(case=name, map=map_index, actors=actor_count)
+                results.append(result)
+                if verbose:
+                    print(format_result(result))
+    return results
+
+
+def _key(result):
+    return result['case'], result['map'], result['actors']
+
+
+def format_result(result, baseline=None):
+    line = '{0:<20} map {1!s:>4} actors {2!s:>4} {3:>12.1f}/s p50 {4:>10.1f}us p99 {5:>10.1f}us alloc {6:>9}B'.format(
+        result['case'], result['map'], result['actors'], result['calls_per_s'], result['p50_us'], result['p99_us'],
+        result['alloc_peak_bytes'])
+    if baseline is not None:
+        line += '  x{0:.2f}'.format(result['calls_per_s'] / baseline['calls_per_s'])
+    return line
+
+
+# the results whose calls per second fell more than tolerance (fraction) below their baseline
+def compare(results, baseline_results, tolerance=0.2):
+    baseline = {_key(result): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        reference = baseline.get(_key(result))
+        if reference is not None and result['calls_per_s'] < (1 - tolerance) * reference['calls_per_s']:
+            regressions.append((result, reference))
+    return regressions
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None)
+    parser.add_argument('--maps', nargs='+', type=int, default=[0, 1])
+    parser.add_argument('--actors', nargs='+', type=int, default=[2, 8, 32])
+    parser.add_argument('--repeat_scale', help='scale the number of calls of every case', type=float, default=1.0)
+    parser.add_argument('--out', help='write the results to this json file', default=None)
+    parser.add_argument('--baseline', help='compare with the results in this json file', default=None)
+    parser.add_argument('--tolerance', help='allowed drop in calls per second', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args.cases, args.maps, args.actors, args.repeat_scale)
+    if args.out is not None:
+        save_results(args.out, results)
+
+    if args.baseline is not None:
+        baseline_results = load_results(args.baseline)
+        regressions = compare(results, baseline_results, args.tolerance)
+        print('{0} regressions against {1}'.format(len(regressions), args.baseline))
+        for result, reference in regressions:
+            print(format_result(result, reference))
+        sys.exit(1 if regressions else 0)
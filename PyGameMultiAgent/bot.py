@@ -1,57 +1,101 @@
+import argparse
 import random
-import socket
 import pygame
 import signal
 import select
 from math import atan2, degrees, radians
 import sys
-from baselines.PyGameMultiAgent.staticworld import StaticWorld
+import numpy as np
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent import shmtransport
+
+# escape_policy_batch moves, same numbering as the zombie actions of ZombieChasePlayerEnv
+MOVE_FORWARD, MOVE_IDLE, MOVE_LEFT, MOVE_RIGHT = 0, 1, 2, 3
+
+
+# Bot.dummy_escape_policy for many bots of one world at once.
+# bot_poses: (n, 3) x, y, angle
+# zombies: (n, m, 3) zombie x, y, angle seen by every bot, rows of nan are ignored
+# returns (moves, turn): (n,) MOVE_* and (n,) turn angle in radians for MOVE_LEFT / MOVE_RIGHT
+def escape_policy_batch(world, bot_poses, zombies):
+    bot_poses = np.asarray(bot_poses, dtype=np.float64).reshape(-1, 3)
+    zombies = np.asarray(zombies, dtype=np.float64).reshape(bot_poses.shape[0], -1, 3)
+    n = bot_poses.shape[0]
+    x = bot_poses[:, 0]
+    y = bot_poses[:, 1]
+
+    dir_score = np.zeros((n, 24))
+    zombie_in_sight = np.zeros(n, dtype=bool)
+    offsets = np.arange(-11, 11)
+    rows = np.arange(n)[:, None]
+
+    # zombies are added one after another, same summation order as dummy_escape_policy
+    for z in range(zombies.shape[1]):
+        zx = zombies[:, z, 0]
+        zy = zombies[:, z, 1]
+        present = ~np.isnan(zx)
+        relative_angle = np.degrees(np.arctan2(zy - y, zx - x))
+        relative_angle[relative_angle < 0] += 360  # [0, 360]
+        center_sector = np.where(present, np.round(relative_angle / 15), 0).astype(np.int64)
+        z_distance_sqr = (zx - x) ** 2 + (zy - y) ** 2
+
+        with np.errstate(divide='ignore'):
+            score = 1 / ((np.abs(offsets)[None, :] + 1) * z_distance_sqr[:, None])
+        score[~present] = 0
+        dir_score[rows, (center_sector[:, None] + offsets[None, :]) % 24] -= score
+
+        zombie_in_sight |= present & (z_distance_sqr < Bot.alertRadius * Bot.alertRadius)
+
+    wallDistances = world.rayCastSectors(bot_poses[:, :2])
+    with np.errstate(divide='ignore'):
+        dir_score = np.where(wallDistances < 2, -99999, dir_score - 1 / wallDistances ** 2)
+
+    now_heading_index = np.round(np.degrees(bot_poses[:, 2]) / 15).astype(np.int64) % 24
+    best_index = np.argmax(dir_score, axis=1)
+    heading_is_best = dir_score[np.arange(n), now_heading_index] == dir_score[np.arange(n), best_index]
+
+    moves = np.where(best_index > now_heading_index, MOVE_LEFT, MOVE_RIGHT)
+    moves[heading_is_best] = MOVE_FORWARD
+    moves[~zombie_in_sight] = MOVE_IDLE
+    turn = np.radians(np.abs(best_index - now_heading_index) * 15)
+    return moves, turn
+
 
 class Bot(object):
     alertRadius = 10
+    # seconds recvfrom waits before run checks running again
+    poll_interval = 0.5
 
-    def __init__(self, addr="127.0.0.1", serverport=9009):
+    def __init__(self, addr="127.0.0.1", serverport=9009, wire_protocol=protocol.BINARY, room=None, transport=shmtransport.AUTO):
         self.botport = random.randrange(8000, 8999)
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.conn.bind(("127.0.0.1", self.botport))
+        self.conn = shmtransport.client_socket(addr, self.botport, transport)
         self.addr = addr
         self.serverport = serverport
+        self.wire_protocol = wire_protocol
+        self.room = room
 
         self.read_list = [self.conn]
         self.write_list = []
 
         self.map_index = 0
-        self.world = StaticWorld('../Maps/map_0.csv')
+        self.world = load_world(0)
         self.running = True
 
     def run(self):
-        self.conn.sendto("cb".encode('utf-8'), (self.addr, self.serverport))
+        self.conn.sendto(protocol.connect_message("b", self.wire_protocol, self.room, shmtransport.channel_path(self.conn)).encode('utf-8'), (self.addr, self.serverport))
 
+        self.conn.settimeout(self.poll_interval)
         while self.running:
-            msg, addr = self.conn.recvfrom(2048)
-            msg = msg.decode('utf-8')  # Coordinates of all players
-            AllZombiePose = []
-
-            splitted_msg = msg.split('|')
-            x, y, a, _ = splitted_msg[0].split(',')
-            x = float(x)
-            y = float(y)
-            a = float(a)
-            self_pos = (x, y, a)
-
-            for position in msg.split('|')[1:-1]:
-                x, y, angle, tag = position.split(',')
-                x = float(x)
-                y = float(y)
-                angle = float(angle)
-                tag = int(tag)
-                if tag == 0:
-                    AllZombiePose.append((x, y, angle))
-
-            server_map_index = int(splitted_msg[-1])
+            try:
+                msg, addr = self.conn.recvfrom(2048)
+            except shmtransport.timeout:
+                continue
+            self_pos, others, server_map_index, _ = protocol.decode_update(msg)  # Coordinates of all players
+            AllZombiePose = others[others[:, 3] == 0, :3]
+
             if server_map_index != self.map_index:
-                del self.world
-                self.world = StaticWorld("../Maps/map_{0}.csv".format(server_map_index))
+                self.world = load_world(server_map_index)
                 self.map_index = server_map_index
 
             movement = self.dummy_escape_policy(self_pos, AllZombiePose)
@@ -74,18 +118,17 @@ class Bot(object):
 
             if z_distance_sqr < Bot.alertRadius * Bot.alertRadius:
                 zombie_in_sight = True
-        input()
         if not zombie_in_sight:
             return "ui"
 
+        wallDistances = self.world.rayCastSectors((x, y))[0]
         for s in range(24):
-            wangle = s * 15
-            wallDistance = self.world.rayCastWall((x, y), wangle)
+            wallDistance = wallDistances[s]
 
             if wallDistance < 2:
                 dir_score[s] = -99999
             else:
-                dir_score[s] -= 1 / self.world.rayCastWall((x, y), wangle) ** 2
+                dir_score[s] -= 1 / wallDistance ** 2
 
         now_heading_index = round(degrees(angle) / 15) % 24
 
@@ -105,10 +148,100 @@ class Bot(object):
                 return "ur" + str(angle_diff_rad)
 
 
+# dummy_escape_policy command of every escape_policy_batch move
+def escape_commands(moves, turn):
+    commands = []
+    for move, angle_diff_rad in zip(moves, turn):
+        if move == MOVE_FORWARD:
+            commands.append("uu")
+        elif move == MOVE_IDLE:
+            commands.append("ui")
+        elif move == MOVE_LEFT:
+            commands.append("ul" + str(angle_diff_rad))
+        else:
+            commands.append("ur" + str(angle_diff_rad))
+    return commands
+
+
+class BotPool(object):
+    """
+    count bots driven by one process over one socket (see protocol.py, multiplexing).
+    Every round takes the updates that arrived together and runs escape_policy_batch once per map for those bots.
+    rooms: one room for all bots, or a list with the room of every bot
+    """
+    def __init__(self, count, addr="127.0.0.1", serverport=9009, wire_protocol=protocol.BINARY, rooms=None,
+                 transport=shmtransport.AUTO):
+        self.count = count
+        self.botport = random.randrange(8000, 8999)
+        self.conn = shmtransport.client_socket(addr, self.botport, transport)
+        self.addr = addr
+        self.serverport = serverport
+        self.wire_protocol = wire_protocol
+        self.rooms = rooms if isinstance(rooms, (list, tuple)) else [rooms] * count
+        self.running = True
+
+    def _send(self, slot, msg):
+        self.conn.sendto(protocol.mux_message(slot, msg).encode('utf-8'), (self.addr, self.serverport))
+
+    # the latest update of every bot that has one, waits for the first
+    def _receive_round(self):
+        updates = {}
+        msg, _ = self.conn.recvfrom(65536)
+        self.conn.setblocking(False)
+        try:
+            while True:
+                slot, payload = protocol.decode_mux(msg)
+                updates[slot] = payload
+                msg, _ = self.conn.recvfrom(65536)
+        except BlockingIOError:
+            pass
+        finally:
+            self.conn.setblocking(True)
+        return updates
+
+    def run(self):
+        for slot in range(self.count):
+            self._send(slot, protocol.connect_message("b", self.wire_protocol, self.rooms[slot],
+                                                      shmtransport.channel_path(self.conn)))
+
+        while self.running:
+            updates = self._receive_round()
+
+            by_map = {}
+            for slot, payload in updates.items():
+                self_pos, others, map_index, _ = protocol.decode_update(payload)
+                by_map.setdefault(map_index, []).append((slot, self_pos, others[others[:, 3] == 0, :3]))
+
+            for map_index, bots in by_map.items():
+                zombies = np.full((len(bots), max(len(z) for _, _, z in bots), 3), np.nan)
+                for i, (_, _, bot_zombies) in enumerate(bots):
+                    zombies[i, :len(bot_zombies)] = bot_zombies
+                moves, turn = escape_policy_batch(load_world(map_index), [pos for _, pos, _ in bots], zombies)
+                for (slot, _, _), command in zip(bots, escape_commands(moves, turn)):
+                    self._send(slot, command)
+
+    def disconnect(self):
+        self.running = False
+        for slot in range(self.count):
+            self._send(slot, "d")
+
+
 if __name__ == "__main__":
-    b = Bot()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--room', default=None, help='GameServer room to join')
+    parser.add_argument('--transport', choices=[shmtransport.AUTO, shmtransport.SHM, shmtransport.UDP], default=shmtransport.AUTO)
+    parser.add_argument('--bots', help='drive this many bots from this process (BotPool)', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.bots > 1:
+        b = BotPool(args.bots, rooms=args.room, transport=args.transport)
+    else:
+        b = Bot(room=args.room, transport=args.transport)
 
     def term_sig_handler(signum, frame):
+        if isinstance(b, BotPool):
+            b.disconnect()
+            return
         b.running = False
         b.conn.sendto("d".encode('utf-8'), (b.addr, b.serverport))
 
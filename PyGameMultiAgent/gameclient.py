@@ -4,7 +4,7 @@ import socket
 import select
 import random
 import numpy as np
-from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent.mapstore import load_world
 
 
 class GameClient(object):
@@ -23,7 +23,7 @@ class GameClient(object):
 
     def setup_pygame(self):
 
-        self.world = StaticWorld('../Maps/map_1.csv')
+        self.world = load_world(1)
 
         self.screen = pygame.display.set_mode((self.world.local_width * self.world.zoom, self.world.local_length * self.world.zoom))
 
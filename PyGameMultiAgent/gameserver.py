@@ -1,9 +1,20 @@
 import socket
 import select
+import asyncio
+import argparse
 from math import pi as PI
 from math import cos, sin, atan2
 import numpy as np
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent import shmtransport
+from baselines.PyGameMultiAgent.shmtransport import Channel
+from baselines.PyGameMultiAgent.sessionlog import SessionLogWriter, read_session_log
+from baselines.PyGameMultiAgent.serverstats import ServerStats
+from baselines.PyGameMultiAgent.reward import calculate_reward_batch
+from baselines.PyGameMultiAgent.spatialhash import SpatialHash
 from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent.bot import Bot
 import pygame
 import pygame.locals
 import time
@@ -12,39 +23,173 @@ import sys
 # Messages:
 #  Client->Server
 #   One or two characters. First character is the command:
-#     c: connect
+#     c: connect, followed by z (zombie) or b (bot), optionally ":bin" for binary updates, "@<room>"
+#        and "!<channel path>" for the shared memory transport of clients on this host
+#     r: reset the room of the sender
 #     u: update position
 #     d: disconnect
 #   Second character only applies to position and specifies direction (udlr)
 #
 #  Server->Client
-#   '|' delimited pairs of positions to draw the players (there is no
-#     distinction between the players - not even the client knows where its
-#     player is.
+#   Poses of all players and the map index, text or binary (see protocol.py).
+#   Zombies on the obs protocol also get their radar observation, reward and done, computed by observe_rooms.
 
 # pos: x,y,angle,tag (tag==0: zombie_model, tag==1:bot)
 
-class GameServer(object):
-    map_count = 2
-
-    def __init__(self, port=9009, visualize = True):
-        print(time.asctime(time.localtime(time.time())))
-
-        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # Bind to localhost - set to external ip to connect from other computers
-        self.listener.bind(("127.0.0.1", port))
-        self.read_list = [self.listener]
-        self.write_list = []
+# Picks start poses (x, y, angle) for player_count players inside one random quadrant of world,
+# at least 8 grids (manhattan) apart. The other quadrants are tried if the players do not fit.
+# Returns None if they fit in none of them.
+#
+# Samples the free cells of world.spawn_points without replacement: every accepted point rules out the points
+# too close to it at once, so this takes at most one pass over the quadrant.
+def place_players(world, player_count, rng=np.random):
+    first = rng.randint(0, 2) * 2 + rng.randint(0, 2)
+    for quadrant in [first] + [q for q in rng.permutation(4) if q != first]:
+        points = world.spawn_points[quadrant]
+        blocked = np.zeros(len(points), dtype=bool)
+        start_position = []
+
+        for i in rng.permutation(len(points)):
+            if len(start_position) == player_count:
+                break
+            if blocked[i]:
+                continue
+            x, y = points[i]
+            start_position.append((x, y))
+            blocked |= np.abs(points[:, 0] - x) + np.abs(points[:, 1] - y) < 8
+
+        if len(start_position) == player_count:
+            angles = rng.random_sample(player_count) * 2 * PI
+            return [(int(x), int(y), angle) for (x, y), angle in zip(start_position, angles)]
+    return None
+
+
+# (map_index, world, start poses) for player_count players on a random map out of map_count.
+# Every map is tried at most once, ValueError if the players fit on none.
+def spawn(player_count, map_count, rng=np.random):
+    for map_index in rng.permutation(map_count):
+        world = load_world(int(map_index))
+        start_position = place_players(world, player_count, rng)
+        if start_position is not None:
+            return int(map_index), world, start_position
+    raise ValueError('{0} players do not fit on any of the {1} maps'.format(player_count, map_count))
+
+
+# Radar observation, reward and done (ZombieChasePlayerEnv.step) of every obs protocol zombie in rooms,
+# in one batched pass per map, stored in room.players_obs.
+# The reward is measured from room.last_poses, the poses of the last broadcast; it is 0 without them (after a reset
+# or for a new player), and for rewards=False (reply to a reset).
+# Only the actors within OBSERVE_RADIUS of a zombie (room.actors) take part, which gives the same observation
+# and reward as long as nobody moves more than Bot.alertRadius per broadcast.
+OBSERVE_RADIUS = StaticWorld.perception_grids + Bot.alertRadius
+
+
+def observe_rooms(rooms, rewards=True):
+    groups = {}
+    for room in rooms:
+        room.players_obs = {}
+        zombies = [player for player, pose in room.players_pose.items()
+                   if pose[3] == 0 and room.players_protocol.get(player) == protocol.OBS]
+        if zombies:
+            groups.setdefault(room.map_index, []).append((room, zombies))
+
+    for map_index, members in groups.items():
+        # neighborhoods of different size are padded with nan actors, which the batch functions ignore
+        neighborhoods = []
+        for room, zombies in members:
+            keys, poses = room.actors.neighbors([room.players_pose[zombie][:2] for zombie in zombies], OBSERVE_RADIUS)
+            neighborhoods.append((room, zombies, keys, poses))
+        actor_count = max(poses.shape[1] for _, _, _, poses in neighborhoods)
+
+        self_poses, actors, last_self_poses, last_actors, owners = [], [], [], [], []
+        for room, zombies, keys, poses in neighborhoods:
+            for zombie, neighbor_keys, neighbor_poses in zip(zombies, keys, poses):
+                actor_poses = np.full((actor_count, 4), np.nan)
+                actor_poses[:len(neighbor_poses)] = neighbor_poses
+                last_poses = np.full((actor_count, 4), np.nan)
+                if rewards and room.last_poses is not None:
+                    for i, player in enumerate(neighbor_keys):
+                        if player in room.last_poses:
+                            last_poses[i] = room.last_poses[player]
+
+                i = neighbor_keys.index(zombie)
+                self_poses.append(actor_poses[i, :3])
+                last_self_poses.append(last_poses[i, :3])
+                actors.append(actor_poses)
+                last_actors.append(last_poses)
+                owners.append((room, zombie))
+
+        world = members[0][0].world
+        obs = world.to_local_radar_obs_batch(self_poses, actors)
+        with np.errstate(invalid='ignore'):
+            rew, done = calculate_reward_batch(self_poses, actors, last_self_poses, last_actors)
+        has_last = ~np.isnan(np.asarray(last_self_poses)[:, 0])
+        rew[~has_last] = 0
+        done[~has_last] = False
+
+        for i, (room, zombie) in enumerate(owners):
+            room.players_obs[zombie] = (obs[i], rew[i], done[i])
+
+
+# One match: its own world, map index, players and reset cycle.
+# next_seed: returns the seed of every start pose draw (see GameServer._next_seed), np.random is used without it
+class Room(object):
+    def __init__(self, room_id, map_count, next_seed=None):
+        self.room_id = room_id
+        self.map_count = map_count
+        self.next_seed = next_seed
 
         self.players_pose = {}
         self.players_ready = {}
         self.players_reward = {}
+        self.players_protocol = {}
+        self.tick = 0
+
+        # obs protocol, see observe_rooms
+        self.players_obs = {}
+        self.last_poses = None
+
+        # request seq of the last command applied and the last update sent, by player (see protocol.py, requests)
+        self.players_ack = {}
+        self.last_updates = {}
+
+        # lock-step: when the first player got ready after the last broadcast (ServerStats ready_wait)
+        self.first_ready = None
+
+        # run_ticked only
+        self.pending_moves = {}
+        self.last_moves = {}
 
         self.map_index = 0
-        self.world = StaticWorld('../Maps/map_0.csv')
+        self.world = load_world(0)
 
-        self.screen = pygame.display.set_mode((self.world.zoom * self.world.length, self.world.zoom * self.world.width)) \
-            if sys.platform.startswith('win') and visualize else None
+        # players_pose by position, kept in sync with it
+        self.actors = SpatialHash(cell_size=StaticWorld.perception_grids)
+
+    # False if the room is full: its players and this one fit on no map (see spawn), it is not added then
+    def add_player(self, addr, kind, wire_protocol):
+        if kind == "z": # New Connection from zombie (model)
+            self.players_pose[addr] = (0, 0, 0, 0)
+        else:
+            self.players_pose[addr] = (0, 0, 0, 1)
+
+        if not self.init_players_pose():
+            del self.players_pose[addr]
+            return False
+        self.players_protocol[addr] = wire_protocol
+        self.players_ready[addr] = True
+        return True
+
+    def remove_player(self, addr):
+        del self.players_pose[addr]
+        del self.players_ready[addr]
+        self.actors.remove(addr)
+        self.players_protocol.pop(addr, None)
+        self.players_reward.pop(addr, None)
+        self.pending_moves.pop(addr, None)
+        self.last_moves.pop(addr, None)
+        self.players_ack.pop(addr, None)
+        self.last_updates.pop(addr, None)
 
     # mv is in format [l/r/u][(optional)float]
     def do_movement(self, move, player):
@@ -88,139 +233,488 @@ class GameServer(object):
             self.players_pose[player] = (pos[0], pos[1], angle, pos[3])
 
         else:  # stand idle
-            pass
+            return
 
-    def init_players_pose(self):
-        while True:
-            self.map_index = np.random.randint(0, self.map_count)
-            del self.world
-            self.world = StaticWorld("../Maps/map_{0}.csv".format(self.map_index))
-            section_x = [(0, self.world.width // 2), (self.world.width // 2, self.world.width)][np.random.randint(0, 2)]
-            section_y = [(0, self.world.length // 2), (self.world.length // 2, self.world.length)][np.random.randint(0, 2)]
-
-            start_position = []
-
-            for p in range(len(self.players_pose)):
-                trial_cnt = 0
-                while trial_cnt < 5:
-                    new_pose = (np.random.randint(*section_x), np.random.randint(*section_y), np.random.random() * 2 * PI)
-
-                    if self.world[(new_pose[0], new_pose[1])] == 1:
-                        continue
-
-                    noncollision = True
-                    for existing_pose in start_position:
-                        if abs(existing_pose[0] - new_pose[0]) + abs(existing_pose[1] - new_pose[1]) < 8:
-                            noncollision = False
-                            break
-
-                    if noncollision:
-                        start_position.append(new_pose)
-                        break
-
-                    trial_cnt += 1
-
-                # If cannot find a suitable location for a new player, move to new map
-                if trial_cnt == 5:
-                    break
-
-            # If all playerStarts are ready, break from main loop
-            if len(start_position) == len(self.players_pose):
-                for k in zip(self.players_pose.keys(), start_position):
-                    self.players_pose[k[0]] = *(k[1]), self.players_pose[k[0]][3]
-                break
+        self.actors.update(player, self.players_pose[player])
 
-    def _send_to_client(self, addr = None):
-        if addr is not None:
-            send = []
-            for pos in list(self.players_pose):
-                if pos == addr:
-                    send.insert(0, "{0},{1},{2},{3}".format(*self.players_pose[pos]))
+    # False if the players fit on no map (see spawn), they keep their poses then
+    def init_players_pose(self):
+        rng = np.random.RandomState(self.next_seed()) if self.next_seed is not None else np.random
+        try:
+            self.map_index, self.world, start_position = spawn(len(self.players_pose), self.map_count, rng)
+        except ValueError:
+            return False
+        for k in zip(self.players_pose.keys(), start_position):
+            self.players_pose[k[0]] = *(k[1]), self.players_pose[k[0]][3]
+            self.actors.update(k[0], self.players_pose[k[0]])
+        self.last_poses = None
+        return True
+
+    # [(payload, addr)] of a broadcast to every player, or of the reply to addr only
+    def updates(self, addr = None):
+        players = list(self.players_pose)
+        self_index = {player: i for i, player in enumerate(players)}
+        poses = [self.players_pose[player] for player in players]
+        body = None
+
+        updates = []
+        for player in ([addr] if addr is not None else players):
+            wire_protocol = self.players_protocol.get(player)
+            if wire_protocol in (protocol.BINARY, protocol.OBS) and player in self_index:
+                if body is None:
+                    body = protocol.encode_poses(poses)
+                ack = self.players_ack.get(player, 0)
+                if player in self.players_obs:
+                    payload = protocol.encode_obs_update(body, self.tick, self.map_index, self_index[player],
+                                                         *self.players_obs[player], ack=ack)
                 else:
-                    send.append("{0},{1},{2},{3}".format(*self.players_pose[pos]))
+                    payload = protocol.encode_update(body, self.tick, self.map_index, self_index[player], ack)
+            else:
+                payload = protocol.encode_text_update(poses, self_index.get(player), self.map_index)
+            self.last_updates[player] = payload
+            updates.append((payload, player))
+
+        if addr is None:
+            self.tick += 1
+            self.last_poses = dict(self.players_pose)
+        return updates
+
+    # Movements of one fixed-rate tick, see GameServer.tick_once
+    def apply_moves(self, missed_tick='repeat'):
+        for player in list(self.players_pose):
+            move = self.pending_moves.pop(player, None)
+            if move is None:
+                if missed_tick != 'repeat' or player not in self.last_moves:
+                    continue
+                move = (self.last_moves[player], None)
+
+            msg_mv, msg_rew = move
+            self.do_movement(msg_mv, player)
+            self.last_moves[player] = msg_mv
+            if msg_rew is not None:
+                self.players_reward[player] = float(msg_rew)
+
+        self.pending_moves.clear()
+
+
+# Hosts any number of independent rooms (matches) on one socket.
+# A client joins a room with its connect message (see protocol.py), without one it joins DEFAULT_ROOM.
+# record: path of a session log (see sessionlog.py) to write, port=None: no socket and no channels (replay)
+# stats_interval: seconds between dumps of the ServerStats (see serverstats.py) with baselines.logger, 0 for never
+class GameServer(object):
+    map_count = 2
+
+    def __init__(self, port=9009, visualize = True, record=None, stats_interval=0):
+        print(time.asctime(time.localtime(time.time())))
 
-            send.append(str(self.map_index))
-            self.listener.sendto('|'.join(send).encode('utf-8'), addr)
+        if port is not None:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Bind to localhost - set to external ip to connect from other computers
+            self.listener.bind(("127.0.0.1", port))
+            self.read_list = [self.listener]
         else:
-            for player in list(self.players_pose):
-                send = []
-                for pos in list(self.players_pose):
-                    if player == pos:
-                        send.insert(0, "{0},{1},{2},{3}".format(*self.players_pose[pos]))
+            self.listener = None
+            self.read_list = []
+        self.write_list = []
+
+        self.rooms = {}
+        self.player_room = {}
+
+        # shared memory clients, the channel path is their address
+        self.channels = {}
+
+        # run_ticked only
+        self.transport = None
+        self.loop = None
+        self.tick_task = None
+        self.tick_count = 0
+
+        # session log, and the recorded seeds during a replay
+        self.log = SessionLogWriter(record) if record is not None else None
+        self.replay_seeds = None
+
+        self.stats = ServerStats()
+        self.stats_interval = stats_interval
+        # run returns once this is False, see stop
+        self.running = True
+        self.stats_dumped = time.time()
+
+        world = load_world(0)
+        self.screen = pygame.display.set_mode((world.zoom * world.length, world.zoom * world.width)) \
+            if sys.platform.startswith('win') and visualize else None
+
+    def room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = Room(room_id, self.map_count, self._next_seed)
+            self.rooms[room_id] = room
+        return room
+
+    def _next_seed(self):
+        if self.replay_seeds is not None:
+            return self.replay_seeds.popleft()
+        seed = int(np.random.randint(1 << 32, dtype=np.int64))
+        if self.log is not None:
+            self.log.seed(self.tick_count, seed)
+        return seed
+
+    # makes run or run_ticked return, from another thread
+    def stop(self):
+        self.running = False
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._cancel_tick_task)
+            except RuntimeError:  # run_ticked returned and closed it meanwhile
+                pass
+        elif self.listener is not None and self.listener.fileno() != -1:
+            # an empty datagram wakes up the select of run
+            waker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            waker.sendto(b'', self.listener.getsockname())
+            waker.close()
+
+    def _cancel_tick_task(self):
+        if self.tick_task is not None:
+            self.tick_task.cancel()
+
+    # releases the port and the channels, after run returned
+    def close(self):
+        for path in list(self.channels):
+            self._close_channel(path)
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            self.read_list = []
+        self.close_log()
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def dump_stats_if_due(self):
+        if self.stats_interval > 0 and time.time() - self.stats_dumped >= self.stats_interval:
+            self.stats.dump()
+            self.stats_dumped = time.time()
+
+    def _sendto(self, payload, addr):
+        self.stats.update_sent(addr, time.perf_counter())
+        self.stats.count('updates')
+        if isinstance(addr, protocol.MuxAddr):
+            payload = protocol.encode_mux(addr.slot, payload)
+            addr = addr.addr
+        channel = self.channels.get(addr)
+        if channel is not None:
+            channel.send(payload)
+        elif self.listener is not None:
+            (self.transport or self.listener).sendto(payload, addr)
+
+    def _send_to_client(self, room, addr = None):
+        start = time.perf_counter()
+        observe_rooms([room], rewards=addr is None)
+        observed = time.perf_counter()
+        updates = room.updates(addr)
+        self.stats.add('observe', observed - start)
+        self.stats.add('serialize', time.perf_counter() - observed)
+        for payload, player in updates:
+            self._sendto(payload, player)
+
+    # False if path is not a client's channel or attaching to it failed
+    def _open_channel(self, path):
+        if path in self.channels or self.listener is None:  # without a socket (replay) replies are dropped anyway
+            return True
+        if not shmtransport.is_channel_path(path):
+            return False
+        try:
+            channel = Channel(path, is_server=True)
+        except OSError as e:
+            print("Cannot attach to channel {0}: {1}".format(path, e))
+            return False
+        channel.unlink()
+        self.channels[path] = channel
+        if self.loop is not None:
+            self.loop.add_reader(channel.fileno(), self._read_channel, channel)
+        else:
+            self.read_list.append(channel)
+        return True
+
+    def _close_channel(self, path):
+        channel = self.channels.pop(path)
+        if self.loop is not None:
+            self.loop.remove_reader(channel.fileno())
+        else:
+            self.read_list.remove(channel)
+        channel.close()
+
+    def _read_channel(self, channel):
+        for msg in channel.receive_all():
+            if channel.path not in self.channels:  # disconnected
+                break
+            self.handle_message(msg.decode('utf-8'), channel.path, lockstep=self.loop is None)
+
+    def handle_message(self, msg, addr, lockstep=True):
+        received = time.perf_counter()
+        if not isinstance(addr, protocol.MuxAddr):
+            self.stats.count('datagrams')
+            if self.log is not None:
+                self.log.message(self.tick_count, addr, msg, lockstep)
+
+        if len(msg) >= 1:
+            cmd = msg[0]
+            if cmd == "m":  # one of several players behind addr, see BotPool
+                slot, msg = protocol.parse_mux(msg)
+                self.handle_message(msg, protocol.MuxAddr(addr, slot), lockstep)
+                return
+
+            room = self.player_room.get(addr)
+            if cmd != "c" and room is not None:
+                msg, request_seq = protocol.parse_request(msg)
+                if request_seq is not None:
+                    last = room.players_ack.get(addr)
+                    if last is not None and protocol.request_seq_diff(last, request_seq) <= 0:
+                        # a retry: the client lost the update that answered it, an older request is dropped
+                        if request_seq == last and addr in room.last_updates:
+                            self._sendto(room.last_updates[addr], addr)
+                        return
+                    room.players_ack[addr] = request_seq
+            if room is not None:
+                self.stats.command_received(addr, received)
+            self.stats.add('parse', time.perf_counter() - received)
+
+            if cmd == "c":  # New Connection
+                kind, wire_protocol, room_id, channel = protocol.parse_connect(msg)
+                if channel is not None:
+                    addr = protocol.MuxAddr(channel, addr.slot) if isinstance(addr, protocol.MuxAddr) else channel
+                    room = self.player_room.get(addr)
+                if room is not None:
+                    # a reconnect through the channel keeps it, its files are gone since the first connect
+                    self._remove_player(addr, close_channel=channel is None)
+                if channel is not None and not self._open_channel(channel):
+                    print("Rejected connect with channel {0}".format(channel))
+                    return
+                room = self.room(room_id)
+                start = time.perf_counter()
+                added = room.add_player(addr, kind, wire_protocol)  # places every player of the room anew
+                self.stats.add('init_pose', time.perf_counter() - start)
+                if not added:
+                    print("Rejected connect of {0}, room {1} is full".format(addr, room_id))
+                    if not room.players_pose:
+                        del self.rooms[room_id]
+                    if channel is not None:
+                        self._close_channel_if_unused(channel)
+                    return
+                self.player_room[addr] = room
+            elif cmd == "u":
+                # Movement Update  ul0.3|0.5
+                # left 0.3, reward 0.5
+                if len(msg) >= 2 and room is not None:
+                    if "|" in msg:
+                        msg_mv, msg_rew = msg[1:].split('|')
+                    else:
+                        msg_mv = msg[1:]
+                        msg_rew = None
+
+                    if lockstep:
+                        start = time.perf_counter()
+                        room.do_movement(msg_mv, addr)
+                        self.stats.add('movement', time.perf_counter() - start)
+                        room.players_ready[addr] = True
+                        if room.first_ready is None:
+                            room.first_ready = start
+                        if msg_rew is not None:
+                            room.players_reward[addr] = float(msg_rew)
                     else:
-                        send.append("{0},{1},{2},{3}".format(*self.players_pose[pos]))
-                send.append(str(self.map_index))
-                self.listener.sendto('|'.join(send).encode('utf-8'), player)
+                        # applied with everybody else's at the next tick, latest command wins
+                        room.pending_moves[addr] = (msg_mv, msg_rew)
+
+            elif cmd == "d":  # Player Quitting
+                if room is not None:
+                    self._remove_player(addr)
+                    room = None
+            elif cmd == "r":
+                # only re-randomizes the room of the sender, an unknown sender has none (rooms come from "c")
+                if room is not None:
+                    start = time.perf_counter()
+                    if not room.init_players_pose():
+                        print("Room {0} could not be placed anew, it keeps its poses".format(room.room_id))
+                    self.stats.add('init_pose', time.perf_counter() - start)
+                    self._send_to_client(room, addr)
+            else:
+                print ("Unexpected: {0}".format(msg))
+
+            if lockstep and room is not None:
+                allready = all(elem for elem in room.players_ready.values())
+                if allready:
+                    if room.first_ready is not None:
+                        # addr was the last player the room waited for
+                        self.stats.ready_wait(room.first_ready, addr, time.perf_counter())
+                        room.first_ready = None
+                    self._send_to_client(room)
+                    room.players_ready = dict.fromkeys(room.players_ready, False)
+
+    def _remove_player(self, addr, close_channel=True):
+        room = self.player_room.pop(addr)
+        room.remove_player(addr)
+        self.stats.forget(addr)
+        if not room.players_pose:
+            del self.rooms[room.room_id]
+
+        if close_channel:
+            self._close_channel_if_unused(addr.addr if isinstance(addr, protocol.MuxAddr) else addr)
+
+    # closes the channel at path once none of its players is left
+    def _close_channel_if_unused(self, path):
+        if path in self.channels and not any(player == path or (isinstance(player, protocol.MuxAddr) and player.addr == path)
+                                             for player in self.player_room):
+            self._close_channel(path)
+
+    # draws the default room
+    def _update_screen(self):
+        room = self.rooms.get(protocol.DEFAULT_ROOM)
+        if room is not None:
+            room.world.draw_global(self.screen, room.players_pose, room.players_reward)
+            pygame.display.update()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or event.type == pygame.locals.QUIT:
+                pygame.quit()
 
     def run(self):
         last_updated_time = time.time()
         try:
-            while True:
-
-                if self.screen is not None:
-                    if time.time() - last_updated_time > 0.03:
-                        self.world.draw_global(self.screen, self.players_pose, self.players_reward)
-                        pygame.display.update()
-                        last_updated_time = time.time()
-
-                    for event in pygame.event.get():
-                        if event.type == pygame.QUIT or event.type == pygame.locals.QUIT:
-                            pygame.quit()
+            while self.running:
 
-                    pygame.display.update()
+                if self.screen is not None and time.time() - last_updated_time > 0.03:
+                    self._update_screen()
+                    last_updated_time = time.time()
 
                 readable, writable, exceptional = (
-                    select.select(self.read_list, self.write_list, [])
+                    select.select(self.read_list, self.write_list, [], self.stats_interval or None)
                 )
+                self.dump_stats_if_due()
                 for f in readable:
                     if f is self.listener:
                         msg, addr = f.recvfrom(2048)
-                        msg = msg.decode('utf-8')
-                        if len(msg) >= 1:
-                            cmd = msg[0]
-                            if cmd == "c":  # New Connection
-                                if msg[1] == "z": # New Connection from zombie (model)
-                                    self.players_pose[addr] = (0, 0, 0, 0)
-                                else:
-                                    self.players_pose[addr] = (0, 0, 0, 1)
-
-                                self.players_ready[addr] = True
-                                self.init_players_pose()
-                            elif cmd == "u":
-                                # Movement Update  ul0.3|0.5
-                                # left 0.3, reward 0.5
-                                if len(msg) >= 2 and addr in self.players_pose:
-                                    if "|" in msg:
-                                        msg_mv, msg_rew = msg[1:].split('|')
-                                    else:
-                                        msg_mv = msg[1:]
-                                        msg_rew = None
-
-                                    self.do_movement(msg_mv, addr)
-                                    self.players_ready[addr] = True
-                                    if msg_rew is not None:
-                                        self.players_reward[addr] = float(msg_rew)
-
-                            elif cmd == "d":  # Player Quitting
-                                if addr in self.players_pose:
-                                    del self.players_pose[addr]
-                                    del self.players_ready[addr]
-                            elif cmd == "r":
-                                self.init_players_pose()
-                                self._send_to_client(addr)
-                            else:
-                                print ("Unexpected: {0}".format(msg))
-
-                            allready = all(elem for elem in self.players_ready.values())
-                            if allready:
-                                self._send_to_client()
-                                self.players_ready = dict.fromkeys(self.players_ready, False)
+                        self.handle_message(msg.decode('utf-8'), addr)
+                    elif f.path in self.channels:
+                        self._read_channel(f)
 
 
         except KeyboardInterrupt as e:
             pass
+        finally:
+            self.close_log()
+
+    # One fixed-rate tick of every room: applies the movement commands received since the last tick as one batch,
+    # then broadcasts once. A player without a command repeats its last movement (missed_tick='repeat')
+    # or stands still (missed_tick='idle').
+    def tick_once(self, missed_tick='repeat'):
+        if self.log is not None:
+            self.log.tick(self.tick_count, missed_tick)
+        self.tick_count += 1
+        self.stats.count('ticks')
+        rooms = list(self.rooms.values())
+        start = time.perf_counter()
+        for room in rooms:
+            room.apply_moves(missed_tick)
+        moved = time.perf_counter()
+        observe_rooms(rooms)
+        observed = time.perf_counter()
+        updates = [room.updates() for room in rooms]
+        self.stats.add('movement', moved - start)
+        self.stats.add('observe', observed - moved)
+        self.stats.add('serialize', time.perf_counter() - observed)
+        for room_updates in updates:
+            for payload, player in room_updates:
+                self._sendto(payload, player)
+
+    # asyncio server mode: does not wait for every player (players_ready), the rooms advance at tick_rate
+    # ticks per second and slow clients are handled by missed_tick, see tick_once.
+    # Runs its own event loop, so it may run on any thread.
+    def run_ticked(self, tick_rate=30, missed_tick='repeat'):
+        loop = asyncio.new_event_loop()
+        self.transport, _ = loop.run_until_complete(
+            loop.create_datagram_endpoint(lambda: TickedServerProtocol(self), sock=self.listener))
+        self.loop = loop
+        for channel in self.channels.values():
+            self.read_list.remove(channel)
+            loop.add_reader(channel.fileno(), self._read_channel, channel)
+        self.tick_task = loop.create_task(self._tick_loop(loop, 1 / tick_rate, missed_tick))
+        try:
+            loop.run_until_complete(self.tick_task)
+        except (KeyboardInterrupt, asyncio.CancelledError) as e:
+            pass
+        finally:
+            for channel in self.channels.values():
+                loop.remove_reader(channel.fileno())
+                self.read_list.append(channel)
+            self.loop = None
+            self.tick_task = None
+            self.transport.close()
+            self.transport = None
+            loop.run_until_complete(asyncio.sleep(0))  # lets the transport finish closing
+            loop.close()
+            self.close_log()
+
+    async def _tick_loop(self, loop, interval, missed_tick):
+        next_tick = loop.time()
+        while self.running:
+            self.tick_once(missed_tick)
+            self.dump_stats_if_due()
+            if self.screen is not None:
+                self._update_screen()
+
+            # fixed rate, a tick that overran is not made up for
+            next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+
+
+# Re-drives a GameServer with the session log at path as fast as possible, without sockets or clients.
+# Returns the server, whose rooms end up with the poses of the recorded session.
+def replay(path, visualize=False):
+    events, seeds = read_session_log(path)
+    server = GameServer(port=None, visualize=visualize)
+    server.replay_seeds = seeds
+    for event in events:
+        if event[0] == 'message':
+            _, _, addr, msg, lockstep = event
+            server.handle_message(msg, addr, lockstep)
+        else:
+            server.tick_once(event[2])
+        if server.screen is not None:
+            server._update_screen()
+    return server
+
+
+class TickedServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_message(data.decode('utf-8'), addr, lockstep=False)
 
 
 if __name__ == "__main__":
-    g = GameServer()
-    g.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tick_rate', help='run the asyncio server at this fixed tick rate instead of lock-step', type=float, default=0)
+    parser.add_argument('--missed_tick', help='what a player without a command does in a tick', choices=['repeat', 'idle'], default='repeat')
+    parser.add_argument('--record', help='write a session log to this path', default=None)
+    parser.add_argument('--stats_interval', help='seconds between server stats dumps (baselines.logger), 0 for none', type=float, default=0)
+    parser.add_argument('--replay', help='replay this session log at full speed and exit', default=None)
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        start = time.time()
+        g = replay(args.replay)
+        elapsed = time.time() - start
+        print('replayed {0} in {1:.3f}s, final poses:'.format(args.replay, elapsed))
+        for room_id, room in sorted(g.rooms.items()):
+            print(room_id, room.tick, list(room.players_pose.values()))
+        g.stats.dump()
+        sys.exit(0)
+
+    g = GameServer(record=args.record, stats_interval=args.stats_interval)
+    if args.tick_rate > 0:
+        g.run_ticked(args.tick_rate, args.missed_tick)
+    else:
+        g.run()
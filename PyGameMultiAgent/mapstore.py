@@ -0,0 +1,161 @@
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+from baselines.PyGameMultiAgent.staticworld import StaticWorld, load_csv_map
+
+# Compiled map archive
+#   All Maps/map_<index>.csv packed into one file, so that a map switch does not parse csv.
+#   The archive is memory-mapped: every process on the box shares the same pages.
+#
+#   layout (little endian):
+#     header   MAGIC, uint32 map count, uint32 csv file count, uint64 newest csv mtime (ns)
+#     index    map count * (uint64 payload offset, uint32 rows, uint32 cols), position == map index
+#     payload  np.packbits of every map's row-major wall grid
+#
+#   MapStore rebuilds the archive when the csv files in maps_dir changed since it was compiled
+#   (count or newest mtime differs from the header). To rebuild by hand:
+#     python -m baselines.PyGameMultiAgent.mapstore [maps_dir]
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Maps')
+ARCHIVE_NAME = 'maps.bin'
+MAGIC = b'ZCMAPS02'
+
+_header_dtype = np.dtype([('magic', 'S8'), ('count', '<u4'), ('csv_count', '<u4'), ('csv_mtime_ns', '<u8')])
+_index_dtype = np.dtype([('offset', '<u8'), ('rows', '<u4'), ('cols', '<u4')])
+
+
+def map_csv_path(map_index, maps_dir=MAPS_DIR):
+    return os.path.join(maps_dir, 'map_{0}.csv'.format(map_index))
+
+
+def _csv_indices(maps_dir):
+    return sorted(int(f[len('map_'):-len('.csv')]) for f in os.listdir(maps_dir)
+                  if f.startswith('map_') and f.endswith('.csv'))
+
+
+# (csv file count, newest csv mtime in ns) of maps_dir, what an archive is checked against
+def _sources_stamp(maps_dir):
+    indices = _csv_indices(maps_dir)
+    mtime_ns = max([os.stat(map_csv_path(i, maps_dir)).st_mtime_ns for i in indices], default=0)
+    return len(indices), mtime_ns
+
+
+def _read_header(archive_path):
+    with open(archive_path, 'rb') as f:
+        raw = f.read(_header_dtype.itemsize)
+    if len(raw) < _header_dtype.itemsize:
+        return None
+    return np.frombuffer(raw, dtype=_header_dtype)[0]
+
+
+# whether the archive is missing, of another version, or older than the csv files of maps_dir
+def archive_is_stale(archive_path, maps_dir=MAPS_DIR):
+    if not os.path.exists(archive_path):
+        return True
+    header = _read_header(archive_path)
+    if header is None or header['magic'] != MAGIC:
+        return True
+    if not os.path.isdir(maps_dir):  # an archive shipped without its sources
+        return False
+    return (int(header['csv_count']), int(header['csv_mtime_ns'])) != _sources_stamp(maps_dir)
+
+
+def compile_maps(maps_dir=MAPS_DIR, archive_path=None):
+    archive_path = archive_path or os.path.join(maps_dir, ARCHIVE_NAME)
+    # stamped before reading, an edit while compiling makes the archive stale
+    csv_count, csv_mtime_ns = _sources_stamp(maps_dir)
+    indices = _csv_indices(maps_dir)
+    count = indices[-1] + 1 if indices else 0
+
+    header = np.zeros(1, dtype=_header_dtype)
+    header['magic'] = MAGIC
+    header['count'] = count
+    header['csv_count'] = csv_count
+    header['csv_mtime_ns'] = csv_mtime_ns
+    index = np.zeros(count, dtype=_index_dtype)
+
+    payload = []
+    offset = _header_dtype.itemsize + _index_dtype.itemsize * count
+    for map_index in indices:
+        data = load_csv_map(map_csv_path(map_index, maps_dir))
+        packed = np.packbits(data.ravel())
+        index[map_index] = (offset, data.shape[0], data.shape[1])
+        payload.append(packed)
+        offset += packed.nbytes
+
+    # write next to the target and rename, so concurrent readers never see a partial archive
+    tmp_path = '{0}.{1}.tmp'.format(archive_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(index.tobytes())
+        for packed in payload:
+            f.write(packed.tobytes())
+    os.replace(tmp_path, archive_path)
+    return archive_path
+
+
+class MapStore(object):
+    # cache_size: number of decoded StaticWorld instances kept (least recently used are dropped)
+    def __init__(self, archive_path=None, maps_dir=MAPS_DIR, cache_size=32):
+        self.maps_dir = maps_dir
+        self.archive_path = archive_path or os.path.join(maps_dir, ARCHIVE_NAME)
+        if archive_is_stale(self.archive_path, maps_dir):
+            compile_maps(maps_dir, self.archive_path)
+
+        self.archive = np.memmap(self.archive_path, dtype=np.uint8, mode='r')
+        header = np.frombuffer(self.archive, dtype=_header_dtype, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError('{0} is not a compiled map archive'.format(self.archive_path))
+        self.index = np.frombuffer(self.archive, dtype=_index_dtype, count=int(header['count']),
+                                   offset=_header_dtype.itemsize)
+
+        self.cache_size = cache_size
+        self.worlds = OrderedDict()
+
+    def __len__(self):
+        return len(self.index)
+
+    # 0/1 wall grid of a map, decoded from the archive
+    def data(self, map_index):
+        if not 0 <= map_index < len(self.index) or self.index[map_index]['rows'] == 0:
+            raise KeyError('map {0} is not in {1}'.format(map_index, self.archive_path))
+        offset, rows, cols = (int(v) for v in self.index[map_index])
+        nbytes = (rows * cols + 7) // 8
+        packed = self.archive[offset:offset + nbytes]
+        return np.unpackbits(packed, count=rows * cols).reshape(rows, cols)
+
+    # sector_table: a world with its sector table built (see StaticWorld.build_sector_table), cached apart
+    # from the one without
+    def world(self, map_index, sector_table=False):
+        key = (map_index, bool(sector_table))
+        world = self.worlds.get(key)
+        if world is None:
+            world = StaticWorld(data=self.data(map_index), sector_table=sector_table)
+            self.worlds[key] = world
+            if len(self.worlds) > self.cache_size:
+                self.worlds.popitem(last=False)
+        else:
+            self.worlds.move_to_end(key)
+        return world
+
+
+_store = None
+
+
+# process wide MapStore over MAPS_DIR
+def get_map_store():
+    global _store
+    if _store is None:
+        _store = MapStore()
+    return _store
+
+
+# shared, cached StaticWorld of Maps/map_<map_index>.csv. Do not modify it.
+# sector_table: answer rayCastSectors from the per-cell table, built here rather than on a hot path
+def load_world(map_index, sector_table=False):
+    return get_map_store().world(map_index, sector_table)
+
+
+if __name__ == "__main__":
+    print(compile_maps(*sys.argv[1:2]))
@@ -0,0 +1,179 @@
+import struct
+from collections import namedtuple
+import numpy as np
+
+# Server->Client pose updates
+#
+#  text (legacy, handy for debugging)
+#   '|' delimited "x,y,angle,tag" of every player, the receiving player first, then the map index.
+#
+#  binary
+#   header_dtype followed by count * (x, y, angle, tag) float64, little endian.
+#   The poses are in players_pose order for every receiver, only self_index differs,
+#   so the server packs them once per tick.
+#
+#  obs (zombies only)
+#   binary update with OBS_MAGIC, followed by obs_dtype: the server side radar observation, reward and done
+#   of the receiver, so the client neither loads maps nor computes them.
+#
+#  A client picks the protocol when connecting: "cz" / "cb" is text, "cz:bin" / "cb:bin" is binary, "cz:obs" is obs.
+#  It may add "@<room>" to join a room other than DEFAULT_ROOM, e.g. "cz:bin@3",
+#  and "!<channel path>" to talk to a server on the same host through shared memory (see shmtransport.py).
+
+# Requests (ZombieChasePlayerEnv)
+#   A client command may end with "#<request seq>", e.g. "uu|0.5#17": the server applies every request seq once,
+#   answers a repeated one with the last update it sent to that player, and puts the request seq of the last
+#   command it applied in the 'ack' field of the binary updates (uint16, wraps around). So a client can retry a
+#   command after a timeout and tell the update that answers it from older ones.
+
+# Multiplexing (BotPool): many players behind one socket
+#   Client->Server "m<slot>:<message>", e.g. "m3:ul0.5", Server->Client MUX_MAGIC, uint16 slot, then the update.
+#   The server tells the players apart by MuxAddr(addr, slot).
+
+TEXT = 'text'
+BINARY = 'bin'
+OBS = 'obs'
+
+DEFAULT_ROOM = '0'
+
+MAGIC = b'ZC'
+OBS_MAGIC = b'ZO'
+MUX_MAGIC = b'ZM'
+# 2: the header field after count carries ack (padding in 1)
+VERSION = 2
+
+header_dtype = np.dtype([('magic', 'S2'), ('version', 'u1'), ('reserved', 'u1'), ('seq', '<u4'),
+                         ('map_index', '<u2'), ('self_index', '<u2'), ('count', '<u2'), ('ack', '<u2')])
+_header_struct = struct.Struct('<2sBBIHHHH')
+assert _header_struct.size == header_dtype.itemsize
+
+# radar_length is StaticWorld.radar_length
+def obs_dtype(radar_length):
+    return np.dtype([('reward', '<f8'), ('done', 'u1'), ('pad', 'S7'), ('obs', '<f8', (radar_length,))])
+
+
+# "cz:bin@3" -> ('z', 'bin', '3', None), "cz!/dev/shm/x" -> ('z', 'text', '0', '/dev/shm/x')
+def parse_connect(msg):
+    rest, _, channel = msg[1:].partition('!')
+    rest, _, room = rest.partition('@')
+    kind, _, wire_protocol = rest.partition(':')
+    return kind, wire_protocol or TEXT, room or DEFAULT_ROOM, channel or None
+
+
+def connect_message(kind, wire_protocol=TEXT, room=None, channel=None):
+    msg = 'c' + kind
+    if wire_protocol != TEXT:
+        msg += ':' + wire_protocol
+    if room is not None:
+        msg += '@{0}'.format(room)
+    if channel is not None:
+        msg += '!' + channel
+    return msg
+
+
+def is_connect(msg):
+    return msg[:1] in ('c', b'c') or (msg[:1] in ('m', b'm') and parse_mux(msg)[1][:1] in ('c', b'c'))
+
+
+MuxAddr = namedtuple('MuxAddr', ['addr', 'slot'])
+_mux_struct = struct.Struct('<2sH')
+
+
+def mux_message(slot, msg):
+    return 'm{0}:{1}'.format(slot, msg)
+
+
+# "m3:ul0.5" -> (3, 'ul0.5'), str or bytes
+def parse_mux(msg):
+    slot, inner = msg[1:].split(':' if isinstance(msg, str) else b':', 1)
+    return int(slot), inner
+
+
+def encode_mux(slot, payload):
+    return _mux_struct.pack(MUX_MAGIC, slot) + payload
+
+
+# returns (slot, payload)
+def decode_mux(msg):
+    _, slot = _mux_struct.unpack_from(msg)
+    return slot, msg[_mux_struct.size:]
+
+
+# poses: sequence of (x, y, angle, tag), packed once per tick
+def encode_poses(poses):
+    return np.asarray(poses, dtype='<f8').reshape(-1, 4).tobytes()
+
+
+def encode_update(body, seq, map_index, self_index, ack=0):
+    count = len(body) // 32
+    return _header_struct.pack(MAGIC, VERSION, 0, seq & 0xFFFFFFFF, map_index, self_index, count, ack & 0xFFFF) + body
+
+
+def encode_obs_update(body, seq, map_index, self_index, obs, reward, done, ack=0):
+    count = len(body) // 32
+    extra = np.zeros(1, dtype=obs_dtype(len(obs)))
+    extra['reward'] = reward
+    extra['done'] = done
+    extra['obs'] = np.ravel(obs)
+    return _header_struct.pack(OBS_MAGIC, VERSION, 0, seq & 0xFFFFFFFF, map_index, self_index, count, ack & 0xFFFF) + \
+        body + extra.tobytes()
+
+
+def encode_text_update(poses, self_index, map_index):
+    send = ["{0},{1},{2},{3}".format(*pos) for pos in poses]
+    if self_index is not None:
+        send.insert(0, send.pop(self_index))
+    send.append(str(map_index))
+    return '|'.join(send).encode('utf-8')
+
+
+# returns (self_pos, others, map_index, seq)
+#   self_pos: (x, y, angle), others: (n, 4) array of the other players, seq: None for text updates
+def decode_update(msg):
+    if msg[:2] in (MAGIC, OBS_MAGIC):
+        header = np.frombuffer(msg, dtype=header_dtype, count=1)[0]
+        if header['version'] != VERSION:
+            raise ValueError('unsupported protocol version {0}'.format(header['version']))
+        poses = np.frombuffer(msg, dtype='<f8', count=int(header['count']) * 4, offset=header_dtype.itemsize).reshape(-1, 4)
+        self_index = int(header['self_index'])
+        self_pos = tuple(poses[self_index, :3].tolist())
+        others = np.delete(poses, self_index, axis=0)
+        return self_pos, others, int(header['map_index']), int(header['seq'])
+
+    splitted_msg = msg.decode('utf-8').split('|')
+    x, y, a, _ = splitted_msg[0].split(',')
+    self_pos = (float(x), float(y), float(a))
+    others = np.asarray([[float(v) for v in position.split(',')] for position in splitted_msg[1:-1]],
+                        dtype=np.float64).reshape(-1, 4)
+    return self_pos, others, int(splitted_msg[-1]), None
+
+
+# request seq acknowledged by a binary update, None for text updates
+def decode_ack(msg):
+    if msg[:2] in (MAGIC, OBS_MAGIC):
+        return _header_struct.unpack_from(msg)[7]
+    return None
+
+
+def request_message(msg, request_seq):
+    return '{0}#{1}'.format(msg, request_seq & 0xFFFF)
+
+
+# "uu|0.5#17" -> ('uu|0.5', 17), "uu" -> ('uu', None)
+def parse_request(msg):
+    msg, sep, request_seq = msg.partition('#')
+    return msg, (int(request_seq) if sep else None)
+
+
+# how far request seq b is ahead of a, negative if it is behind, modulo the uint16 wrap around
+def request_seq_diff(a, b):
+    return (b - a + 0x8000) % 0x10000 - 0x8000
+
+
+# returns (obs, reward, done) of an obs update, obs: (radar_length, 1)
+def decode_obs(msg):
+    header = np.frombuffer(msg, dtype=header_dtype, count=1)[0]
+    offset = header_dtype.itemsize + int(header['count']) * 32
+    radar_length = (len(msg) - offset - 16) // 8
+    extra = np.frombuffer(msg, dtype=obs_dtype(radar_length), count=1, offset=offset)[0]
+    return extra['obs'].reshape(-1, 1), float(extra['reward']), bool(extra['done'])
@@ -0,0 +1,82 @@
+import numpy as np
+from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent.bot import Bot
+
+# Zombie rewards, shared by ZombieChasePlayerEnv, GameServer (obs protocol) and ZombieChaseSimulator.
+# Kept apart from MyEnv.py so that the server does not need gym.
+
+# Nearest bot (tag 1) of every pose.
+# self_poses: (n, 3), actors: (n, m, 4), rows of nan are ignored
+# returns (distance, target index, has target); distance is 10000 without target like _get_closest_bot_distance
+def closest_bot_batch(self_poses, actors):
+    if actors.shape[1] == 0:
+        return np.full(len(self_poses), 10000.0), np.zeros(len(self_poses), dtype=np.int64), np.zeros(len(self_poses), dtype=bool)
+    dist_sqr = (actors[:, :, 0] - self_poses[:, 0:1]) ** 2 + (actors[:, :, 1] - self_poses[:, 1:2]) ** 2
+    dist_sqr = np.where(actors[:, :, 3] == 1, dist_sqr, np.inf)
+    target = dist_sqr.argmin(axis=1)
+    closest_dist_sqr = dist_sqr[np.arange(len(self_poses)), target]
+    has_target = closest_dist_sqr < 100000000
+    return np.sqrt(np.where(has_target, closest_dist_sqr, 100000000)), target, has_target
+
+
+# How far along me->target the other zombies close to the target are (_projection_blocking_distance),
+# for the nearest bot of closest_bot_batch. Returns (n,), 0 without target or if it is beyond perception_grids.
+def projection_blocking_distance_batch(self_poses, actors, distance, target, has_target, perception_grids=StaticWorld.perception_grids):
+    n = self_poses.shape[0]
+    if actors.shape[1] == 0:
+        return np.zeros(n)
+
+    x = self_poses[:, 0:1]
+    y = self_poses[:, 1:2]
+    target_actor = actors[np.arange(n), target]
+    target_x = target_actor[:, 0:1]
+    target_y = target_actor[:, 1:2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        me_to_target_x = target_x - x
+        me_to_target_y = target_y - y
+        me_to_target_norm = np.sqrt(me_to_target_x * me_to_target_x + me_to_target_y * me_to_target_y)
+        unit_x = me_to_target_x / me_to_target_norm
+        unit_y = me_to_target_y / me_to_target_norm
+
+        actor_to_target_x = target_x - actors[:, :, 0]
+        actor_to_target_y = target_y - actors[:, :, 1]
+        actor_to_target_norm = np.sqrt(actor_to_target_x * actor_to_target_x + actor_to_target_y * actor_to_target_y)
+        actor_proj_len = unit_x * actor_to_target_x + unit_y * actor_to_target_y
+
+        blocking = (actors[:, :, 3] == 0) & ((actors[:, :, 0] != x) | (actors[:, :, 1] != y)) & \
+                   (actor_to_target_norm < Bot.alertRadius) & \
+                   (0 < actor_proj_len) & (actor_proj_len < distance[:, None])
+    blocked_distance = np.where(blocking, actor_proj_len, 0).max(axis=1)
+    return np.where((distance > perception_grids) | ~has_target, 0, blocked_distance)
+
+
+# ZombieChasePlayerEnv._calculate_reward for a batch of zombies, see closest_bot_batch for the layout.
+# The zombie itself may be part of actors, it is skipped by position like in _projection_blocking_distance.
+# returns (rew, done), (n,) each
+def calculate_reward_batch(self_poses, actors, last_self_poses, last_actors, perception_grids=StaticWorld.perception_grids):
+    self_poses = np.asarray(self_poses, dtype=np.float64).reshape(-1, 3)
+    n = self_poses.shape[0]
+    actors = np.asarray(actors, dtype=np.float64).reshape(n, -1, 4)
+    last_self_poses = np.asarray(last_self_poses, dtype=np.float64).reshape(n, 3)
+    last_actors = np.asarray(last_actors, dtype=np.float64).reshape(n, -1, 4)
+
+    old_distance, _, _ = closest_bot_batch(last_self_poses, last_actors)
+    curr_distance, target, has_target = closest_bot_batch(self_poses, actors)
+
+    # reward for approaching target
+    approaching = (np.maximum(old_distance, curr_distance) < perception_grids) & (curr_distance < old_distance)
+    rew = np.where(approaching, (old_distance - curr_distance) * 0.01, 0)
+
+    # reward for staying near
+    near = curr_distance < Bot.alertRadius
+    if near.any():
+        blocked_distance = projection_blocking_distance_batch(self_poses, actors, curr_distance, target, has_target, perception_grids)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            near_rew = 2 / np.maximum(2, curr_distance) * (curr_distance - blocked_distance) / curr_distance
+        rew = np.where(near, rew + near_rew, rew)
+
+    # reward for catching
+    done = curr_distance < 2
+    rew = np.where(done, rew + 10, rew)
+
+    return rew, done
@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict, defaultdict
+from baselines import logger
+
+# GameServer instrumentation
+#   Counters and latency histograms of one stats interval, cheap enough to stay on all the time: a histogram
+#   is a fixed array of power of two microsecond buckets, recording a sample is a bit_length and an increment.
+#   summary() turns them into (numeric) key-values, dump() writes those with baselines.logger, logs who the
+#   stragglers are and starts a new interval.
+#
+#   GameServer timers (seconds):
+#     parse             decoding a datagram and its command up to the dispatch
+#     movement          do_movement of one command (lock-step) or apply_moves of one tick
+#     init_pose         init_players_pose of a room (connect or reset)
+#     observe           observe_rooms
+#     serialize         encoding the updates of a broadcast or reply
+#     ready_wait        lock-step: first player ready after a broadcast until the last one, per broadcast
+#     client_rtt        update sent to a client until its next command
+
+
+class Histogram(object):
+    bucket_count = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # seconds
+    def add(self, value):
+        self.buckets[min(int(value * 1e6).bit_length(), self.bucket_count - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # upper bound of the bucket holding quantile q, capped by the largest sample
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+
+class ServerStats(object):
+    # straggler_count: how many of the slowest clients (by mean client_rtt) summary() and dump() list
+    def __init__(self, straggler_count=3):
+        self.straggler_count = straggler_count
+        # update sent, not yet answered, by client
+        self.sent_at = {}
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        # per client (sum, count) of client_rtt, and times it was the last player a lock-step room waited for
+        self.client_rtt = defaultdict(lambda: [0.0, 0])
+        self.last_ready = defaultdict(int)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add(self, name, seconds):
+        self.histograms[name].add(seconds)
+
+    def update_sent(self, client, now):
+        self.sent_at[client] = now
+
+    def command_received(self, client, now):
+        sent = self.sent_at.pop(client, None)
+        if sent is not None:
+            rtt = now - sent
+            self.histograms['client_rtt'].add(rtt)
+            totals = self.client_rtt[client]
+            totals[0] += rtt
+            totals[1] += 1
+
+    def forget(self, client):
+        self.sent_at.pop(client, None)
+
+    def ready_wait(self, first_ready, last_client, now):
+        self.histograms['ready_wait'].add(now - first_ready)
+        self.last_ready[last_client] += 1
+
+    def summary(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        kvs = OrderedDict()
+        kvs['interval_s'] = elapsed
+        for name, n in sorted(self.counters.items()):
+            kvs[name] = n
+            kvs[name + '_per_s'] = n / elapsed
+        for name, histogram in sorted(self.histograms.items()):
+            kvs[name + '_count'] = histogram.count
+            kvs[name + '_mean_ms'] = histogram.mean() * 1e3
+            kvs[name + '_p50_ms'] = histogram.percentile(50) * 1e3
+            kvs[name + '_p99_ms'] = histogram.percentile(99) * 1e3
+            kvs[name + '_max_ms'] = histogram.max * 1e3
+
+        for i, (_, rtt, waited) in enumerate(self.stragglers()):
+            kvs['straggler{0}_rtt_ms'.format(i)] = rtt * 1e3
+            kvs['straggler{0}_count'.format(i)] = waited
+        return kvs
+
+    # [(client, mean client_rtt in seconds, times the room waited for it last)] of the slowest clients
+    def stragglers(self):
+        slowest = sorted(self.client_rtt.items(), key=lambda item: -item[1][0] / item[1][1])
+        return [(client, total / n, self.last_ready.get(client, 0))
+                for client, (total, n) in slowest[:self.straggler_count]]
+
+    # writes summary() with baselines.logger under prefix and starts a new interval
+    def dump(self, prefix='server/'):
+        for i, (client, _, _) in enumerate(self.stragglers()):
+            logger.log('{0}straggler{1}: {2}'.format(prefix, i, client))
+        for key, value in self.summary().items():
+            logger.logkv(prefix + key, value)
+        logger.dumpkvs()
+        self.reset()
@@ -0,0 +1,99 @@
+import struct
+from collections import deque
+
+# GameServer session log
+#   Everything a GameServer run depends on: the inbound messages in arrival order, the fixed-rate ticks
+#   and the seeds of the start pose draws (Room.init_players_pose). Replaying it (gameserver.replay)
+#   reproduces the pose trajectories of the session exactly, without sockets or clients.
+#
+#   layout (little endian): MAGIC, uint8 version, then records appended as the session goes
+#     record header  uint8 kind, uint8 flags, uint32 address id, uint32 tick, uint16 payload length
+#     ADDRESS  a new sender: flags 1 for a UDP (host, port) address as "host:port", 0 for a channel path
+#     MESSAGE  payload is the message, flags 1 if it was handled in lock-step
+#     TICK     one GameServer.tick_once, flags 1 for missed_tick='idle'
+#     SEED     payload is the uint32 seed of the next init_players_pose
+#   tick is the number of GameServer.tick_once calls before the record (0 for a lock-step server).
+
+MAGIC = b'ZR'
+# 2: uint32 address ids (uint16 in 1), every reconnecting shm client is a new sender
+VERSION = 2
+
+ADDRESS, MESSAGE, TICK, SEED = range(4)
+
+_file_header = struct.Struct('<2sB')
+_record = struct.Struct('<BBIIH')
+_seed = struct.Struct('<I')
+
+
+def _format_address(addr):
+    if isinstance(addr, tuple):
+        return 1, '{0}:{1}'.format(*addr).encode('utf-8')
+    return 0, addr.encode('utf-8')
+
+
+def _parse_address(flags, payload):
+    text = payload.decode('utf-8')
+    if flags == 1:
+        host, port = text.rsplit(':', 1)
+        return host, int(port)
+    return text
+
+
+class SessionLogWriter(object):
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(_file_header.pack(MAGIC, VERSION))
+        self.address_ids = {}
+
+    def _write(self, kind, flags, address_id, tick, payload=b''):
+        self.f.write(_record.pack(kind, flags, address_id, tick, len(payload)))
+        self.f.write(payload)
+
+    def message(self, tick, addr, msg, lockstep):
+        address_id = self.address_ids.get(addr)
+        if address_id is None:
+            address_id = len(self.address_ids)
+            self.address_ids[addr] = address_id
+            flags, payload = _format_address(addr)
+            self._write(ADDRESS, flags, address_id, tick, payload)
+        self._write(MESSAGE, int(lockstep), address_id, tick, msg.encode('utf-8'))
+
+    def tick(self, tick, missed_tick):
+        self._write(TICK, int(missed_tick == 'idle'), 0, tick)
+
+    def seed(self, tick, seed):
+        self._write(SEED, 0, 0, tick, _seed.pack(seed))
+
+    def close(self):
+        self.f.close()
+
+
+# (events, seeds) of a session log: events in order, ('message', tick, addr, msg, lockstep) or
+# ('tick', tick, missed_tick), seeds a deque of the init_players_pose seeds in the order they were drawn
+def read_session_log(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version = _file_header.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('{0} is not a version {1} session log'.format(path, VERSION))
+
+    addresses = {}
+    events = []
+    seeds = deque()
+    pos = _file_header.size
+    while pos + _record.size <= len(data):
+        kind, flags, address_id, tick, length = _record.unpack_from(data, pos)
+        payload = data[pos + _record.size:pos + _record.size + length]
+        if len(payload) < length:  # cut off by a crash, ignore the partial record
+            break
+        pos += _record.size + length
+
+        if kind == ADDRESS:
+            addresses[address_id] = _parse_address(flags, payload)
+        elif kind == MESSAGE:
+            events.append(('message', tick, addresses[address_id], payload.decode('utf-8'), bool(flags)))
+        elif kind == TICK:
+            events.append(('tick', tick, 'idle' if flags else 'repeat'))
+        elif kind == SEED:
+            seeds.append(_seed.unpack(payload)[0])
+    return events, seeds
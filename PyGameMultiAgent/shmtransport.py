@@ -0,0 +1,305 @@
+import os
+import mmap
+import uuid
+import errno
+import struct
+import socket
+import select
+import tempfile
+import time
+import weakref
+from baselines.PyGameMultiAgent import protocol
+
+# Shared memory transport between GameServer and the clients on its host.
+#
+#  A client creates a channel: one file in /dev/shm holding two single producer / single consumer byte rings
+#  (client->server "up", server->client "down") plus a fifo per direction as doorbell, and connects over UDP
+#  as usual with "!<channel path>" appended to the connect message (see protocol.py). Everything after the
+#  connect goes through the rings: the payloads are never truncated and never go through the socket stack,
+#  the doorbell is a one byte write the receiver can block on or select() / add_reader().
+#
+#  Like UDP a message is dropped if the receiving ring is full.
+#  Needs mkfifo and Linux fifo semantics (O_RDWR open), UDP is used elsewhere.
+#
+#  The server only attaches to CHANNEL_PREFIX files directly in the shared memory directory and unlinks them once
+#  attached (the open descriptors and the mapping stay valid), a client that dies before that leaves them behind
+#  until the next client of the host sweeps them: the name carries the pid of the creator.
+
+UDP = 'udp'
+SHM = 'shm'
+AUTO = 'auto'
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+RING_CAPACITY = 1 << 16
+
+CHANNEL_PREFIX = 'zombiechase-'
+
+# raised by recvfrom of either client socket when its timeout runs out
+timeout = socket.timeout
+
+# ring: head (written by the producer) and tail (written by the consumer) on their own cache lines, then the data.
+# Both grow monotonically, a record is a u32 length followed by the payload, PAD_RECORD skips to the ring start.
+_index = struct.Struct('<Q')
+_length = struct.Struct('<I')
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+DATA_OFFSET = 128
+PAD_RECORD = 0xFFFFFFFF
+
+
+def available():
+    return hasattr(os, 'mkfifo') and os.name == 'posix'
+
+
+def is_local(host):
+    return host in LOCAL_HOSTS
+
+
+def _shm_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+# whether a server may attach to path: a channel file of a client, not anything a connect message names
+def is_channel_path(path):
+    name = os.path.basename(path)
+    return (os.path.dirname(path) == _shm_dir() and name.startswith(CHANNEL_PREFIX)
+            and not name.endswith(('.up', '.down')) and os.path.isfile(path) and not os.path.islink(path))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink_channel(path):
+    for name in (path, path + '.up', path + '.down'):
+        try:
+            os.unlink(name)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+# removes the channel files of clients that died before a server attached
+def sweep_stale_channels():
+    directory = _shm_dir()
+    for name in os.listdir(directory):
+        if not name.startswith(CHANNEL_PREFIX) or name.endswith(('.up', '.down')):
+            continue
+        pid = name[len(CHANNEL_PREFIX):].split('-', 1)[0]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            try:
+                _unlink_channel(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+class Ring(object):
+    def __init__(self, buf, offset, capacity):
+        self.buf = buf
+        self.offset = offset
+        self.capacity = capacity
+        self.data = offset + DATA_OFFSET
+
+    def _get(self, which):
+        return _index.unpack_from(self.buf, self.offset + which)[0]
+
+    def _set(self, which, value):
+        _index.pack_into(self.buf, self.offset + which, value)
+
+    # returns False if msg does not fit in the free space
+    def push(self, msg):
+        head, tail = self._get(HEAD_OFFSET), self._get(TAIL_OFFSET)
+        pos = head % self.capacity
+        size = _length.size + len(msg)
+        pad = self.capacity - pos if pos + size > self.capacity else 0
+        if head + pad + size - tail > self.capacity:
+            return False
+
+        if pad:
+            if pad >= _length.size:
+                _length.pack_into(self.buf, self.data + pos, PAD_RECORD)
+            head += pad
+            pos = 0
+        _length.pack_into(self.buf, self.data + pos, len(msg))
+        self.buf[self.data + pos + _length.size:self.data + pos + size] = msg
+        # publish after the payload is written
+        self._set(HEAD_OFFSET, head + size)
+        return True
+
+    # returns None if the ring is empty
+    def pop(self):
+        head, tail = self._get(HEAD_OFFSET), self._get(TAIL_OFFSET)
+        if tail == head:
+            return None
+
+        pos = tail % self.capacity
+        if self.capacity - pos < _length.size or _length.unpack_from(self.buf, self.data + pos)[0] == PAD_RECORD:
+            tail += self.capacity - pos
+            pos = 0
+        length = _length.unpack_from(self.buf, self.data + pos)[0]
+        start = self.data + pos + _length.size
+        msg = self.buf[start:start + length]
+        self._set(TAIL_OFFSET, tail + _length.size + length)
+        return msg
+
+
+class Channel(object):
+    """
+    One client's pair of rings. The client creates it (create=True) and removes the files on close,
+    the server attaches to it by path. send / receive are from the point of view of is_server.
+    """
+    def __init__(self, path, is_server, create=False, capacity=RING_CAPACITY):
+        self.path = path
+        self.is_server = is_server
+
+        if create:
+            with open(path, 'wb') as f:
+                f.truncate(2 * (DATA_OFFSET + capacity))
+            os.mkfifo(path + '.up')
+            os.mkfifo(path + '.down')
+        # the capacity of an existing channel is whatever its creator picked
+        with open(path, 'r+b') as f:
+            self.buf = mmap.mmap(f.fileno(), 0)
+        ring_size = len(self.buf) // 2
+        capacity = ring_size - DATA_OFFSET
+
+        up, down = Ring(self.buf, 0, capacity), Ring(self.buf, ring_size, capacity)
+        # O_RDWR: opening never blocks on the other end and the fifo never reports EOF
+        up_fd = os.open(path + '.up', os.O_RDWR)
+        down_fd = os.open(path + '.down', os.O_RDWR)
+        if is_server:
+            self.inbound, self.outbound = up, down
+            self.bell_in, self.bell_out = up_fd, down_fd
+            os.set_blocking(self.bell_in, False)
+        else:
+            self.inbound, self.outbound = down, up
+            self.bell_in, self.bell_out = down_fd, up_fd
+        os.set_blocking(self.bell_out, False)
+
+    def fileno(self):
+        return self.bell_in
+
+    def send(self, msg):
+        if not self.outbound.push(msg):
+            return False
+        try:
+            os.write(self.bell_out, b'\0')
+        except (BlockingIOError, InterruptedError):
+            # the receiver has not caught up with the doorbells, it will find the message anyway
+            pass
+        return True
+
+    # blocks until a message arrives (client side), socket.timeout after timeout seconds
+    def receive(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            msg = self.inbound.pop()
+            if msg is not None:
+                return msg
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self.bell_in], [], [], remaining)[0]:
+                    raise socket.timeout('timed out')
+            os.read(self.bell_in, 1)
+
+    # every message received so far, without blocking (server side, after select / add_reader)
+    def receive_all(self):
+        try:
+            os.read(self.bell_in, 4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+        msgs = []
+        msg = self.inbound.pop()
+        while msg is not None:
+            msgs.append(msg)
+            msg = self.inbound.pop()
+        return msgs
+
+    def close(self):
+        if self.buf is None:
+            return
+        os.close(self.bell_in)
+        os.close(self.bell_out)
+        self.buf.close()
+        self.buf = None
+        if not self.is_server:
+            self.unlink()
+
+    # removes the files, the channel keeps working for whoever has it open
+    def unlink(self):
+        _unlink_channel(self.path)
+
+
+class ShmClientSocket(object):
+    """
+    Client end of a Channel with the part of the UDP socket interface the clients use:
+    connect messages go to the server over UDP, everything else through the channel.
+    """
+    def __init__(self, udp):
+        self.udp = udp
+        sweep_stale_channels()
+        name = '{0}{1}-{2}'.format(CHANNEL_PREFIX, os.getpid(), uuid.uuid4().hex)
+        self.channel = Channel(os.path.join(_shm_dir(), name), is_server=False, create=True)
+        self.server = None
+        self.timeout = None
+        # removes the files at exit of clients that are never closed (bots)
+        weakref.finalize(self, self.channel.close)
+
+    @property
+    def channel_path(self):
+        return self.channel.path
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def sendto(self, data, addr):
+        self.server = addr
+        if protocol.is_connect(data):
+            return self.udp.sendto(data, addr)
+        self.channel.send(data)
+        return len(data)
+
+    # same meaning as for a socket: None blocks, 0.0 is non-blocking
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0.0
+
+    # like socket.recvfrom: BlockingIOError if non-blocking and there is no message, socket.timeout after the timeout
+    def recvfrom(self, bufsize):
+        if self.timeout == 0.0:
+            msg = self.channel.inbound.pop()
+            if msg is None:
+                raise BlockingIOError
+            return msg, self.server
+        return self.channel.receive(self.timeout), self.server
+
+    def close(self):
+        self.channel.close()
+        self.udp.close()
+
+
+# UDP socket bound to port, or a ShmClientSocket on top of it if transport picks shared memory.
+# transport: AUTO (shared memory if server_host is local and the platform supports it), SHM or UDP
+def client_socket(server_host, port, transport=AUTO):
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.bind(("127.0.0.1", port))
+    if transport == SHM or (transport == AUTO and available() and is_local(server_host)):
+        return ShmClientSocket(udp)
+    return udp
+
+
+# channel path for the connect message, None for plain UDP
+def channel_path(conn):
+    return getattr(conn, 'channel_path', None)
@@ -0,0 +1,163 @@
+from math import pi as PI
+import numpy as np
+from gym.spaces.box import Box
+from gym.spaces.discrete import Discrete
+from baselines.common.vec_env import VecEnv
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent.staticworld import StaticWorld
+from baselines.PyGameMultiAgent.gameserver import GameServer, spawn
+from baselines.PyGameMultiAgent.bot import escape_policy_batch, MOVE_FORWARD, MOVE_LEFT, MOVE_RIGHT
+from baselines.PyGameMultiAgent.reward import calculate_reward_batch
+
+# Headless ZombieChase: n_worlds independent matches stepped together without GameServer, Bot processes or sockets.
+# Every world holds n_zombies agent controlled zombies followed by n_bots bots running the escape policy.
+# poses: (n_worlds, n_zombies + n_bots, 4) x, y, angle, tag like the server's players_pose
+
+
+class ZombieChaseSimulator(object):
+    # default step sizes of GameServer.do_movement
+    zombie_forward = 1
+    bot_forward = 1.5
+    turn = 0.5
+
+    def __init__(self, n_worlds, n_zombies=1, n_bots=1, map_count=GameServer.map_count, seed=None):
+        self.n_worlds = n_worlds
+        self.n_zombies = n_zombies
+        self.n_bots = n_bots
+        self.map_count = map_count
+        self.rng = np.random.RandomState(seed)
+
+        self.poses = np.zeros((n_worlds, n_zombies + n_bots, 4))
+        self.poses[:, n_zombies:, 3] = 1
+        self.map_index = np.zeros(n_worlds, dtype=np.int64)
+
+    # GameServer.init_players_pose for every world in worlds (default all)
+    def reset(self, worlds=None):
+        worlds = range(self.n_worlds) if worlds is None else worlds
+        for w in worlds:
+            map_index, _, start_position = spawn(self.poses.shape[1], self.map_count, self.rng)
+            self.map_index[w] = map_index
+            self.poses[w, :, :3] = start_position
+
+    # worlds grouped by map: [(world, array of world indices)]
+    def world_groups(self):
+        return [(load_world(m), np.flatnonzero(self.map_index == m)) for m in np.unique(self.map_index)]
+
+    # zombie_actions: (n_worlds, n_zombies) ZombieChasePlayerEnv actions, bots pick theirs from the current poses
+    def step(self, zombie_actions):
+        moves = np.empty(self.poses.shape[:2], dtype=np.int64)
+        stepsize = np.empty(self.poses.shape[:2])
+        moves[:, :self.n_zombies] = np.asarray(zombie_actions).reshape(self.n_worlds, self.n_zombies)
+        stepsize[:, :self.n_zombies] = np.where(moves[:, :self.n_zombies] == MOVE_FORWARD, self.zombie_forward, self.turn)
+
+        groups = self.world_groups()
+        if self.n_bots > 0:
+            for world, worlds in groups:
+                bots = self.poses[worlds, self.n_zombies:, :3].reshape(-1, 3)
+                zombies = np.repeat(self.poses[worlds, :self.n_zombies, :3], self.n_bots, axis=0)
+                bot_moves, turn = escape_policy_batch(world, bots, zombies)
+                bot_moves = bot_moves.reshape(len(worlds), self.n_bots)
+                moves[worlds, self.n_zombies:] = bot_moves
+                stepsize[worlds, self.n_zombies:] = np.where(bot_moves == MOVE_FORWARD, self.bot_forward,
+                                                             turn.reshape(len(worlds), self.n_bots))
+
+        self.do_movement(moves, stepsize, groups)
+
+    # GameServer.do_movement for every actor of every world
+    def do_movement(self, moves, stepsize, groups):
+        x = self.poses[:, :, 0]
+        y = self.poses[:, :, 1]
+        angle = self.poses[:, :, 2]
+
+        for world, worlds in groups:
+            forward = moves[worlds] == MOVE_FORWARD
+            _x = np.clip(x[worlds] + stepsize[worlds] * np.cos(angle[worlds]), 0, world.width)
+            _y = np.clip(y[worlds] + stepsize[worlds] * np.sin(angle[worlds]), 0, world.length)
+            forward &= ~world.is_wall(_x, _y)
+            x[worlds] = np.where(forward, _x, x[worlds])
+            y[worlds] = np.where(forward, _y, y[worlds])
+
+        left = angle + stepsize
+        left[left > 2 * PI] -= 2 * PI
+        right = angle - stepsize
+        right[right < 0] += 2 * PI
+        self.poses[:, :, 2] = np.where(moves == MOVE_LEFT, left, np.where(moves == MOVE_RIGHT, right, angle))
+
+    # (n_worlds * n_zombies, radar_length, 1) radar observation of every zombie
+    def observations(self):
+        obs = np.zeros((self.n_worlds, self.n_zombies, StaticWorld.radar_blocks * 2, 1))
+        for world, worlds in self.world_groups():
+            zombies = self.poses[worlds, :self.n_zombies, :3].reshape(-1, 3)
+            actors = np.repeat(self.poses[worlds], self.n_zombies, axis=0)
+            obs[worlds] = world.to_local_radar_obs_batch(zombies, actors).reshape(len(worlds), self.n_zombies, -1, 1)
+        return obs.reshape(self.n_worlds * self.n_zombies, -1, 1)
+
+    # (n_worlds * n_zombies, height, width, 3) ZombieChasePlayerEnv.render('rgb_array') frame of every zombie
+    def frames(self):
+        frames = None
+        for world, worlds in self.world_groups():
+            zombies = self.poses[worlds, :self.n_zombies, :3].reshape(-1, 3)
+            actors = np.repeat(self.poses[worlds], self.n_zombies, axis=0)
+            group_frames = world.to_local_rgb_batch(zombies, actors)
+            if frames is None:
+                frames = np.zeros((self.n_worlds, self.n_zombies) + group_frames.shape[1:], dtype=np.uint8)
+            frames[worlds] = group_frames.reshape((len(worlds), self.n_zombies) + group_frames.shape[1:])
+        return frames.reshape((-1,) + frames.shape[2:])
+
+    # ZombieChasePlayerEnv._calculate_reward of every zombie, between last_poses and the current poses
+    # returns (rew, done), (n_worlds * n_zombies,) each
+    def rewards(self, last_poses):
+        zombies = self.poses[:, :self.n_zombies, :3].reshape(-1, 3)
+        last_zombies = last_poses[:, :self.n_zombies, :3].reshape(-1, 3)
+        actors = np.repeat(self.poses, self.n_zombies, axis=0)
+        last_actors = np.repeat(last_poses, self.n_zombies, axis=0)
+        return calculate_reward_batch(zombies, actors, last_zombies, last_actors)
+
+
+class ZombieChaseVecEnv(VecEnv):
+    """
+    ZombieChasePlayerEnv for num_envs zombies, simulated in process by ZombieChaseSimulator.
+
+    A world is reset as soon as one of its zombies catches a bot or after max_episode_steps, and all of its
+    zombies get done=True then. The first reward of an episode is measured from the reset poses.
+    """
+    def __init__(self, num_envs, n_zombies=1, n_bots=1, max_episode_steps=4000, map_count=GameServer.map_count, seed=None):
+        assert num_envs % n_zombies == 0, "num_envs must be a multiple of n_zombies"
+        self.sim = ZombieChaseSimulator(num_envs // n_zombies, n_zombies, n_bots, map_count=map_count, seed=seed)
+        self.max_episode_steps = max_episode_steps
+        self.stepcount = np.zeros(self.sim.n_worlds, dtype=np.int64)
+        self.actions = None
+
+        observation_space = Box(low=0, high=3, shape=(StaticWorld.radar_blocks * 2, 1), dtype=np.float64)
+        VecEnv.__init__(self, num_envs, observation_space, Discrete(4))
+
+    def reset(self):
+        self.sim.reset()
+        self.stepcount[:] = 0
+        return self.sim.observations()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions)
+
+    def step_wait(self):
+        last_poses = self.sim.poses.copy()
+        self.sim.step(self.actions)
+        rew, done = self.sim.rewards(last_poses)
+
+        # done or self.stepcount == 4000, per world
+        world_done = done.reshape(self.sim.n_worlds, self.sim.n_zombies).any(axis=1) | (self.stepcount == self.max_episode_steps)
+        self.stepcount += 1
+        finished = np.flatnonzero(world_done)
+        if len(finished) > 0:
+            self.sim.reset(finished)
+            self.stepcount[finished] = 0
+
+        dones = np.repeat(world_done, self.sim.n_zombies)
+        infos = [{} for _ in range(self.num_envs)]
+        return self.sim.observations(), rew, dones, infos
+
+    def get_images(self):
+        return list(self.sim.frames())
+
+    def seed(self, seed=None):
+        self.sim.rng.seed(seed)
@@ -0,0 +1,113 @@
+from math import floor, sqrt, inf
+import numpy as np
+
+
+class SpatialHash(object):
+    """
+    Uniform grid of actor poses (x, y, angle, tag) by key, for radius and nearest-of-tag queries whose cost
+    grows with the actors nearby rather than all actors. update() only touches the grid when an actor
+    changes cell, so keeping it in sync with a few moves per tick is cheap.
+    """
+    def __init__(self, cell_size=15):
+        self.cell_size = cell_size
+        self.poses = {}
+        self.cell_of = {}
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.poses)
+
+    def __contains__(self, key):
+        return key in self.poses
+
+    def _cell(self, x, y):
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def update(self, key, pose):
+        self.poses[key] = tuple(pose)
+        cell = self._cell(pose[0], pose[1])
+        old_cell = self.cell_of.get(key)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard(key, old_cell)
+        self.cell_of[key] = cell
+        self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        del self.poses[key]
+        self._discard(key, self.cell_of.pop(key))
+
+    def clear(self):
+        self.poses.clear()
+        self.cell_of.clear()
+        self.cells.clear()
+
+    def _discard(self, key, cell):
+        members = self.cells[cell]
+        members.discard(key)
+        if not members:
+            del self.cells[cell]
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for i in range(-r, r + 1):
+            yield cx + i, cy - r
+            yield cx + i, cy + r
+        for j in range(-r + 1, r):
+            yield cx - r, cy + j
+            yield cx + r, cy + j
+
+    # keys of the actors closer than radius to (x, y), optionally only those with tag
+    def query_radius(self, x, y, radius, tag=None):
+        radius_sqr = radius * radius
+        x0, y0 = self._cell(x - radius, y - radius)
+        x1, y1 = self._cell(x + radius, y + radius)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # huge radius, visit the occupied cells instead
+            cells = [cell for cell in self.cells if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
+        else:
+            cells = [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+        found = []
+        for cell in cells:
+            for key in self.cells.get(cell, ()):
+                ax, ay, _, atag = self.poses[key]
+                if (ax - x) ** 2 + (ay - y) ** 2 < radius_sqr and (tag is None or atag == tag):
+                    found.append(key)
+        return found
+
+    # (key, distance) of the actor with tag nearest to (x, y), (None, inf) if there is none within max_radius.
+    # Searches rings of cells outwards and stops once no unvisited cell can hold a nearer actor.
+    def nearest(self, x, y, tag, max_radius=inf):
+        if not self.cells:
+            return None, inf
+        cx, cy = self._cell(x, y)
+        max_ring = max(max(abs(c[0] - cx), abs(c[1] - cy)) for c in self.cells)
+        if max_radius < inf:
+            max_ring = min(max_ring, int(max_radius // self.cell_size) + 1)
+
+        best_key, best_dist_sqr = None, max_radius * max_radius
+        for r in range(max_ring + 1):
+            for cell in self._ring(cx, cy, r):
+                for key in self.cells.get(cell, ()):
+                    ax, ay, _, atag = self.poses[key]
+                    dist_sqr = (ax - x) ** 2 + (ay - y) ** 2
+                    if atag == tag and dist_sqr < best_dist_sqr:
+                        best_key, best_dist_sqr = key, dist_sqr
+            # every cell beyond ring r is at least r cells away
+            if best_key is not None and best_dist_sqr <= (r * self.cell_size) ** 2:
+                break
+        return best_key, (sqrt(best_dist_sqr) if best_key is not None else inf)
+
+    # keys and (n, k, 4) poses of the actors closer than radius to every center, padded with nan rows
+    # (which StaticWorld.to_local_radar_obs_batch and calculate_reward_batch ignore)
+    def neighbors(self, centers, radius):
+        keys = [self.query_radius(x, y, radius) for x, y in centers]
+        poses = np.full((len(keys), max([len(k) for k in keys] + [0]), 4), np.nan)
+        for i, neighbor_keys in enumerate(keys):
+            if neighbor_keys:
+                poses[i, :len(neighbor_keys)] = [self.poses[key] for key in neighbor_keys]
+        return keys, poses
@@ -1,10 +1,16 @@
 import numpy as np
 from pandas import read_csv
-from math import floor, degrees, sin, cos, radians, atan2
+from scipy.ndimage import binary_dilation, distance_transform_edt
+from math import floor, ceil, degrees, sin, cos, radians
 import pygame
 
 #Passable = 0 Wall = 1 #Zombie = 2
 
+def load_csv_map(csv_path):
+    raw_data = np.asarray(read_csv(csv_path, skipinitialspace=True, header=None).values)[:,:-1] #dtype is char
+    # a map without any wall is parsed as float nan
+    return (raw_data.astype(object) == '#').astype(np.uint8)
+
 class StaticWorld:
     gridLength = 1  # how many GRIDs does a grid in csv map represent
     perception_grids = 15 # how far in GRIDs can actor see
@@ -12,14 +18,20 @@ class StaticWorld:
 
     radar_blocks = 24
 
-    def __init__(self, csv_path):
-        raw_data = np.asarray(read_csv(csv_path, skipinitialspace=True, header=None).values)[:,:-1] #dtype is char
-        self.data = np.zeros_like(raw_data)
-
-        for i in range(self.data.shape[0]):
-            for j in range(self.data.shape[1]):
-                if raw_data[i][j] == '#':
-                    self.data[i][j] = 1
+    # rgb_array colors of the to_local_obs values: free, wall, zombie, bot
+    local_palette = np.asarray([(80, 200, 80), (60, 60, 60), (220, 50, 50), (50, 90, 230)], dtype=np.uint8)
+    # rgb_array colors of the global view: free, wall
+    global_palette = np.asarray([(0, 0, 0), (60, 60, 60)], dtype=np.uint8)
+    # rayCastSectors sphere traces batches of at least this many centers over clearance. Smaller ones sample
+    # every point of every ray at once, which takes fewer numpy calls than the trace's iterations.
+    trace_min_batch = 128
+
+    # data: already decoded 0/1 grid (see mapstore), skips parsing csv_path
+    # sector_table: build the per-cell x per-sector table rayCastSectors then answers from, see build_sector_table
+    def __init__(self, csv_path=None, data=None, sector_table=False):
+        if data is None:
+            data = load_csv_map(csv_path)
+        self.data = np.asarray(data, dtype=np.int64)
 
         self.length = self.data.shape[0] * self.gridLength
         self.width = self.data.shape[1] * self.gridLength
@@ -30,11 +42,58 @@ class StaticWorld:
         self.image_zombie_1x1 = None
         self.image_bot = None
 
+        # static wall layer, rendered once: see wall_image / wall_surface
+        self._wall_image = None
+        self._wall_surface = None
+
         self.local_length = (self.perception_grids * 2 + 1)
         self.local_width = (self.perception_grids * 2 + 1)
 
         self.radar_length = StaticWorld.radar_blocks * 2
 
+        # local frame coordinates of every to_local_obs cell: obs[lx + perception_grids][perception_grids - ly]
+        self.local_lattice_x, self.local_lattice_y = np.meshgrid(
+            np.arange(-self.perception_grids, self.perception_grids + 1),
+            np.arange(self.perception_grids, -self.perception_grids - 1, -1), indexing='ij')
+
+        # boolean copy of data used by the vectorized queries, surrounded by a border of walls (out of area)
+        self.walls = np.asarray(self.data, dtype=bool)
+        self.wall_padding = 1
+        self.walls_padded = np.pad(self.walls, self.wall_padding, mode='constant', constant_values=True)
+
+        # distance from any point inside a cell to the nearest wall cell, used by rayCastWall to skip samples.
+        # For grid cells the gap between two cells is the center distance to the nearest of the 3x3 cells
+        # around the wall, hence the dilation.
+        self.clearance = distance_transform_edt(~binary_dilation(self.walls_padded, structure=np.ones((3, 3)),
+                                                                 border_value=1)) * self.gridLength
+        # flat views of walls_padded and of the clearance in 0.5 samples (at least 1), for _trace_sectors
+        self.walls_flat = self.walls_padded.ravel()
+        self.clearance_samples = np.maximum(1, np.ceil((self.clearance - 1e-6) / 0.5)).astype(np.intp).ravel()
+        self.sector_table = None
+
+        # unit vector of every radar sector, computed the same way as in rayCastWall
+        radar_block_angle = 360 / StaticWorld.radar_blocks
+        self.radar_dirs = np.asarray([(cos(radians(s * radar_block_angle)), sin(radians(s * radar_block_angle)))
+                                      for s in range(StaticWorld.radar_blocks)])
+
+        # free integer (x, y) spawn points of every quadrant section, see quadrant_sections
+        self.spawn_points = [self._free_points(section_x, section_y) for section_x, section_y in self.quadrant_sections()]
+
+        if sector_table:
+            self.build_sector_table()
+
+
+    # ((x0, x1), (y0, y1)) half open ranges of the four quadrants, index = x half * 2 + y half
+    def quadrant_sections(self):
+        halves_x = [(0, self.width // 2), (self.width // 2, self.width)]
+        halves_y = [(0, self.length // 2), (self.length // 2, self.length)]
+        return [(section_x, section_y) for section_x in halves_x for section_y in halves_y]
+
+    # (k, 2) integer points of the section that are not walls
+    def _free_points(self, section_x, section_y):
+        xs, ys = np.meshgrid(np.arange(*section_x), np.arange(*section_y), indexing='ij')
+        free = ~self.is_wall(xs, ys)
+        return np.stack([xs[free], ys[free]], axis=1)
 
     def __getitem__(self, tup_item):
         _x, _y = tup_item
@@ -46,6 +105,51 @@ class StaticWorld:
             return 1
         return self.data[grid_x, grid_y]
 
+    # vectorized __getitem__: True where (xs, ys) is a wall or out of area
+    def is_wall(self, xs, ys):
+        return self.walls_padded[self._padded_cell(xs, ys)]
+
+    # indices into walls_padded / clearance / sector_table
+    def _padded_cell(self, xs, ys):
+        if self.gridLength == 1:
+            # floor(x // 1) == floor(x), and np.floor is much cheaper than np.floor_divide
+            grid_y = np.floor(xs)
+            grid_x = np.floor(self.length - ys - 1)
+        else:
+            grid_y = np.floor(xs // self.gridLength)
+            grid_x = np.floor((self.length - ys - 1) // self.gridLength)
+
+        # anything beyond the wall border of walls_padded is out of area as well, so clipping is safe
+        rows = np.minimum(np.maximum(grid_x + self.wall_padding, 0), self.walls_padded.shape[0] - 1).astype(np.intp)
+        cols = np.minimum(np.maximum(grid_y + self.wall_padding, 0), self.walls_padded.shape[1] - 1).astype(np.intp)
+        return rows, cols
+
+    # walls of the whole map blitted once onto a transparent surface, draw_global only composites the actors on it
+    def wall_surface(self):
+        if self._wall_surface is None:
+            surface = pygame.Surface((self.width * self.zoom, self.length * self.zoom), pygame.SRCALPHA)
+            for i in range(self.data.shape[1]):
+                for j in range(self.data.shape[0]):
+                    if self.data[j][i] == 1:
+                        surface.blit(self.image_wall, (i * self.gridLength * self.zoom, j * self.gridLength * self.zoom))
+            self._wall_surface = surface
+        return self._wall_surface
+
+    # (length * zoom, width * zoom, 3) uint8 image of the walls, same layout as draw_global. Needs no display.
+    def wall_image(self):
+        if self._wall_image is None:
+            pixels = self.zoom * self.gridLength
+            self._wall_image = np.repeat(np.repeat(self.global_palette[self.data], pixels, axis=0), pixels, axis=1)
+        return self._wall_image
+
+    # headless draw_global: a copy of wall_image with every actor (x, y, angle, tag) as a zoom x zoom square
+    def render_global_rgb(self, poses):
+        frame = self.wall_image().copy()
+        for x, y, angle, tag in poses:
+            col, row = int(x * self.zoom), int((self.length - 1 - y) * self.zoom)
+            frame[max(row, 0):max(row + self.zoom, 0), max(col, 0):max(col + self.zoom, 0)] = self.local_palette[int(tag) + 2]
+        return frame
+
     def draw_global(self, screen, poses_dict, rewards_dict):
         screen.fill(pygame.Color("black"))
         if self.image_wall is None:
@@ -58,10 +162,7 @@ class StaticWorld:
             self.image_bot = pygame.transform.rotozoom(self.image_bot, 0, self.zoom / 10)
 
 
-        for i in range(self.data.shape[1]):
-            for j in range(self.data.shape[0]):
-                if self.data[j][i] == 1:
-                    screen.blit(self.image_wall, (i * self.gridLength * self.zoom, j * self.gridLength * self.zoom))
+        screen.blit(self.wall_surface(), (0, 0))
 
         for addr in list(poses_dict.keys()):
             pos = poses_dict[addr]
@@ -90,75 +191,111 @@ class StaticWorld:
     # zombie = 2
     # player(bot) = 3
     def to_local_obs(self, pos, allZombiePose):
-        obs = np.zeros((self.local_length, self.local_width), dtype = np.int)
-
-        x, y, angle = pos
-        local_frame_x_axis = np.asarray([sin(angle), -cos(angle)])
-        local_frame_y_axis = np.asarray([cos(angle), sin(angle)])
-
-        for local_frame_x in range(-self.perception_grids, self.perception_grids + 1):
-            for local_frame_y in range(-self.perception_grids, self.perception_grids + 1):
-                world_frame_x, world_frame_y = local_frame_x_axis * local_frame_x + local_frame_y_axis * local_frame_y
-                world_frame_x += x
-                world_frame_y += y
-
-                if self.__getitem__((world_frame_x, world_frame_y)) == 1:
-                    obs[local_frame_x + self.perception_grids][self.perception_grids - local_frame_y] = 1
-
-        for a_zombie in allZombiePose:
-            x1, y1, angle1, tag = a_zombie
-            x1 -= x
-            y1 -= y
-            local_frame_x1 = int(sin(angle) * x1 - cos(angle) * y1)
-            local_frame_y1 = int(cos(angle) * x1 + sin(angle) * y1)
-
-            if -self.perception_grids <= local_frame_x1 <= self.perception_grids and \
-                    -self.perception_grids <= local_frame_y1 <= self.perception_grids:
-                obs[local_frame_x1 + self.perception_grids][self.perception_grids - local_frame_y1] = tag + 2
-
-        return np.expand_dims(obs, axis=2)
-
+        return self.to_local_obs_batch([pos], allZombiePose)[0]
+
+    # world frame (x, y) of every local lattice cell of every pose, (n, local_length, local_width) each
+    def _local_lattice_world(self, poses):
+        # math.sin / math.cos like the scalar code, np.sin may differ in the last bit
+        sin_a = np.asarray([sin(angle) for angle in poses[:, 2]])[:, None, None]
+        cos_a = np.asarray([cos(angle) for angle in poses[:, 2]])[:, None, None]
+        world_x = sin_a * self.local_lattice_x + cos_a * self.local_lattice_y + poses[:, 0, None, None]
+        world_y = -cos_a * self.local_lattice_x + sin_a * self.local_lattice_y + poses[:, 1, None, None]
+        return world_x, world_y
+
+    # poses: (n, 3) array of (x, y, angle), actors like to_local_radar_obs_batch
+    # returns (n, local_length, local_width, 1): the lattice rotated and translated onto every pose and gathered
+    # from walls_padded at once (out of area is wall), then the actors, identical to the per-cell loop
+    def to_local_obs_batch(self, poses, actors):
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+        n = poses.shape[0]
+        actors = np.asarray(actors, dtype=np.float64)
+        actors = actors.reshape((n, -1, 4) if actors.ndim == 3 else (1, -1, 4))
+
+        obs = self.is_wall(*self._local_lattice_world(poses)).astype(np.int64)
+
+        # later actors overwrite earlier ones, like the loop over allZombiePose
+        sin_a = np.asarray([sin(angle) for angle in poses[:, 2]])
+        cos_a = np.asarray([cos(angle) for angle in poses[:, 2]])
+        for z in range(actors.shape[1]):
+            x1 = actors[:, z, 0] - poses[:, 0]
+            y1 = actors[:, z, 1] - poses[:, 1]
+            with np.errstate(invalid='ignore'):
+                local_frame_x1 = np.trunc(sin_a * x1 - cos_a * y1)
+                local_frame_y1 = np.trunc(cos_a * x1 + sin_a * y1)
+                visible = (np.abs(local_frame_x1) <= self.perception_grids) & (np.abs(local_frame_y1) <= self.perception_grids)
+            rows = np.flatnonzero(visible)
+            tags = np.broadcast_to(actors[:, z, 3], (n,))
+            obs[rows, local_frame_x1[rows].astype(np.intp) + self.perception_grids,
+                self.perception_grids - local_frame_y1[rows].astype(np.intp)] = tags[rows] + 2
+
+        return obs[..., None]
+
+    # headless draw_local: (n, local_length * zoom, local_width * zoom, 3) uint8 frames of to_local_obs_batch,
+    # colored with local_palette
+    def to_local_rgb_batch(self, poses, actors):
+        # obs is indexed [local x][local y from the top], the frame [row][column]
+        obs = self.to_local_obs_batch(poses, actors)[..., 0].transpose(0, 2, 1)
+        frames = self.local_palette[obs]
+        return np.repeat(np.repeat(frames, self.zoom, axis=1), self.zoom, axis=2)
+
+    def to_local_rgb(self, pos, allZombiePose):
+        return self.to_local_rgb_batch([pos], allZombiePose)[0]
 
     def to_local_radar_obs(self, pos, allZombiePose):
-        x, y, angle = pos
+        return self.to_local_radar_obs_batch([pos], allZombiePose)[0]
+
+    # poses: (n, 3) array of (x, y, angle)
+    # actors: (m, 4) array of (x, y, angle, tag) seen by every pose, or (n, m, 4) with one row per pose.
+    #         rows filled with nan are ignored, so lists of different length can be padded.
+    # returns (n, radar_length, 1), identical to calling to_local_radar_obs for every pose
+    def to_local_radar_obs_batch(self, poses, actors):
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+        n = poses.shape[0]
+        actors = np.asarray(actors, dtype=np.float64)
+        actors = actors.reshape((n, -1, 4) if actors.ndim == 3 else (1, -1, 4))
         radar_block_angle = 360 / StaticWorld.radar_blocks
+        batch_index = np.arange(n)[:, None]
 
-        obs = np.zeros((StaticWorld.radar_blocks), dtype = np.int)
-        depth = np.ones((StaticWorld.radar_blocks), dtype = np.float) * 10000
-
-        for z in allZombiePose:
-            zx, zy, angle1, tag = z
-            if zx == x and zy == y:
-                continue
+        obs = np.zeros((n, StaticWorld.radar_blocks), dtype=np.int64)
+        depth = np.ones((n, StaticWorld.radar_blocks), dtype=np.float64) * 10000
 
-            relative_angle = degrees(atan2(zy - y, zx - x))
-            if relative_angle < 0:
-                relative_angle += 360 #[0, 360]
-            center_sector = round(relative_angle / radar_block_angle) % 24
+        # actors: the nearest one inside perception_grids wins its sector
+        if actors.shape[1] > 0:
+            x = poses[:, 0:1]
+            y = poses[:, 1:2]
+            zx = actors[:, :, 0]
+            zy = actors[:, :, 1]
 
+            relative_angle = np.degrees(np.arctan2(zy - y, zx - x))
+            relative_angle[relative_angle < 0] += 360  # [0, 360]
             z_distance = np.sqrt(np.square(zx - x) + np.square(zy - y))
-            if z_distance < StaticWorld.perception_grids and z_distance < depth[center_sector]:
-                obs[center_sector] = tag + 2  # 2 or 3
-                depth[center_sector] = z_distance
+            seen = (z_distance < StaticWorld.perception_grids) & ~((zx == x) & (zy == y))
+            center_sector = np.where(seen, np.round(relative_angle / radar_block_angle), 0).astype(np.int64) % StaticWorld.radar_blocks
 
-        for s in range(StaticWorld.radar_blocks):
-            wangle = s * radar_block_angle
-            wallDistance = self.rayCastWall((x, y), wangle)
-            if wallDistance < StaticWorld.perception_grids and wallDistance < depth[s]:
-                obs[s] = 1
-                depth[s] = wallDistance
+            # (n, radar_blocks, m) distances, inf where the actor is not in that sector
+            in_sector = seen[:, None, :] & (center_sector[:, None, :] == np.arange(StaticWorld.radar_blocks)[:, None])
+            sector_distance = np.where(in_sector, z_distance[:, None, :], np.inf)
+            nearest = np.argmin(sector_distance, axis=2)
+            has_actor = in_sector.any(axis=2)
+
+            tags = np.broadcast_to(actors[:, :, 3], z_distance.shape)
+            obs[has_actor] = tags[batch_index, nearest][has_actor].astype(np.int64) + 2  # 2 or 3
+            depth[has_actor] = z_distance[batch_index, nearest][has_actor]
+
+        # walls
+        wallDistance = self.rayCastSectors(poses[:, :2])
+        wall_visible = (wallDistance < StaticWorld.perception_grids) & (wallDistance < depth)
+        obs[wall_visible] = 1
+        depth[wall_visible] = wallDistance[wall_visible]
 
         # normalize depth
         depth = np.minimum(1, depth / self.perception_grids)
 
         # roll to front view
-        self_pos_block = round(degrees(angle) / radar_block_angle)
-        obs = np.roll(obs, -self_pos_block, 0)
-        depth = np.roll(depth, -self_pos_block, 0)
-
-        return np.expand_dims(np.concatenate([obs, depth]), axis=1)
-
+        self_pos_block = np.round(np.degrees(poses[:, 2]) / radar_block_angle).astype(np.int64)
+        rolled = (np.arange(StaticWorld.radar_blocks) + self_pos_block[:, None]) % StaticWorld.radar_blocks
 
+        return np.expand_dims(np.concatenate([obs[batch_index, rolled], depth[batch_index, rolled]], axis=1), axis=2)
 
     # also shows rotation
     def draw_local(self, screen, pos, allZombiePose):
@@ -169,19 +306,11 @@ class StaticWorld:
             self.image_bot = pygame.image.load("../Resources/sprite_blue.png")
 
         x, y, angle = pos
-        local_frame_x_axis = np.asarray([sin(angle), -cos(angle)])
-        local_frame_y_axis = np.asarray([cos(angle), sin(angle)])
-
-        for local_frame_x in range(-self.perception_grids, self.perception_grids + 1):
-            for local_frame_y in range(-self.perception_grids, self.perception_grids + 1):
-                world_frame_x, world_frame_y = local_frame_x_axis * local_frame_x + local_frame_y_axis * local_frame_y
-                world_frame_x += x
-                world_frame_y += y
-
-                if self.__getitem__((world_frame_x, world_frame_y)) == 1:
-                    screen.blit(self.image_wall,
-                                (self.zoom * (local_frame_x + self.perception_grids),
-                                 self.zoom * (self.perception_grids - local_frame_y)))
+        walls = self.is_wall(*self._local_lattice_world(np.asarray([pos], dtype=np.float64)))[0]
+        for local_frame_x, local_frame_y in zip(self.local_lattice_x[walls], self.local_lattice_y[walls]):
+            screen.blit(self.image_wall,
+                        (self.zoom * (local_frame_x + self.perception_grids),
+                         self.zoom * (self.perception_grids - local_frame_y)))
 
         for a_zombie in allZombiePose:
             x1, y1, angle1, tag = a_zombie
@@ -204,9 +333,82 @@ class StaticWorld:
                             (self.zoom * (local_frame_x1 + self.perception_grids),
                              self.zoom * (self.perception_grids - local_frame_y1)))
 
+    # rayCastWall for all radar sectors of a batch of (x, y) centers.
+    # Visits the same points as rayCastWall, so the distances are identical
+    # (unless the world has a sector table, see build_sector_table).
+    # returns (n, radar_blocks)
+    def rayCastSectors(self, centers, distance = 15):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        if self.sector_table is not None and distance == 15:
+            return self.sector_table[self._padded_cell(centers[:, 0], centers[:, 1])]
+        if len(centers) >= self.trace_min_batch:
+            return self._trace_sectors(centers, distance)
+        return self._sample_sectors(centers, distance)
+
+    # every sample of every ray in a single gather into walls_padded
+
+    def _sample_sectors(self, centers, distance):
+        steps = np.arange(0, distance, 0.5)
+        sample_x = centers[:, 0, None, None] + self.radar_dirs[None, :, 0, None] * steps[None, None, :]
+        sample_y = centers[:, 1, None, None] + self.radar_dirs[None, :, 1, None] * steps[None, None, :]
+        hit = self.is_wall(sample_x, sample_y)
+
+        wallDistance = steps[np.argmax(hit, axis=2)]
+        wallDistance[~hit.any(axis=2)] = 99999
+        return wallDistance
+
+    # rayCastWall's sphere tracing for all rays at once: every iteration advances each ray still going
+    # by the clearance of its cell, rays that hit a wall or ran out of samples drop out
+    def _trace_sectors(self, centers, distance):
+        steps = np.arange(0, distance, 0.5)
+        n = centers.shape[0]
+        wallDistance = np.full(n * StaticWorld.radar_blocks, 99999.0)
+        rays = np.arange(n * StaticWorld.radar_blocks)
+        ray_x = np.repeat(centers[:, 0], StaticWorld.radar_blocks)
+        ray_y = np.repeat(centers[:, 1], StaticWorld.radar_blocks)
+        dir_x = np.tile(self.radar_dirs[:, 0], n)
+        dir_y = np.tile(self.radar_dirs[:, 1], n)
+        k = np.zeros(len(rays), dtype=np.intp)
+        while len(rays):
+            step = steps[k]
+            rows, cols = self._padded_cell(ray_x + dir_x * step, ray_y + dir_y * step)
+            cell = rows * self.walls_padded.shape[1] + cols
+            hit = self.walls_flat[cell]
+            wallDistance[rays[hit]] = step[hit]
+            k += self.clearance_samples[cell]
+            going = np.flatnonzero(~hit & (k < len(steps)))
+            rays, k, ray_x, ray_y, dir_x, dir_y = rays[going], k[going], ray_x[going], ray_y[going], dir_x[going], dir_y[going]
+        return wallDistance.reshape(n, StaticWorld.radar_blocks)
+
+    # (rows, cols, radar_blocks) wall distances cast from the center of every cell of walls_padded.
+    # rayCastSectors then answers from it in O(1), with the distances of the center of the cell a query is in:
+    # off by up to half a cell diagonal, more for a ray that grazes a wall corner from one point but not the other.
+    def build_sector_table(self):
+        rows, cols = np.indices(self.walls_padded.shape)
+        centers_x = (cols - self.wall_padding + 0.5) * self.gridLength
+        centers_y = self.length - 1 - (rows - self.wall_padding + 0.5) * self.gridLength
+
+        table = self._trace_sectors(np.stack([centers_x.ravel(), centers_y.ravel()], axis=1), 15)
+        self.sector_table = table.reshape(self.walls_padded.shape + (StaticWorld.radar_blocks,))
+        return self.sector_table
+
     #angle in degrees
+    # Sphere tracing over clearance: visits the same 0.5 spaced samples as plain stepping would,
+    # but jumps over the ones that are closer than the clearance of the current cell.
     def rayCastWall(self, center, angle, distance = 15):
-        for i in np.arange(0, distance, 0.5):
-            if self.__getitem__((center[0] + cos(radians(angle)) * i, center[1] + sin(radians(angle)) * i)) == 1:
+        steps = np.arange(0, distance, 0.5)
+        dx = cos(radians(angle))
+        dy = sin(radians(angle))
+        k = 0
+        while k < len(steps):
+            i = steps[k]
+            _x = center[0] + dx * i
+            _y = center[1] + dy * i
+            if self.__getitem__((_x, _y)) == 1:
                 return i
+
+            row = floor((self.length - _y - 1) // self.gridLength) + self.wall_padding
+            col = floor(_x // self.gridLength) + self.wall_padding
+            # samples closer than the clearance cannot be in a wall, small margin for rounding
+            k += max(1, ceil((self.clearance[row, col] - 1e-6) / 0.5))
         return 99999
@@ -0,0 +1,17 @@
+from baselines.PyGameMultiAgent import benchmark
+
+
+def test_run_and_compare(tmpdir):
+    results = benchmark.run(['raycast', 'radar_obs', 'server_tick'], maps=(0,), actor_counts=(2, 4),
+                            repeat_scale=0.01, verbose=False)
+    assert [(r['case'], r['actors']) for r in results] == \
+        [('raycast', None), ('radar_obs', 2), ('radar_obs', 4), ('server_tick', 2), ('server_tick', 4)]
+    assert all(r['calls_per_s'] > 0 and r['p50_us'] <= r['p99_us'] for r in results)
+
+    path = str(tmpdir.join('baseline.json'))
+    benchmark.save_results(path, results)
+    baseline = benchmark.load_results(path)
+    assert benchmark.compare(results, baseline) == []
+
+    faster = [dict(r, calls_per_s=r['calls_per_s'] * 2) for r in baseline[:2]]
+    assert [result['case'] for result, _ in benchmark.compare(results, faster)] == ['raycast', 'radar_obs']
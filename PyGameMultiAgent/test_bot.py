@@ -0,0 +1,79 @@
+import socket
+import threading
+
+import numpy as np
+
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent import shmtransport
+from baselines.PyGameMultiAgent.bot import Bot, BotPool, escape_commands, escape_policy_batch
+from baselines.PyGameMultiAgent.gameserver import GameServer
+from baselines.PyGameMultiAgent.mapstore import load_world
+
+
+def test_escape_policy_batch_matches_dummy_escape_policy():
+    rng = np.random.RandomState(0)
+    bot = Bot(transport=shmtransport.UDP)
+    bot.conn.close()
+    for map_index in (0, 3, 17):
+        bot.world = world = load_world(map_index)
+        n = 200
+        poses = np.stack([rng.uniform(0, world.width, n), rng.uniform(0, world.length, n),
+                          rng.uniform(0, 2 * np.pi, n)], axis=1)
+        # up to 4 zombies around every bot, the rows past a bot's count stay nan
+        counts = rng.randint(0, 5, n)
+        zombies = np.full((n, 4, 3), np.nan)
+        for i, count in enumerate(counts):
+            zombies[i, :count, :2] = poses[i, :2] + rng.uniform(-12, 12, (count, 2))
+            zombies[i, :count, 2] = rng.uniform(0, 2 * np.pi, count)
+
+        commands = escape_commands(*escape_policy_batch(world, poses, zombies))
+        expected = [bot.dummy_escape_policy(tuple(pose), [tuple(z) for z in bot_zombies[:count]])
+                    for pose, bot_zombies, count in zip(poses, zombies, counts)]
+        assert commands == expected
+        assert len(set(command[:2] for command in commands)) == 4
+
+
+def test_bot_pool_round_trip():
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    # stands in for the server's socket: hands the pool's datagrams to handle_message and sends its updates back
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.bind(('127.0.0.1', 0))
+    relay.settimeout(5)
+    server._sendto = lambda payload, addr: relay.sendto(protocol.encode_mux(addr.slot, payload), addr.addr) \
+        if isinstance(addr, protocol.MuxAddr) else None
+    zombie = ('127.0.0.1', 1)
+    server.handle_message(protocol.connect_message('z', protocol.OBS, '1'), zombie)
+
+    pool = BotPool(3, serverport=relay.getsockname()[1], rooms=['0', '0', '1'], transport=shmtransport.UDP)
+    thread = threading.Thread(target=pool.run, daemon=True)
+    try:
+        thread.start()
+        sent = set()
+
+        # until every slot has sent a message starting with cmd
+        def relay_until(cmd):
+            while {slot for slot, first in sent if first == cmd} != {0, 1, 2}:
+                msg, addr = relay.recvfrom(2048)
+                slot, command = protocol.parse_mux(msg.decode('utf-8'))
+                sent.add((slot, command[0]))
+                server.handle_message(msg.decode('utf-8'), addr)
+
+        relay_until('c')
+        assert {addr.slot: room.room_id for addr, room in server.player_room.items()
+                if isinstance(addr, protocol.MuxAddr)} == {0: '0', 1: '0', 2: '1'}
+        # room 0 started with its second connect, room 1 waits for its zombie
+        server.handle_message('uu', zombie)
+        relay_until('u')
+
+        pool.disconnect()
+        relay_until('d')
+        assert list(server.player_room) == [zombie]
+        # wakes up the pool, whose round is the last one
+        update = protocol.encode_update(protocol.encode_poses([(5.0, 5.0, 0.0, 1)]), 0, 0, 0)
+        relay.sendto(protocol.encode_mux(0, update), pool.conn.getsockname())
+        thread.join(5)
+        assert not thread.is_alive()
+    finally:
+        relay.close()
+        pool.conn.close()
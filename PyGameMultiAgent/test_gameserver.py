@@ -0,0 +1,208 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent.gameserver import GameServer, Room, observe_rooms, place_players, spawn
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent.reward import calculate_reward_batch
+
+
+def test_observe_rooms_matches_per_zombie():
+    np.random.seed(0)
+    rooms = []
+    for room_id, (zombies, bots) in enumerate([(2, 1), (1, 2), (3, 0)]):
+        room = Room(str(room_id), map_count=2)
+        for i in range(zombies):
+            room.add_player(('z', i), 'z', protocol.OBS)
+        for i in range(bots):
+            room.add_player(('b', i), 'b', protocol.BINARY)
+        rooms.append(room)
+
+    observe_rooms(rooms)
+    for room in rooms:
+        for player in room.players_pose:
+            room.do_movement('u', player)
+    # the first observation of a room carries no reward
+    assert all(rew == 0 for room in rooms for _, rew, _ in room.players_obs.values())
+    for room in rooms:
+        room.updates()
+        for player in room.players_pose:
+            room.do_movement('l', player)
+            room.do_movement('u', player)
+
+    observe_rooms(rooms)
+    for room in rooms:
+        assert sorted(room.players_obs) == sorted(p for p in room.players_pose if p[0] == 'z')
+        for zombie, (obs, rew, done) in room.players_obs.items():
+            me = room.players_pose[zombie]
+            others = [pose for player, pose in room.players_pose.items() if player != zombie]
+            last_others = [pose for player, pose in room.last_poses.items() if player != zombie]
+            assert np.array_equal(obs, room.world.to_local_radar_obs(me[:3], others))
+            expected_rew, expected_done = calculate_reward_batch([me[:3]], np.reshape(others, (1, -1, 4)),
+                                                                 [room.last_poses[zombie][:3]], np.reshape(last_others, (1, -1, 4)))
+            assert np.isclose(rew, expected_rew[0]) and done == expected_done[0]
+
+
+def test_place_players():
+    rng = np.random.RandomState(0)
+    for map_index in (0, 1, 6):
+        world = load_world(map_index)
+        for player_count in (1, 4, 9):
+            start_position = place_players(world, player_count, rng)
+            if start_position is None:
+                continue
+            assert len(start_position) == player_count
+            xs = np.asarray([p[0] for p in start_position])
+            ys = np.asarray([p[1] for p in start_position])
+            assert not world.is_wall(xs, ys).any()
+            manhattan = np.abs(xs[:, None] - xs) + np.abs(ys[:, None] - ys)
+            assert (manhattan[~np.eye(player_count, dtype=bool)] >= 8).all()
+            # all inside one quadrant
+            assert any(all(x0 <= x < x1 and y0 <= y < y1 for x, y in zip(xs, ys))
+                       for (x0, x1), (y0, y1) in world.quadrant_sections())
+
+    # an empty 50x50 map holds 9 players per quadrant at best, so 40 fit nowhere
+    assert place_players(load_world(0), 40, rng) is None
+    with pytest.raises(ValueError):
+        spawn(40, 2, rng)
+
+
+def test_full_room_rejects_connects():
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    sent = []
+    server._sendto = lambda payload, addr: sent.append((payload, addr))
+    # an empty 50x50 map holds 9 players per quadrant at best (see test_place_players)
+    players = [('127.0.0.1', i) for i in range(40)]
+    for addr in players:
+        server.handle_message(protocol.connect_message('z', protocol.BINARY), addr)
+    room = server.rooms[protocol.DEFAULT_ROOM]
+    joined = [addr for addr in players if addr in server.player_room]
+    assert 0 < len(joined) < len(players)
+    assert sorted(room.players_pose) == sorted(joined) == sorted(room.players_ready)
+
+    # a reset that fits on no map keeps the poses
+    poses = dict(room.players_pose)
+    room.map_count = 0
+    del sent[:]
+    server.handle_message('r', joined[0])
+    assert room.players_pose == poses and [addr for _, addr in sent] == [joined[0]]
+
+    # the server goes on, for the other rooms too
+    other = ('127.0.0.1', 100)
+    server.handle_message(protocol.connect_message('z', protocol.BINARY, '1'), other)
+    server.handle_message('uu', other)
+    assert server.player_room[other] is server.rooms['1']
+
+
+def test_request_retries():
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    sent = []
+    server._sendto = lambda payload, addr: sent.append((payload, addr))
+    zombie, bot = ('127.0.0.1', 1), ('127.0.0.1', 2)
+    server.handle_message(protocol.connect_message('z', protocol.OBS), zombie)
+    server.handle_message(protocol.connect_message('b', protocol.BINARY), bot)
+    room = server.rooms[protocol.DEFAULT_ROOM]
+
+    del sent[:]
+    server.handle_message(protocol.request_message('r', 1), zombie)
+    assert [protocol.decode_ack(payload) for payload, addr in sent if addr == zombie] == [1]
+
+    server.handle_message(protocol.request_message('uu|0.0', 2), zombie)
+    server.handle_message('uu', bot)
+    broadcast = [payload for payload, addr in sent if addr == zombie][-1]
+    assert protocol.decode_ack(broadcast) == 2
+    pose = room.players_pose[zombie]
+
+    # a retry gets the last update again and does not move twice, an older request is dropped
+    del sent[:]
+    server.handle_message(protocol.request_message('uu|0.0', 2), zombie)
+    server.handle_message(protocol.request_message('ul', 1), zombie)
+    assert sent == [(broadcast, zombie)]
+    assert room.players_pose[zombie] == pose
+
+
+@pytest.mark.parametrize('missed_tick', ['repeat', 'idle'])
+def test_tick_with_silent_client(missed_tick):
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    sent = []
+    server._sendto = lambda payload, addr: sent.append((payload, addr))
+    talker, silent, bot = ('127.0.0.1', 1), ('127.0.0.1', 2), ('127.0.0.1', 3)
+    for addr, kind in [(talker, 'z'), (silent, 'z'), (bot, 'b')]:
+        server.handle_message(protocol.connect_message(kind, protocol.BINARY), addr, lockstep=False)
+    room = server.rooms[protocol.DEFAULT_ROOM]
+
+    # turns, which no wall blocks
+    for addr in [talker, silent, bot]:
+        server.handle_message('ul', addr, lockstep=False)
+    server.tick_once(missed_tick)
+
+    # silent misses the next tick, the others still move and everybody gets the broadcast
+    before = dict(room.players_pose)
+    del sent[:]
+    server.handle_message('ul', talker, lockstep=False)
+    server.handle_message('ur', bot, lockstep=False)
+    server.tick_once(missed_tick)
+
+    assert sorted(addr for _, addr in sent) == [talker, silent, bot]
+    assert room.players_pose[talker] != before[talker]
+    assert room.players_pose[bot] != before[bot]
+    if missed_tick == 'repeat':
+        assert room.last_moves[silent] == 'l'
+        # turned as far as talker, whose command was the same
+        assert room.players_pose[silent][2] - before[silent][2] == \
+            pytest.approx(room.players_pose[talker][2] - before[talker][2])
+    else:
+        assert room.players_pose[silent] == before[silent]
+
+
+def test_rooms_are_isolated():
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    sent = []
+    server._sendto = lambda payload, addr: sent.append((payload, addr))
+    players = {'0': [('127.0.0.1', 1), ('127.0.0.1', 2)], '1': [('127.0.0.1', 3), ('127.0.0.1', 4)]}
+    for room_id, (zombie, bot) in players.items():
+        server.handle_message(protocol.connect_message('z', protocol.BINARY, room_id), zombie)
+        server.handle_message(protocol.connect_message('b', protocol.BINARY, room_id), bot)
+    quiet, busy = server.rooms['0'], server.rooms['1']
+    state = (dict(quiet.players_pose), quiet.map_index, quiet.tick)
+
+    # a reset and a step of room 1
+    del sent[:]
+    server.handle_message('r', players['1'][0])
+    for addr in players['1']:
+        server.handle_message('ul', addr)
+    assert busy.tick > 0
+    assert (dict(quiet.players_pose), quiet.map_index, quiet.tick) == state
+    assert {addr for _, addr in sent} == set(players['1'])
+
+    # a reset from an unknown sender neither creates a room nor answers
+    del sent[:]
+    server.handle_message('r', ('127.0.0.1', 5))
+    assert sorted(server.rooms) == ['0', '1'] and sent == []
+
+
+def test_run_ticked_stops():
+    server = GameServer(port=0, visualize=False)
+    thread = threading.Thread(target=server.run_ticked, args=(100,), daemon=True)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    try:
+        thread.start()
+        client.sendto(protocol.connect_message('b', protocol.BINARY).encode('utf-8'), server.listener.getsockname())
+        # updates of two ticks in a row, without sending anything in between
+        seqs = [protocol.decode_update(client.recvfrom(2048)[0])[3] for _ in range(2)]
+        assert seqs[1] > seqs[0]
+
+        server.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+    finally:
+        client.close()
+        server.close()
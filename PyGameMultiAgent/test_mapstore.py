@@ -0,0 +1,54 @@
+import os
+import numpy as np
+
+from baselines.PyGameMultiAgent.mapstore import MapStore, MAPS_DIR, map_csv_path
+from baselines.PyGameMultiAgent.staticworld import StaticWorld, load_csv_map
+
+
+def test_archive_matches_csv(tmpdir):
+    store = MapStore(archive_path=os.path.join(str(tmpdir), 'maps.bin'), cache_size=2)
+    assert len(store) == len([f for f in os.listdir(MAPS_DIR) if f.endswith('.csv')])
+
+    for map_index in (0, 1, 57, len(store) - 1):
+        csv_path = map_csv_path(map_index)
+        assert np.array_equal(store.data(map_index), load_csv_map(csv_path))
+        assert np.array_equal(store.world(map_index).data, StaticWorld(csv_path).data)
+
+
+def test_world_cache(tmpdir):
+    store = MapStore(archive_path=os.path.join(str(tmpdir), 'maps.bin'), cache_size=2)
+    world = store.world(3)
+    assert store.world(3) is world
+    store.world(4)
+    store.world(3)
+    store.world(5)  # evicts 4, the least recently used
+    assert list(store.worlds.keys()) == [(3, False), (5, False)]
+
+    # built when loaded, and cached apart from the world without it
+    tabled = store.world(5, sector_table=True)
+    assert tabled is not store.world(5) and tabled.sector_table is not None and world.sector_table is None
+
+
+def _write_map(path, grid):
+    with open(path, 'w') as f:
+        for row in grid:
+            f.write(','.join('#' if cell else ' ' for cell in row) + ',\n')
+
+
+def test_stale_archive_is_rebuilt(tmpdir):
+    maps_dir = str(tmpdir.mkdir('maps'))
+    archive_path = os.path.join(str(tmpdir), 'maps.bin')
+    grid = np.zeros((4, 6), dtype=int)
+    _write_map(map_csv_path(0, maps_dir), grid)
+    assert len(MapStore(archive_path, maps_dir)) == 1
+
+    # a new map and an edited one, with an mtime later than the archive's stamp
+    grid[1, 2] = 1
+    _write_map(map_csv_path(0, maps_dir), grid)
+    _write_map(map_csv_path(1, maps_dir), grid)
+    stat = os.stat(map_csv_path(0, maps_dir))
+    os.utime(map_csv_path(0, maps_dir), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    store = MapStore(archive_path, maps_dir)
+    assert len(store) == 2
+    assert np.array_equal(store.data(0), grid) and np.array_equal(store.data(1), grid)
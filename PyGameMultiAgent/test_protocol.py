@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from baselines.PyGameMultiAgent import protocol
+
+POSES = [(1.5, 2.25, 0.5, 0), (10.0, 20.0, 3.0, 1), (7.0, 8.0, 6.0, 1)]
+
+
+def test_binary_update():
+    body = protocol.encode_poses(POSES)
+    for self_index in range(len(POSES)):
+        msg = protocol.encode_update(body, 42, 7, self_index)
+        self_pos, others, map_index, seq = protocol.decode_update(msg)
+
+        assert self_pos == POSES[self_index][:3]
+        assert np.array_equal(others, [p for i, p in enumerate(POSES) if i != self_index])
+        assert map_index == 7
+        assert seq == 42
+
+
+def test_other_version_is_rejected():
+    msg = bytearray(protocol.encode_update(protocol.encode_poses(POSES), 42, 7, 0))
+    msg[2] = protocol.VERSION - 1
+    with pytest.raises(ValueError):
+        protocol.decode_update(bytes(msg))
+
+
+def test_text_update_matches_binary():
+    body = protocol.encode_poses(POSES)
+    for self_index in range(len(POSES)):
+        text = protocol.decode_update(protocol.encode_text_update(POSES, self_index, 3))
+        binary = protocol.decode_update(protocol.encode_update(body, 0, 3, self_index))
+
+        assert text[0] == binary[0]
+        assert np.array_equal(text[1], binary[1])
+        assert text[2] == binary[2] == 3
+        assert text[3] is None
+
+
+def test_obs_update():
+    body = protocol.encode_poses(POSES)
+    obs = np.arange(48, dtype=np.float64) / 16
+    msg = protocol.encode_obs_update(body, 5, 1, 0, obs, 0.25, True)
+
+    assert protocol.decode_update(msg)[0] == POSES[0][:3]
+    decoded_obs, reward, done = protocol.decode_obs(msg)
+    assert decoded_obs.shape == (48, 1)
+    assert np.array_equal(decoded_obs[:, 0], obs)
+    assert reward == 0.25 and done
+
+
+def test_connect_message():
+    assert protocol.connect_message('z') == 'cz'
+    assert protocol.parse_connect('cz') == ('z', protocol.TEXT, protocol.DEFAULT_ROOM, None)
+    assert protocol.parse_connect(protocol.connect_message('b', protocol.BINARY)) == ('b', protocol.BINARY, protocol.DEFAULT_ROOM, None)
+    assert protocol.parse_connect(protocol.connect_message('z', protocol.BINARY, 12)) == ('z', protocol.BINARY, '12', None)
+    assert protocol.parse_connect(protocol.connect_message('z', room='a')) == ('z', protocol.TEXT, 'a', None)
+    assert protocol.parse_connect(protocol.connect_message('b', protocol.BINARY, 'a', '/dev/shm/x')) == ('b', protocol.BINARY, 'a', '/dev/shm/x')
+
+
+def test_mux():
+    msg = protocol.mux_message(3, protocol.connect_message('b', protocol.BINARY, 'a'))
+    assert protocol.parse_mux(msg) == (3, 'cb:bin@a')
+    assert protocol.is_connect(msg.encode('utf-8')) and protocol.is_connect('cz')
+    assert not protocol.is_connect(protocol.mux_message(3, 'ul0.5')) and not protocol.is_connect(b'uu|0.0')
+
+    payload = protocol.encode_update(protocol.encode_poses(POSES), 1, 2, 1)
+    assert protocol.decode_mux(protocol.encode_mux(513, payload)) == (513, payload)
+
+
+def test_request():
+    msg = protocol.request_message('uu|0.5', 70000)
+    assert protocol.parse_request(msg) == ('uu|0.5', 70000 & 0xFFFF)
+    assert protocol.parse_request('ul0.3') == ('ul0.3', None)
+    assert protocol.request_seq_diff(65535, 1) == 2 and protocol.request_seq_diff(1, 65535) == -2
+
+    body = protocol.encode_poses(POSES)
+    assert protocol.decode_ack(protocol.encode_update(body, 1, 2, 0, ack=17)) == 17
+    assert protocol.decode_ack(protocol.encode_obs_update(body, 1, 2, 0, np.zeros(4), 0.0, False, ack=9)) == 9
+    assert protocol.decode_ack(protocol.encode_text_update(POSES, 0, 2)) is None
@@ -0,0 +1,39 @@
+import numpy as np
+
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent.gameserver import GameServer
+from baselines.PyGameMultiAgent.serverstats import Histogram
+
+
+def test_histogram():
+    histogram = Histogram()
+    for us in [3, 5, 6, 7, 100, 1000]:
+        histogram.add(us * 1e-6)
+    assert histogram.count == 6 and histogram.max == 1e-3
+    # bucket upper bounds: 4us holds 3, 8us holds 5..7
+    assert histogram.percentile(10) == 4e-6
+    assert histogram.percentile(50) == 8e-6
+    assert histogram.percentile(99) == 1e-3
+    assert Histogram().percentile(50) == 0
+
+
+def test_server_stats():
+    np.random.seed(0)
+    server = GameServer(port=None, visualize=False)
+    zombie, bot = ('127.0.0.1', 1), ('127.0.0.1', 2)
+    server.handle_message(protocol.connect_message('z', protocol.OBS), zombie)
+    server.handle_message(protocol.connect_message('b', protocol.BINARY), bot)
+    for i in range(10):
+        server.handle_message('uu', zombie)
+        server.handle_message('ul', bot)
+    server.handle_message('r', zombie)
+
+    kvs = server.stats.summary()
+    assert kvs['datagrams'] == 23
+    assert kvs['movement_count'] == 20 and kvs['ready_wait_count'] == 10
+    assert kvs['init_pose_count'] == 3
+    assert kvs['client_rtt_count'] == 21
+    # the bot is the one the room waits for
+    assert sorted([kvs['straggler0_count'], kvs['straggler1_count']]) == [0, 10]
+    assert all(isinstance(value, (int, float)) for value in kvs.values())
+    assert bot in [client for client, _, _ in server.stats.stragglers()]
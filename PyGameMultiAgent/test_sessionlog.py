@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from baselines.PyGameMultiAgent import protocol
+from baselines.PyGameMultiAgent.gameserver import GameServer, replay
+from baselines.PyGameMultiAgent.sessionlog import VERSION, SessionLogWriter, read_session_log
+
+
+def test_replay_reproduces_session(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    server = GameServer(port=None, visualize=False, record=path)
+    zombie, bot, ticked_zombie = ('127.0.0.1', 8001), '/dev/shm/zombiechase-test', ('127.0.0.1', 8002)
+
+    # lock-step room
+    server.handle_message(protocol.connect_message('z', protocol.OBS), zombie)
+    server.handle_message(protocol.connect_message('b', protocol.BINARY, channel=bot), ('127.0.0.1', 8003))
+    server.handle_message('r', zombie)
+    for i in range(30):
+        server.handle_message('uu' if i % 3 else 'ul0.3', zombie)
+        server.handle_message('ur0.2|0.5' if i % 4 else 'uu', bot)
+    # fixed-rate room, with one of several players behind a socket
+    server.handle_message(protocol.connect_message('z', protocol.OBS, room='1'), ticked_zombie, lockstep=False)
+    server.handle_message(protocol.mux_message(2, protocol.connect_message('b', room='1')), ticked_zombie, lockstep=False)
+    for i in range(20):
+        server.handle_message('uu' if i % 2 else 'ur', ticked_zombie, lockstep=False)
+        if i % 5 == 0:
+            server.handle_message(protocol.mux_message(2, 'ul0.1'), ticked_zombie, lockstep=False)
+        server.tick_once('idle' if i % 7 == 0 else 'repeat')
+    server.handle_message('d', zombie)
+    server.close_log()
+
+    events, seeds = read_session_log(path)
+    assert len(seeds) == 5
+    assert sum(event[0] == 'tick' for event in events) == 20
+
+    replayed = replay(path)
+    assert replayed.tick_count == server.tick_count
+    assert sorted(replayed.rooms) == sorted(server.rooms)
+    for room_id, room in server.rooms.items():
+        other = replayed.rooms[room_id]
+        assert other.tick == room.tick and other.map_index == room.map_index
+        assert other.players_pose == room.players_pose
+        for player, (obs, rew, done) in room.players_obs.items():
+            np.testing.assert_array_equal(other.players_obs[player][0], obs)
+            assert other.players_obs[player][1:] == (rew, done)
+
+
+def test_many_senders(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    log = SessionLogWriter(path)
+    # more than a uint16 address id holds, like shm clients reconnecting through new channels
+    senders = ['/dev/shm/zombiechase-1-{0}'.format(i) for i in range(70000)]
+    for sender in senders:
+        log.message(0, sender, 'uu', True)
+    log.message(1, senders[0], 'ul', False)
+    log.close()
+
+    events, _ = read_session_log(path)
+    assert [event[2] for event in events] == senders + senders[:1]
+    assert events[-1] == ('message', 1, senders[0], 'ul', False)
+
+    # a log of the uint16 layout is refused rather than misread
+    with open(path, 'r+b') as f:
+        f.seek(2)
+        f.write(bytes([VERSION - 1]))
+    with pytest.raises(ValueError):
+        read_session_log(path)
@@ -0,0 +1,71 @@
+import os
+import socket
+import pytest
+
+from baselines.PyGameMultiAgent import shmtransport
+from baselines.PyGameMultiAgent.shmtransport import Channel
+
+pytestmark = pytest.mark.skipif(not shmtransport.available(), reason='needs mkfifo')
+
+
+def test_channel_roundtrip(tmpdir):
+    path = os.path.join(str(tmpdir), 'channel')
+    client = Channel(path, is_server=False, create=True, capacity=256)
+    server = Channel(path, is_server=True)
+
+    # wraps around the ring many times with odd message sizes
+    for i in range(200):
+        msgs = [bytes([i % 256]) * (i % 37 + j) for j in range(3)]
+        for msg in msgs:
+            assert client.send(msg)
+        assert server.receive_all() == msgs
+        assert server.send(msgs[0])
+        assert client.receive() == msgs[0]
+
+    # full ring drops like UDP
+    assert not client.send(b'x' * 300)
+
+    with pytest.raises(socket.timeout):
+        client.receive(timeout=0.01)
+
+    server.close()
+    client.close()
+    assert not os.path.exists(path) and not os.path.exists(path + '.up')
+
+
+def test_server_only_attaches_to_client_channels(tmpdir):
+    from baselines.PyGameMultiAgent.gameserver import GameServer
+    from baselines.PyGameMultiAgent import protocol
+
+    server = GameServer(port=0, visualize=False)
+    server._sendto = lambda payload, addr: None
+    try:
+        for path in ('/etc/passwd', os.path.join(str(tmpdir), 'zombiechase-1-x'),
+                     os.path.join(shmtransport._shm_dir(), 'zombiechase-missing')):
+            server.handle_message(protocol.connect_message('z', protocol.OBS, channel=path), ('127.0.0.1', 1))
+        assert not server.channels and not server.player_room
+
+        name = '{0}{1}-test'.format(shmtransport.CHANNEL_PREFIX, os.getpid())
+        client = Channel(os.path.join(shmtransport._shm_dir(), name), is_server=False, create=True)
+        server.handle_message(protocol.connect_message('z', protocol.OBS, channel=client.path), ('127.0.0.1', 1))
+        assert client.path in server.channels and client.path in server.player_room
+        # unlinked once attached, the channel still works
+        assert not os.path.exists(client.path) and not os.path.exists(client.path + '.up')
+        assert client.send(b'uu')
+        assert server.channels[client.path].receive_all() == [b'uu']
+        client.close()
+    finally:
+        server.listener.close()
+
+
+def test_sweep_stale_channels():
+    # pid 2**22 + 1 is above the kernel's pid_max
+    stale = Channel(os.path.join(shmtransport._shm_dir(), '{0}{1}-test'.format(shmtransport.CHANNEL_PREFIX, 2 ** 22 + 1)),
+                    is_server=False, create=True)
+    alive = Channel(os.path.join(shmtransport._shm_dir(), '{0}{1}-test'.format(shmtransport.CHANNEL_PREFIX, os.getpid())),
+                    is_server=False, create=True)
+    shmtransport.sweep_stale_channels()
+    assert not os.path.exists(stale.path) and not os.path.exists(stale.path + '.down')
+    assert os.path.exists(alive.path)
+    stale.close()
+    alive.close()
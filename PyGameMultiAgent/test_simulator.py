@@ -0,0 +1,99 @@
+import numpy as np
+
+from baselines.PyGameMultiAgent.simulator import ZombieChaseVecEnv
+from baselines.PyGameMultiAgent.MyEnv import ZombieChasePlayerEnv
+from baselines.PyGameMultiAgent.reward import calculate_reward_batch
+from baselines.PyGameMultiAgent.mapstore import load_world
+from baselines.PyGameMultiAgent.bot import Bot
+
+
+def test_vec_env_step():
+    env = ZombieChaseVecEnv(8, n_zombies=2, n_bots=2, max_episode_steps=20, seed=0)
+    obs = env.reset()
+    assert obs.shape == (8,) + env.observation_space.shape
+
+    done_seen = False
+    for _ in range(25):
+        obs, rew, done, infos = env.step(np.random.randint(0, 4, size=8))
+        assert obs.shape == (8,) + env.observation_space.shape
+        assert rew.shape == done.shape == (8,)
+        assert len(infos) == 8
+        # zombies of one world finish together
+        assert np.array_equal(done[0::2], done[1::2])
+        done_seen |= done.any()
+    assert done_seen
+
+    frame = env.render(mode='rgb_array')
+    assert frame.ndim == 3 and frame.dtype == np.uint8
+
+    # every actor stays on free cells
+    for world, worlds in env.sim.world_groups():
+        poses = env.sim.poses[worlds].reshape(-1, 4)
+        assert not world.is_wall(poses[:, 0], poses[:, 1]).any()
+
+
+# the per-actor loops ZombieChasePlayerEnv._calculate_reward used to run
+def reference_reward(self_pos, actors, last_self_pose, last_actors, perception_grids=15):
+    def closest_bot(pos, actors):
+        closest_dist_sqr, target = 100000000, None
+        for actor in actors:
+            if actor[3] == 1 and (actor[0] - pos[0])**2 + (actor[1] - pos[1])**2 < closest_dist_sqr:
+                closest_dist_sqr, target = (actor[0] - pos[0])**2 + (actor[1] - pos[1])**2, actor
+        return np.sqrt(closest_dist_sqr), target
+
+    def blocking_distance(pos, actors):
+        distance, target = closest_bot(pos, actors)
+        if distance > perception_grids or target is None:
+            return 0
+        unit = np.asarray([target[0] - pos[0], target[1] - pos[1]])
+        unit = unit / np.linalg.norm(unit)
+        maximum_proj_length = 0
+        for ax, ay, _, atag in actors:
+            if atag == 0 and (pos[0] != ax or pos[1] != ay):
+                actor_to_target = np.asarray([target[0] - ax, target[1] - ay])
+                if np.linalg.norm(actor_to_target) < Bot.alertRadius:
+                    actor_proj_len = np.dot(unit, actor_to_target)
+                    if 0 < actor_proj_len < distance:
+                        maximum_proj_length = max(maximum_proj_length, actor_proj_len)
+        return maximum_proj_length
+
+    old_distance, _ = closest_bot(last_self_pose, last_actors)
+    curr_distance, _ = closest_bot(self_pos, actors)
+    rew = 0
+    if max(old_distance, curr_distance) < perception_grids and curr_distance < old_distance:
+        rew += (old_distance - curr_distance) * 0.01
+    if curr_distance < Bot.alertRadius:
+        rew += 2 / max(2, curr_distance) * (curr_distance - blocking_distance(self_pos, actors)) / curr_distance
+    if curr_distance < 2:
+        return rew + 10, True
+    return rew, False
+
+
+def test_reward_batch_matches_env():
+    rng = np.random.RandomState(0)
+    env = object.__new__(ZombieChasePlayerEnv)
+    env.world = load_world(0)
+
+    cases = []
+    for _ in range(200):
+        me = tuple(rng.uniform(10, 40, 3))
+        actors = [(me[0] + rng.uniform(-12, 12), me[1] + rng.uniform(-12, 12), 0.0, rng.randint(0, 2))
+                  for _ in range(rng.randint(0, 5))]
+        last_me = (me[0] + rng.uniform(-1, 1), me[1] + rng.uniform(-1, 1), me[2])
+        last_actors = [(x + rng.uniform(-1, 1), y + rng.uniform(-1, 1), a, tag) for x, y, a, tag in actors]
+        cases.append((me, actors, last_me, last_actors))
+
+        expected_rew, expected_done = reference_reward(me, actors, last_me, last_actors)
+        rew, done = env._calculate_reward(me, actors, last_me, last_actors)
+        assert np.isclose(rew, expected_rew)
+        assert done == expected_done
+
+    # a batch of envs, shorter actor lists padded with nan
+    width = max(len(actors) for _, actors, _, _ in cases)
+    pad = lambda actors: np.concatenate([np.reshape(actors, (-1, 4)), np.full((width - len(actors), 4), np.nan)])
+    rew, done = calculate_reward_batch([c[0] for c in cases], [pad(c[1]) for c in cases],
+                                       [c[2] for c in cases], [pad(c[3]) for c in cases])
+    for i, (me, actors, last_me, last_actors) in enumerate(cases):
+        expected_rew, expected_done = reference_reward(me, actors, last_me, last_actors)
+        assert np.isclose(rew[i], expected_rew)
+        assert done[i] == expected_done
@@ -0,0 +1,33 @@
+import numpy as np
+
+from baselines.PyGameMultiAgent.spatialhash import SpatialHash
+
+
+def test_queries_match_brute_force():
+    rng = np.random.RandomState(0)
+    poses = {i: (rng.uniform(-5, 55), rng.uniform(-5, 55), 0.0, rng.randint(0, 2)) for i in range(300)}
+    index = SpatialHash(cell_size=7)
+    for key, pose in poses.items():
+        index.update(key, pose)
+
+    # incremental moves and removals
+    for key in range(0, 300, 3):
+        poses[key] = (poses[key][0] + rng.uniform(-9, 9), poses[key][1] + rng.uniform(-9, 9), 0.0, poses[key][3])
+        index.update(key, poses[key])
+    for key in range(1, 300, 10):
+        del poses[key]
+        index.remove(key)
+    assert len(index) == len(poses)
+
+    for _ in range(100):
+        x, y, radius = rng.uniform(0, 50), rng.uniform(0, 50), rng.uniform(0, 20)
+        dist = {key: np.hypot(pose[0] - x, pose[1] - y) for key, pose in poses.items()}
+        assert sorted(index.query_radius(x, y, radius)) == sorted(k for k, d in dist.items() if d < radius)
+        assert sorted(index.query_radius(x, y, radius, tag=1)) == sorted(k for k, d in dist.items() if d < radius and poses[k][3] == 1)
+
+        key, distance = index.nearest(x, y, tag=0)
+        assert np.isclose(distance, min(d for k, d in dist.items() if poses[k][3] == 0))
+        assert np.isclose(dist[key], distance)
+
+    assert index.nearest(1000, 1000, tag=1, max_radius=5) == (None, np.inf)
+    assert index.nearest(1000, 1000, tag=1)[0] is not None
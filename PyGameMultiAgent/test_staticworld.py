@@ -0,0 +1,157 @@
+import os
+from math import sin, cos
+import numpy as np
+
+from baselines.PyGameMultiAgent.staticworld import StaticWorld
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Maps')
+
+
+def _random_poses(world, n, rng):
+    return np.stack([rng.uniform(-1, world.width + 1, n),
+                     rng.uniform(-1, world.length + 1, n),
+                     rng.uniform(0, 2 * np.pi, n)], axis=1)
+
+
+def test_raycast_sectors_matches_raycast_wall():
+    rng = np.random.RandomState(0)
+    for map_index in (0, 3, 17):
+        world = StaticWorld(os.path.join(MAPS_DIR, 'map_{0}.csv'.format(map_index)))
+        poses = _random_poses(world, 50, rng)
+        distances = world.rayCastSectors(poses[:, :2])
+        for pose, row in zip(poses, distances):
+            expected = [world.rayCastWall((pose[0], pose[1]), s * 360 / StaticWorld.radar_blocks)
+                        for s in range(StaticWorld.radar_blocks)]
+            assert np.array_equal(row, expected)
+
+
+
+def test_trace_sectors_matches_sample_sectors():
+    rng = np.random.RandomState(4)
+    for map_index in (0, 3, 17):
+        world = StaticWorld(os.path.join(MAPS_DIR, 'map_{0}.csv'.format(map_index)))
+        centers = _random_poses(world, 300, rng)[:, :2]
+        expected = world._sample_sectors(centers, 15)
+        assert np.array_equal(world._trace_sectors(centers, 15), expected)
+        assert np.array_equal(world._trace_sectors(centers, 7), world._sample_sectors(centers, 7))
+        # a batch this large is traced
+        assert len(centers) >= world.trace_min_batch
+        assert np.array_equal(world.rayCastSectors(centers), expected)
+
+
+def test_clearance():
+    world = StaticWorld(os.path.join(MAPS_DIR, 'map_3.csv'))
+    # gap between every cell and the nearest wall cell (border included), brute force
+    walls = np.argwhere(world.walls_padded)
+    cells = np.argwhere(np.ones_like(world.walls_padded))
+    gap_rows = np.maximum(np.abs(cells[:, None, 0] - walls[None, :, 0]) - 1, 0)
+    gap_cols = np.maximum(np.abs(cells[:, None, 1] - walls[None, :, 1]) - 1, 0)
+    gap = np.sqrt(gap_rows ** 2 + gap_cols ** 2).min(axis=1)
+    assert np.allclose(world.clearance[cells[:, 0], cells[:, 1]], gap)
+    assert (world.clearance[world.walls_padded] == 0).all()
+
+
+def test_sector_table():
+    rng = np.random.RandomState(5)
+    world = StaticWorld(os.path.join(MAPS_DIR, 'map_17.csv'))
+    tabled = StaticWorld(os.path.join(MAPS_DIR, 'map_17.csv'), sector_table=True)
+    assert world.sector_table is None
+    assert tabled.sector_table.shape == world.walls_padded.shape + (StaticWorld.radar_blocks,)
+
+    # exact at cell centers
+    cells = np.argwhere(~world.walls)
+    cells = cells[rng.randint(len(cells), size=500)]
+    centers = np.stack([cells[:, 1] + 0.5, world.length - 1 - cells[:, 0] - 0.5], axis=1)
+    assert np.array_equal(tabled.rayCastSectors(centers), world.rayCastSectors(centers))
+
+    # anywhere else in the cell the distances of its center
+    points = centers + rng.uniform(-0.49, 0.49, centers.shape)
+    table = tabled.rayCastSectors(points)
+    assert np.array_equal(table, world.rayCastSectors(centers))
+    # which is off by at most half a cell diagonal plus half a sample, unless the ray grazes a corner
+    exact = world.rayCastSectors(points)
+    assert (np.abs(table - exact) <= 0.5 * np.sqrt(2) + 0.5).mean() > 0.85
+
+    # other distances are not in the table
+    assert np.array_equal(tabled.rayCastSectors(points, 7), world.rayCastSectors(points, 7))
+
+
+def test_radar_obs_batch_matches_single():
+    rng = np.random.RandomState(1)
+    world = StaticWorld(os.path.join(MAPS_DIR, 'map_5.csv'))
+    poses = _random_poses(world, 40, rng)
+    actors = [(rng.uniform(0, world.width), rng.uniform(0, world.length), 0.0, rng.randint(0, 2)) for _ in range(8)]
+
+    batch = world.to_local_radar_obs_batch(poses, actors)
+    assert batch.shape == (len(poses), world.radar_length, 1)
+    for pose, obs in zip(poses, batch):
+        assert np.array_equal(obs, world.to_local_radar_obs(tuple(pose), actors))
+
+
+def test_radar_obs_actor_sector():
+    world = StaticWorld(os.path.join(MAPS_DIR, 'map_0.csv'))
+    free = np.argwhere(world.walls == 0)[0]
+    x, y = float(free[1]), float(world.length - 1 - free[0])
+
+    # a bot straight ahead is seen in the front sector, the pose itself is ignored
+    obs = world.to_local_radar_obs((x, y, 0.0), [(x + 0.5, y, 0.0, 1), (x, y, 0.0, 0)])[:, 0]
+    assert obs[0] == 3
+    assert np.isclose(obs[StaticWorld.radar_blocks], 0.5 / StaticWorld.perception_grids)
+
+    # padding rows are ignored
+    padded = world.to_local_radar_obs((x, y, 0.0), [(x + 0.5, y, 0.0, 1), (np.nan,) * 4])[:, 0]
+    assert np.array_equal(obs, padded)
+
+
+# the per-cell loop to_local_obs used to run
+def _reference_local_obs(world, pos, actors):
+    obs = np.zeros((world.local_length, world.local_width), dtype=np.int64)
+    x, y, angle = pos
+    local_frame_x_axis = np.asarray([sin(angle), -cos(angle)])
+    local_frame_y_axis = np.asarray([cos(angle), sin(angle)])
+    for local_frame_x in range(-world.perception_grids, world.perception_grids + 1):
+        for local_frame_y in range(-world.perception_grids, world.perception_grids + 1):
+            world_frame_x, world_frame_y = local_frame_x_axis * local_frame_x + local_frame_y_axis * local_frame_y
+            if world[(world_frame_x + x, world_frame_y + y)] == 1:
+                obs[local_frame_x + world.perception_grids][world.perception_grids - local_frame_y] = 1
+    for x1, y1, _, tag in actors:
+        local_frame_x1 = int(sin(angle) * (x1 - x) - cos(angle) * (y1 - y))
+        local_frame_y1 = int(cos(angle) * (x1 - x) + sin(angle) * (y1 - y))
+        if -world.perception_grids <= local_frame_x1 <= world.perception_grids and \
+                -world.perception_grids <= local_frame_y1 <= world.perception_grids:
+            obs[local_frame_x1 + world.perception_grids][world.perception_grids - local_frame_y1] = tag + 2
+    return obs[..., None]
+
+
+def test_local_obs_matches_loop():
+    rng = np.random.RandomState(2)
+    for map_index in (0, 8):
+        world = StaticWorld(os.path.join(MAPS_DIR, 'map_{0}.csv'.format(map_index)))
+        poses = _random_poses(world, 20, rng)
+        actors = [(rng.uniform(0, world.width), rng.uniform(0, world.length), 0.0, rng.randint(0, 2)) for _ in range(30)]
+
+        batch = world.to_local_obs_batch(poses, actors)
+        assert batch.shape == (len(poses), world.local_length, world.local_width, 1)
+        for pose, obs in zip(poses, batch):
+            assert np.array_equal(obs, _reference_local_obs(world, tuple(pose), actors))
+            assert np.array_equal(obs, world.to_local_obs(tuple(pose), actors))
+
+
+def test_rgb_frames():
+    rng = np.random.RandomState(3)
+    world = StaticWorld(os.path.join(MAPS_DIR, 'map_4.csv'))
+    poses = _random_poses(world, 5, rng)
+    actors = [(rng.uniform(0, world.width), rng.uniform(0, world.length), 0.0, rng.randint(0, 2)) for _ in range(10)]
+
+    frames = world.to_local_rgb_batch(poses, actors)
+    assert frames.shape == (5, world.local_length * world.zoom, world.local_width * world.zoom, 3)
+    obs = world.to_local_obs_batch(poses, actors)[..., 0]
+    # top left pixel of local cell (i, j) is at row j * zoom, column i * zoom
+    assert np.array_equal(frames[:, ::world.zoom, ::world.zoom], StaticWorld.local_palette[obs.transpose(0, 2, 1)])
+
+    image = world.wall_image()
+    assert np.array_equal(image[::world.zoom, ::world.zoom], StaticWorld.global_palette[world.data])
+    frame = world.render_global_rgb([(10.5, 20.5, 0.0, 1)])
+    row, col = int((world.length - 1 - 20.5) * world.zoom), int(10.5 * world.zoom)
+    assert (frame[row, col] == StaticWorld.local_palette[3]).all()
+    assert np.array_equal(world.wall_image(), image)
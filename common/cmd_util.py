@@ -53,6 +53,12 @@ def make_vec_env(env_id, env_type, num_env, seed,
         )
 
     set_global_seeds(seed)
+    if env_type == 'custom' and env_id == 'ZombieChaseSim':
+        # in process batched simulator, already a VecEnv
+        from PyGameMultiAgent.simulator import ZombieChaseVecEnv
+        from baselines.common.vec_env.vec_monitor import VecMonitor
+        env = ZombieChaseVecEnv(num_env, seed=seed, **env_kwargs)
+        return VecMonitor(env, logger_dir and os.path.join(logger_dir, str(mpi_rank) + '.sim'))
     if not force_dummy and num_env > 1:
         return SubprocVecEnv([make_thunk(i + start_index, initializer=initializer) for i in range(num_env)])
     else:
@@ -80,7 +86,10 @@ def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.
         env = retro_wrappers.make_retro(game=env_id, max_episode_steps=10000, use_restricted_actions=retro.Actions.DISCRETE, state=gamestate)
     elif env_type == 'custom':
         from PyGameMultiAgent.MyEnv import ZombieChasePlayerEnv
-        env = ZombieChasePlayerEnv()
+        # env_kwargs room may be per worker, e.g. room='{mpi_rank}.{subrank}' puts every worker in its own GameServer room
+        if env_kwargs.get('room') is not None:
+            env_kwargs = dict(env_kwargs, room=str(env_kwargs['room']).format(mpi_rank=mpi_rank, subrank=subrank))
+        env = ZombieChasePlayerEnv(**env_kwargs)
     else:
         env = gym.make(env_id, **env_kwargs)
 
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+
+# Replay storage in np.memmap files
+#   A storage directory holds one .npy file per array and state.json, the scalar state of the
+#   buffer (ring index, number of entries, ...) as of the last save_state. The files are
+#   preallocated at full size when created. Opening a directory that already has them maps
+#   them as they are. Nothing is read until it is touched, so a buffer of any size reopens
+#   at once, and the OS page cache decides which parts of it stay in memory.
+
+
+def _path(directory, name):
+    return os.path.join(directory, name + '.npy')
+
+
+def open_arrays(directory, specs):
+    """Map the arrays of a storage directory, creating it and the missing files.
+
+    Parameters
+    ----------
+    directory: str
+        storage directory
+    specs: dict
+        name -> (shape, dtype) or (shape, dtype, fill), fill being the initial value
+        of a new file (0 if not given)
+
+    Returns
+    -------
+    arrays: dict
+        name -> np.memmap
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {}
+    for name, spec in specs.items():
+        shape, dtype = tuple(spec[0]), np.dtype(spec[1])
+        path = _path(directory, name)
+        if os.path.exists(path):
+            array = np.lib.format.open_memmap(path, mode='r+')
+            if array.shape != shape or array.dtype != dtype:
+                raise ValueError('{} holds a {} {} array, not {} {}'.format(path, array.shape, array.dtype, shape, dtype))
+        else:
+            array = np.lib.format.open_memmap(path, mode='w+', shape=shape, dtype=dtype)
+            if len(spec) > 2 and spec[2] != 0:
+                array[...] = spec[2]
+        arrays[name] = array
+    return arrays
+
+
+def load_state(directory):
+    """state dict of the last save_state in directory, None if there was none"""
+    path = os.path.join(directory, 'state.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(directory, state, arrays=()):
+    """Flush arrays (np.memmap) to their files, then write state (json-serializable dict)"""
+    for array in arrays:
+        array.flush()
+    path = os.path.join(directory, 'state.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,89 @@
+import queue
+import threading
+
+import numpy as np
+
+# Replay batches sampled ahead of the learner
+#   A BatchPrefetcher calls sample() on a thread and keeps up to queue_size of its batches ready.
+#   The train step (TensorFlow releases the GIL while it runs) then overlaps with sampling and assembling
+#   the next batches. sample() runs under prefetcher.lock, so everything else that touches the replay
+#   buffer (adding transitions, updating priorities) has to hold the lock too.
+#   A batch is used up to queue_size + 1 steps after it was sampled, so it misses the transitions added
+#   and the priorities updated in between. A prioritized batch should carry the buffer's num_writes from
+#   its sampling, to hand to update_priorities (see deepq.PrioritizedReplayBuffer.update_priorities).
+
+
+def contiguous(batch, dtypes=None):
+    """C-contiguous copies of the arrays of batch (list, tuple or dict).
+
+    dtypes is one dtype for all arrays or one per array (a list, or a dict for a dict batch).
+    None keeps an array's dtype, and None entries of batch stay None.
+    """
+    keys = list(batch.keys()) if isinstance(batch, dict) else range(len(batch))
+    if dtypes is None or isinstance(dtypes, (type, str, np.dtype)):
+        dtypes = {key: dtypes for key in keys}
+    converted = {key: None if batch[key] is None else np.ascontiguousarray(batch[key], dtype=dtypes[key])
+                 for key in keys}
+    if isinstance(batch, dict):
+        return converted
+    return type(batch)(converted[key] for key in keys)
+
+
+class _Failure(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class BatchPrefetcher(object):
+    def __init__(self, sample, queue_size=2):
+        """Sample batches on a thread, started by the first get.
+
+        Parameters
+        ----------
+        sample: () -> batch
+            draws a batch from the replay buffer, runs under self.lock
+        queue_size: int
+            how many batches are kept ready
+        """
+        self.sample = sample
+        self.lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._running = False
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            try:
+                with self.lock:
+                    item = self.sample()
+            except Exception as e:
+                item = _Failure(e)
+            while self._running:
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if isinstance(item, _Failure):
+                return
+
+    def get(self):
+        """The oldest ready batch, waits for one if there is none. Raises what sample raised."""
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        item = self._queue.get()
+        if isinstance(item, _Failure):
+            self.close()
+            raise item.exception
+        return item
+
+    def close(self):
+        """Stop the thread and drop the batches it sampled"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while not self._queue.empty():
+            self._queue.get()
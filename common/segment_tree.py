@@ -1,8 +1,10 @@
 import operator
 
+import numpy as np
+
 
 class SegmentTree(object):
-    def __init__(self, capacity, operation, neutral_element):
+    def __init__(self, capacity, operation, neutral_element, array_operation=None):
         """Build a Segment Tree data structure.
 
         https://en.wikipedia.org/wiki/Segment_tree
@@ -27,11 +29,16 @@ class SegmentTree(object):
         neutral_element: obj
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
+        array_operation: lambda np.array, np.array -> np.array
+            elementwise version of operation, used by the batched `update`
+            (eg. np.maximum for max). Defaults to operation.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        # node i has children 2 * i and 2 * i + 1, the leaves are capacity ... 2 * capacity - 1
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
+        self._array_operation = array_operation or operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
         if start == node_start and end == node_end:
@@ -74,18 +81,55 @@ class SegmentTree(object):
         return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
 
     def __setitem__(self, idx, val):
+        # plain floats: much cheaper per element than indexing the array
+        value = memoryview(self._value)
         # index of the leaf
         idx += self._capacity
-        self._value[idx] = val
+        value[idx] = float(val)
         idx //= 2
         while idx >= 1:
-            self._value[idx] = self._operation(
-                self._value[2 * idx],
-                self._value[2 * idx + 1]
+            value[idx] = self._operation(
+                value[2 * idx],
+                value[2 * idx + 1]
             )
             idx //= 2
 
+    def update(self, idxes, values):
+        """Batched __setitem__: arr[idxes[i]] = values[i] for every i,
+        the last value wins for a repeated index.
+
+        The affected ancestors are recomputed level by level, with a few
+        array operations per level.
+
+        Parameters
+        ----------
+        idxes: np.array
+            indexes of the elements to set
+        values: np.array
+            their new values
+        """
+        idxes = np.asarray(idxes, dtype=np.int64).ravel()
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64).ravel(), idxes.shape)
+        if len(idxes) == 0:
+            return
+        assert 0 <= idxes.min() and idxes.max() < self._capacity
+        # last occurrence of every index
+        idxes, last = np.unique(idxes[::-1], return_index=True)
+        self._value[idxes + self._capacity] = values[::-1][last]
+
+        # row i holds the children of node i
+        children = self._value.reshape(-1, 2)
+        nodes = (idxes + self._capacity) // 2
+        while nodes[0] >= 1:  # all at the same depth, up to the root
+            # siblings share a parent, which is then just computed twice
+            pairs = children[nodes]
+            self._value[nodes] = self._array_operation(pairs[:, 0], pairs[:, 1])
+            nodes //= 2
+
     def __getitem__(self, idx):
+        if isinstance(idx, np.ndarray):
+            assert ((0 <= idx) & (idx < self._capacity)).all()
+            return self._value[self._capacity + idx]
         assert 0 <= idx < self._capacity
         return self._value[self._capacity + idx]
 
@@ -112,31 +156,50 @@ class SumSegmentTree(SegmentTree):
 
         Parameters
         ----------
-        perfixsum: float
-            upperbound on the sum of array prefix
+        perfixsum: float or np.array
+            upperbound on the sum of array prefix, or an array of them:
+            then all of them descend the tree together, one level at a time
 
         Returns
         -------
-        idx: int
+        idx: int or np.array
             highest index satisfying the prefixsum constraint
         """
+        if isinstance(prefixsum, np.ndarray):
+            return self._find_prefixsum_idxes(prefixsum)
         assert 0 <= prefixsum <= self.sum() + 1e-5
+        value = memoryview(self._value)
         idx = 1
         while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
+            if value[2 * idx] > prefixsum:
                 idx = 2 * idx
             else:
-                prefixsum -= self._value[2 * idx]
+                prefixsum -= value[2 * idx]
                 idx = 2 * idx + 1
         return idx - self._capacity
 
+    def _find_prefixsum_idxes(self, prefixsum):
+        assert (0 <= prefixsum).all() and (prefixsum <= self.sum() + 1e-5).all()
+        prefixsum = prefixsum.astype(np.float64)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        left = np.empty(prefixsum.shape)
+        go_right = np.empty(prefixsum.shape, dtype=bool)
+        for _ in range(self._capacity.bit_length() - 1):  # one level at a time, in place
+            idx *= 2
+            np.take(self._value, idx, out=left)
+            np.less_equal(left, prefixsum, out=go_right)
+            np.subtract(prefixsum, left, out=prefixsum, where=go_right)
+            idx += go_right
+        return idx - self._capacity
+
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
             operation=min,
-            neutral_element=float('inf')
+            neutral_element=float('inf'),
+            array_operation=np.minimum
         )
 
     def min(self, start=0, end=None):
@@ -0,0 +1,31 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from baselines.common.prefetch import BatchPrefetcher, contiguous
+
+
+def test_contiguous():
+    a = np.arange(12, dtype=np.float64).reshape(3, 4)
+    batch = contiguous((a[:, ::2], a, None), [np.float32, None, None])
+    assert batch[0].flags['C_CONTIGUOUS'] and batch[0].dtype == np.float32
+    assert batch[1].dtype == np.float64 and batch[2] is None
+    assert contiguous({'x': a.T}, np.float32)['x'].flags['C_CONTIGUOUS']
+
+
+def test_batches_in_order():
+    counter = itertools.count()
+    prefetcher = BatchPrefetcher(lambda: next(counter), queue_size=3)
+    assert [prefetcher.get() for _ in range(10)] == list(range(10))
+    prefetcher.close()
+    # at most queue_size batches and the one waiting to be queued were sampled ahead
+    assert next(counter) <= 10 + 3 + 1
+
+
+def test_sample_error_is_raised():
+    def sample():
+        raise ValueError('empty buffer')
+    prefetcher = BatchPrefetcher(sample)
+    with pytest.raises(ValueError):
+        prefetcher.get()
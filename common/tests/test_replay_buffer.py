@@ -0,0 +1,170 @@
+import numpy as np
+from gym.spaces import Box, Discrete
+
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from baselines.ddpg.memory import Memory
+
+
+def _fill(buffer, count):
+    for i in range(count):
+        buffer.add(np.full((2, 3), i, dtype=np.float32), i % 4, float(i), np.full((2, 3), i + 1, dtype=np.float32), i % 2)
+
+
+def test_array_storage_matches_list():
+    spaces = dict(observation_space=Box(low=-10, high=10, shape=(2, 3), dtype=np.float32), action_space=Discrete(4))
+    list_buffer, array_buffer = ReplayBuffer(5), ReplayBuffer(5, **spaces)
+    _fill(list_buffer, 8)
+    _fill(array_buffer, 8)
+    assert len(list_buffer) == len(array_buffer) == 5
+
+    idxes = [0, 4, 2, 2]
+    for expected, actual in zip(list_buffer._encode_sample(idxes), array_buffer._encode_sample(idxes)):
+        np.testing.assert_array_equal(actual, expected)
+
+    obs_t, actions, rewards, obs_tp1, dones = array_buffer.sample(16)
+    assert obs_t.shape == (16, 2, 3) and obs_t.dtype == np.float32 and actions.shape == (16,)
+    # only the last 5 transitions (3..7) are left
+    assert set(rewards) <= {3., 4., 5., 6., 7.}
+    np.testing.assert_array_equal(obs_tp1[:, 0, 0], obs_t[:, 0, 0] + 1)
+    np.testing.assert_array_equal(dones, rewards % 2)
+
+
+def test_prioritized_array_storage():
+    spaces = dict(observation_space=Box(low=-10, high=10, shape=(2, 3), dtype=np.float32), action_space=Discrete(4))
+    buffer = PrioritizedReplayBuffer(8, alpha=1.0, **spaces)
+    _fill(buffer, 4)
+    buffer.update_priorities([0, 1, 2, 3], [1e-6, 1e-6, 1.0, 1e-6])
+    obs_t, actions, rewards, obs_tp1, dones, weights, idxes = buffer.sample(8, beta=1.0)
+    assert len(buffer) == 4 and set(idxes) == {2}
+    assert (rewards == 2.).all()
+
+
+def test_prioritized_weights_and_updates():
+    buffer = PrioritizedReplayBuffer(16, alpha=0.5)
+    _fill(buffer, 10)
+    priorities = np.arange(1, 11, dtype=np.float64)
+    buffer.update_priorities(list(range(10)) + [4], list(priorities) + [20.0])
+    assert buffer._max_priority == 20.0
+    assert np.isclose(buffer._it_sum[4], 20.0 ** 0.5)
+
+    beta = 0.7
+    *_, weights, idxes = buffer.sample(64, beta)
+    assert idxes.shape == (64,) and idxes.max() < 10
+    p = np.array([buffer._it_sum[i] for i in range(10)]) / buffer._it_sum.sum()
+    expected = (p[idxes] * 10) ** -beta / (p.min() * 10) ** -beta
+    np.testing.assert_allclose(weights, expected)
+
+
+def _frame_stack_episodes(lengths, k=3):
+    """transitions of FrameStack episodes of (2, 2, 1) frames, frame values count up over all episodes"""
+    frame = 0
+    for length in lengths:
+        frames = [np.full((2, 2, 1), frame, dtype=np.uint8)] * k
+        for t in range(length):
+            frame += 1
+            obs_t = np.concatenate(frames, axis=-1)
+            frames = frames[1:] + [np.full((2, 2, 1), frame, dtype=np.uint8)]
+            yield obs_t, frame % 4, float(frame), np.concatenate(frames, axis=-1), float(t == length - 1)
+        frame += 1
+
+
+def test_frame_storage_rebuilds_stacks():
+    spaces = dict(observation_space=Box(low=0, high=255, shape=(2, 2, 3), dtype=np.uint8), action_space=Discrete(4))
+    buffer = ReplayBuffer(12, frame_stack=3, **spaces)
+    added = {}
+    for transition in _frame_stack_episodes([1, 5, 2, 7, 1, 4]):
+        added[buffer.add(*transition)] = transition
+    assert buffer._frames.shape == (15, 2, 2, 1)
+
+    idxes = np.flatnonzero(buffer._sampleable)
+    assert len(buffer) == len(idxes) > 0
+    for i, idx in enumerate(idxes):
+        for expected, actual in zip(added[idx], buffer._encode_sample(idxes)):
+            np.testing.assert_array_equal(actual[i], expected)
+
+    obs_t, actions, rewards, obs_tp1, dones = buffer.sample(32)
+    assert obs_t.shape == obs_tp1.shape == (32, 2, 2, 3)
+    np.testing.assert_array_equal(obs_tp1[..., -1], np.broadcast_to(rewards[:, None, None], (32, 2, 2)))
+
+
+def test_prioritized_frame_storage():
+    spaces = dict(observation_space=Box(low=0, high=255, shape=(2, 2, 3), dtype=np.uint8), action_space=Discrete(4))
+    buffer = PrioritizedReplayBuffer(12, alpha=1.0, frame_stack=3, **spaces)
+    for transition in _frame_stack_episodes([3, 6, 2, 5]):
+        buffer.add(*transition)
+    sampleable = buffer._sampleable
+    # slots without a transition have no priority
+    assert (buffer._it_sum[np.flatnonzero(~sampleable)] == 0).all()
+    *_, weights, idxes = buffer.sample(64, beta=0.5)
+    assert sampleable[idxes].all()
+
+    # a stale index is ignored, the others are updated
+    stale = np.flatnonzero(~sampleable)[0]
+    buffer.update_priorities([stale, idxes[0]], [5.0, 5.0])
+    assert buffer._it_sum[stale] == 0 and buffer._it_sum[idxes[0]] == 5.0
+
+
+def test_memmap_storage_reopens(tmp_path):
+    spaces = dict(observation_space=Box(low=-10, high=10, shape=(2, 3), dtype=np.float32), action_space=Discrete(4))
+    buffer = PrioritizedReplayBuffer(8, alpha=1.0, storage_dir=str(tmp_path), **spaces)
+    _fill(buffer, 6)
+    buffer.update_priorities([1, 4], [3.0, 0.5])
+    buffer.flush()
+    _fill(buffer, 1)  # not flushed, the reopened buffer has 6 transitions
+
+    reopened = PrioritizedReplayBuffer(8, alpha=1.0, storage_dir=str(tmp_path), **spaces)
+    assert isinstance(reopened._obs_t, np.memmap)
+    assert len(reopened) == 6 and reopened._next_idx == 6 and reopened._max_priority == 3.0
+    assert reopened._it_sum[1] == 3.0 and reopened._it_min.min() == 0.5
+    for expected, actual in zip(buffer._encode_sample([0, 1, 5]), reopened._encode_sample([0, 1, 5])):
+        np.testing.assert_array_equal(actual, expected)
+
+    uniform = ReplayBuffer(8, storage_dir=str(tmp_path / 'uniform'), **spaces)
+    _fill(uniform, 8)
+    rewards = uniform.sample(16)[2]
+    assert (np.diff(rewards) >= 0).all()  # gathered in file order
+
+
+def test_memmap_frame_storage_reopens(tmp_path):
+    spaces = dict(observation_space=Box(low=0, high=255, shape=(2, 2, 3), dtype=np.uint8), action_space=Discrete(4))
+    buffer = ReplayBuffer(12, frame_stack=3, storage_dir=str(tmp_path), **spaces)
+    transitions = list(_frame_stack_episodes([4, 6, 3]))
+    added = {}
+    for transition in transitions[:8]:
+        added[buffer.add(*transition)] = transition
+    buffer.flush()
+    for transition in transitions[8:]:  # in the files, but not in the flushed state
+        added[buffer.add(*transition)] = transition
+
+    reopened = ReplayBuffer(12, frame_stack=3, storage_dir=str(tmp_path), **spaces)
+    assert reopened._next_idx == (8 + 3 * 2) % 15
+    for transition in _frame_stack_episodes([2]):
+        added[reopened.add(*transition)] = transition
+    idxes = np.flatnonzero(reopened._sampleable)
+    assert len(reopened) == len(idxes) > 0
+    for i, idx in enumerate(idxes):
+        for expected, actual in zip(added[idx], reopened._encode_sample(idxes)):
+            np.testing.assert_array_equal(actual[i], expected)
+
+
+def test_ddpg_memory_reopens(tmp_path):
+    memory = Memory(10, action_shape=(2,), observation_shape=(3,), storage_dir=str(tmp_path))
+    for i in range(14):
+        memory.append(np.full(3, i), np.full(2, -i), float(i), np.full(3, i + 1), i % 2)
+    memory.flush()
+
+    reopened = Memory(10, action_shape=(2,), observation_shape=(3,), storage_dir=str(tmp_path))
+    assert reopened.nb_entries == 10 and reopened.observations0.start == 4
+    batch = reopened.sample(32)
+    np.testing.assert_array_equal(batch['obs1'][:, 0], batch['obs0'][:, 0] + 1)
+    np.testing.assert_array_equal(batch['rewards'][:, 0], batch['obs0'][:, 0])
+    assert (np.diff(batch['rewards'][:, 0]) >= 0).all() and batch['rewards'].min() >= 4
+
+
+def test_priority_updates_skip_overwritten():
+    buffer = PrioritizedReplayBuffer(4, alpha=1.0)
+    _fill(buffer, 3)
+    num_writes = buffer.num_writes
+    _fill(buffer, 2)  # slots 3 and 0
+    buffer.update_priorities([0, 1, 3], [5.0, 6.0, 7.0], num_writes)
+    assert buffer._it_sum[0] == buffer._it_sum[3] == 1.0 and buffer._it_sum[1] == 6.0
@@ -95,9 +95,38 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_batched_update_matches_setitem():
+    rng = np.random.RandomState(0)
+    for capacity in [1, 2, 16, 1024]:
+        for tree_class in [SumSegmentTree, MinSegmentTree]:
+            batched, reference = tree_class(capacity), tree_class(capacity)
+            for _ in range(20):
+                idxes = rng.randint(capacity, size=rng.randint(1, 40))
+                values = rng.random_sample(len(idxes))
+                batched.update(idxes, values)
+                for idx, value in zip(idxes, values):
+                    reference[idx] = value
+                np.testing.assert_allclose(batched._value, reference._value, rtol=1e-12)
+            np.testing.assert_array_equal(batched[np.arange(capacity)], [reference[i] for i in range(capacity)])
+
+
+def test_batched_prefixsum_idx():
+    rng = np.random.RandomState(1)
+    tree = SumSegmentTree(64)
+    tree.update(np.arange(50), rng.random_sample(50))
+    tree.update([3, 10], [0.0, 0.0])
+    masses = np.concatenate([[0.0, tree.sum()], rng.random_sample(200) * tree.sum()])
+    idxes = tree.find_prefixsum_idx(masses)
+    assert idxes.dtype == np.int64 and idxes.shape == masses.shape
+    assert list(idxes) == [tree.find_prefixsum_idx(float(mass)) for mass in masses]
+    assert 3 not in idxes and 10 not in idxes and idxes.max() < 50
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_batched_update_matches_setitem()
+    test_batched_prefixsum_idx()
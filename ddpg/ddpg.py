@@ -42,6 +42,8 @@ def learn(network, env,
           tau=0.01,
           eval_env=None,
           param_noise_adaption_interval=50,
+          memory_dir=None, # keep the replay memory in np.memmap files here, see Memory
+          prefetch=0, # training batches sampled ahead on a thread, see baselines.common.prefetch
           **network_kwargs):
 
     set_global_seeds(seed)
@@ -60,7 +62,10 @@ def learn(network, env,
     nb_actions = env.action_space.shape[-1]
     assert (np.abs(env.action_space.low) == env.action_space.high).all()  # we assume symmetric actions.
 
-    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape)
+    if memory_dir is not None and MPI is not None and MPI.COMM_WORLD.Get_size() > 1:
+        memory_dir = os.path.join(memory_dir, 'rank{}'.format(rank))
+    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape,
+                    storage_dir=memory_dir)
     critic = Critic(network=network, **network_kwargs)
     actor = Actor(nb_actions, network=network, **network_kwargs)
 
@@ -90,7 +95,7 @@ def learn(network, env,
         gamma=gamma, tau=tau, normalize_returns=normalize_returns, normalize_observations=normalize_observations,
         batch_size=batch_size, action_noise=action_noise, param_noise=param_noise, critic_l2_reg=critic_l2_reg,
         actor_lr=actor_lr, critic_lr=critic_lr, enable_popart=popart, clip_norm=clip_norm,
-        reward_scale=reward_scale)
+        reward_scale=reward_scale, prefetch=prefetch)
     logger.info('Using agent with the following configuration:')
     logger.info(str(agent.__dict__.items()))
 
@@ -262,6 +267,8 @@ def learn(network, env,
         if rank == 0:
             logger.dump_tabular()
         logger.info('')
+        with agent.memory_lock:
+            memory.flush()
         logdir = logger.get_dir()
         if rank == 0 and logdir:
             if hasattr(env, 'get_state'):
@@ -271,5 +278,7 @@ def learn(network, env,
                 with open(os.path.join(logdir, 'eval_env_state.pkl'), 'wb') as f:
                     pickle.dump(eval_env.get_state(), f)
 
+    if agent.prefetcher is not None:
+        agent.prefetcher.close()
 
     return agent
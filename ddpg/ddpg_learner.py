@@ -1,3 +1,4 @@
+import threading
 from copy import copy
 from functools import reduce
 
@@ -7,6 +8,7 @@ import tensorflow.contrib as tc
 
 from baselines import logger
 from baselines.common.mpi_adam import MpiAdam
+from baselines.common.prefetch import BatchPrefetcher, contiguous
 import baselines.common.tf_util as U
 from baselines.common.mpi_running_mean_std import RunningMeanStd
 try:
@@ -67,7 +69,7 @@ class DDPG(object):
     def __init__(self, actor, critic, memory, observation_shape, action_shape, param_noise=None, action_noise=None,
         gamma=0.99, tau=0.001, normalize_returns=False, enable_popart=False, normalize_observations=True,
         batch_size=128, observation_range=(-5., 5.), action_range=(-1., 1.), return_range=(-np.inf, np.inf),
-        critic_l2_reg=0., actor_lr=1e-4, critic_lr=1e-3, clip_norm=None, reward_scale=1.):
+        critic_l2_reg=0., actor_lr=1e-4, critic_lr=1e-3, clip_norm=None, reward_scale=1., prefetch=0):
         # Inputs.
         self.obs0 = tf.placeholder(tf.float32, shape=(None,) + observation_shape, name='obs0')
         self.obs1 = tf.placeholder(tf.float32, shape=(None,) + observation_shape, name='obs1')
@@ -99,6 +101,15 @@ class DDPG(object):
         self.stats_sample = None
         self.critic_l2_reg = critic_l2_reg
 
+        # Training batches sampled ahead on a thread (see baselines.common.prefetch).
+        if prefetch:
+            self.prefetcher = BatchPrefetcher(
+                lambda: contiguous(self.memory.sample(batch_size=self.batch_size), np.float32), prefetch)
+            self.memory_lock = self.prefetcher.lock
+        else:
+            self.prefetcher = None
+            self.memory_lock = threading.Lock()
+
         # Observation normalization.
         if self.normalize_observations:
             with tf.variable_scope('obs_rms'):
@@ -282,13 +293,17 @@ class DDPG(object):
 
         B = obs0.shape[0]
         for b in range(B):
-            self.memory.append(obs0[b], action[b], reward[b], obs1[b], terminal1[b])
+            with self.memory_lock:
+                self.memory.append(obs0[b], action[b], reward[b], obs1[b], terminal1[b])
             if self.normalize_observations:
                 self.obs_rms.update(np.array([obs0[b]]))
 
     def train(self):
         # Get a batch.
-        batch = self.memory.sample(batch_size=self.batch_size)
+        if self.prefetcher is not None:
+            batch = self.prefetcher.get()
+        else:
+            batch = self.memory.sample(batch_size=self.batch_size)
 
         if self.normalize_returns and self.enable_popart:
             old_mean, old_std, target_Q = self.sess.run([self.ret_rms.mean, self.ret_rms.std, self.target_Q], feed_dict={
@@ -344,7 +359,8 @@ class DDPG(object):
         if self.stats_sample is None:
             # Get a sample and keep that fixed for all further computations.
             # This allows us to estimate the change in value for the same set of inputs.
-            self.stats_sample = self.memory.sample(batch_size=self.batch_size)
+            with self.memory_lock:
+                self.stats_sample = self.memory.sample(batch_size=self.batch_size)
         values = self.sess.run(self.stats_ops, feed_dict={
             self.obs0: self.stats_sample['obs0'],
             self.actions: self.stats_sample['actions'],
@@ -369,7 +385,8 @@ class DDPG(object):
             return 0.
 
         # Perturb a separate copy of the policy to adjust the scale for the next "real" perturbation.
-        batch = self.memory.sample(batch_size=self.batch_size)
+        with self.memory_lock:
+            batch = self.memory.sample(batch_size=self.batch_size)
         self.sess.run(self.perturb_adaptive_policy_ops, feed_dict={
             self.param_noise_stddev: self.param_noise.current_stddev,
         })
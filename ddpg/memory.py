@@ -1,12 +1,15 @@
 import numpy as np
 
+from baselines.common import mmap_storage
+
 
 class RingBuffer(object):
-    def __init__(self, maxlen, shape, dtype='float32'):
+    def __init__(self, maxlen, shape, dtype='float32', data=None):
         self.maxlen = maxlen
         self.start = 0
         self.length = 0
-        self.data = np.zeros((maxlen,) + shape).astype(dtype)
+        # data: preallocated (maxlen,) + shape array to use, e.g. an np.memmap
+        self.data = np.zeros((maxlen,) + shape).astype(dtype) if data is None else data
 
     def __len__(self):
         return self.length
@@ -40,18 +43,32 @@ def array_min2d(x):
 
 
 class Memory(object):
-    def __init__(self, limit, action_shape, observation_shape):
+    def __init__(self, limit, action_shape, observation_shape, storage_dir=None):
+        # storage_dir: keep the buffers in np.memmap files in this directory (see baselines.common.mmap_storage),
+        # a memory of the same limit and shapes found there continues from its last flush
         self.limit = limit
-
-        self.observations0 = RingBuffer(limit, shape=observation_shape)
-        self.actions = RingBuffer(limit, shape=action_shape)
-        self.rewards = RingBuffer(limit, shape=(1,))
-        self.terminals1 = RingBuffer(limit, shape=(1,))
-        self.observations1 = RingBuffer(limit, shape=observation_shape)
+        self.storage_dir = storage_dir
+
+        shapes = dict(observations0=observation_shape, actions=action_shape, rewards=(1,), terminals1=(1,),
+                      observations1=observation_shape)
+        arrays = {}
+        if storage_dir is not None:
+            arrays = mmap_storage.open_arrays(
+                storage_dir, {name: ((limit,) + tuple(shape), np.float32) for name, shape in shapes.items()})
+        for name, shape in shapes.items():
+            setattr(self, name, RingBuffer(limit, shape=shape, data=arrays.get(name)))
+
+        state = mmap_storage.load_state(storage_dir) if storage_dir is not None else None
+        if state is not None:
+            for name in shapes:
+                getattr(self, name).start, getattr(self, name).length = state['start'], state['length']
 
     def sample(self, batch_size):
         # Draw such that we always have a proceeding element.
         batch_idxs = np.random.randint(self.nb_entries - 2, size=batch_size)
+        if self.storage_dir is not None:
+            # in file order, neighbouring entries share pages
+            batch_idxs.sort()
 
         obs0_batch = self.observations0.get_batch(batch_idxs)
         obs1_batch = self.observations1.get_batch(batch_idxs)
@@ -78,6 +95,14 @@ class Memory(object):
         self.observations1.append(obs1)
         self.terminals1.append(terminal1)
 
+    def flush(self):
+        """Write the memory out to storage_dir, does nothing without one"""
+        if self.storage_dir is None:
+            return
+        buffers = [self.observations0, self.actions, self.rewards, self.terminals1, self.observations1]
+        mmap_storage.save_state(self.storage_dir, dict(start=self.observations0.start, length=self.observations0.length),
+                                [buffer.data for buffer in buffers])
+
     @property
     def nb_entries(self):
         return len(self.observations0)
@@ -1,5 +1,6 @@
 import os
 import tempfile
+import threading
 
 import tensorflow as tf
 import zipfile
@@ -11,6 +12,7 @@ from baselines.common.tf_util import load_variables, save_variables
 from baselines import logger
 from baselines.common.schedules import LinearSchedule
 from baselines.common import set_global_seeds
+from baselines.common.prefetch import BatchPrefetcher, contiguous
 
 from baselines import deepq
 from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
@@ -92,6 +94,15 @@ def load_act(path):
     return ActWrapper.load_act(path)
 
 
+def _frame_stack(env):
+    """k of the FrameStack wrapper of env"""
+    from baselines.common.atari_wrappers import FrameStack
+    while not isinstance(env, FrameStack):
+        assert hasattr(env, 'env'), "replay_storage='frames' needs an env wrapped in FrameStack"
+        env = env.env
+    return env.k
+
+
 def learn(env,
           network,
           seed=None,
@@ -113,6 +124,9 @@ def learn(env,
           prioritized_replay_beta0=0.4,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
+          replay_storage='list',
+          replay_dir=None,
+          prefetch=0,
           param_noise=False,
           callback=None,
           load_path=None,
@@ -169,6 +183,20 @@ def learn(env,
         to 1.0. If set to None equals to total_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    replay_storage: str
+        'list' keeps the transitions as given (LazyFrames keep sharing frames),
+        'array' preallocates typed arrays for buffer_size transitions from the env spaces,
+        which makes sampling much cheaper for large buffers (see ReplayBuffer.__init__),
+        'frames' is for envs wrapped in FrameStack (wrap_deepmind(frame_stack=True)): every frame
+        is stored once in a preallocated ring and the stacks are rebuilt at sample time.
+    replay_dir: str
+        with replay_storage 'array' or 'frames', keep the replay buffer in np.memmap files in this
+        directory. It is flushed every checkpoint_freq steps and at the end, and a later run with the
+        same directory (and buffer_size) starts with the buffer as it was then.
+    prefetch: int
+        if > 0, a thread samples this many batches ahead of the train steps
+        (see baselines.common.prefetch), prioritized replay skips the priority updates of
+        transitions added over since their batch was sampled.
     param_noise: bool
         whether or not to use parameter space noise (https://arxiv.org/abs/1706.01905)
     callback: (locals, globals) -> None
@@ -218,16 +246,43 @@ def learn(env,
     act = ActWrapper(act, act_params)
 
     # Create the replay buffer
+    assert replay_storage in ('list', 'array', 'frames'), 'unknown replay_storage {}'.format(replay_storage)
+    if replay_storage == 'array':
+        storage_spaces = dict(observation_space=env.observation_space, action_space=env.action_space)
+    elif replay_storage == 'frames':
+        storage_spaces = dict(observation_space=env.observation_space, action_space=env.action_space,
+                              frame_stack=_frame_stack(env))
+    else:
+        storage_spaces = {}
+    if replay_dir is not None:
+        assert storage_spaces, "replay_dir needs replay_storage 'array' or 'frames'"
+        storage_spaces['storage_dir'] = replay_dir
     if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha, **storage_spaces)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = total_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, **storage_spaces)
         beta_schedule = None
+
+    if prefetch:
+        def sample_batch():
+            # t is the step of the training loop
+            if prioritized_replay:
+                experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
+            else:
+                experience = replay_buffer.sample(batch_size) + (np.ones(batch_size, dtype=np.float32), None)
+            experience = contiguous(experience, [None, None, np.float32, None, np.float32, np.float32, None])
+            return experience, replay_buffer.num_writes
+        prefetcher = BatchPrefetcher(sample_batch, prefetch)
+        # held by whatever touches replay_buffer
+        replay_lock = prefetcher.lock
+    else:
+        prefetcher = None
+        replay_lock = threading.Lock()
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * total_timesteps),
                                  initial_p=1.0,
@@ -281,7 +336,8 @@ def learn(env,
             reset = False
             new_obs, rew, done, _ = env.step(env_action)
             # Store transition in the replay buffer.
-            replay_buffer.add(obs, action, rew, new_obs, float(done))
+            with replay_lock:
+                replay_buffer.add(obs, action, rew, new_obs, float(done))
             obs = new_obs
 
             episode_rewards[-1] += rew
@@ -292,7 +348,11 @@ def learn(env,
 
             if t > learning_starts and t % train_freq == 0:
                 # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
-                if prioritized_replay:
+                num_writes = None
+                if prefetcher is not None:
+                    experience, num_writes = prefetcher.get()
+                    (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+                elif prioritized_replay:
                     experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
                     (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
                 else:
@@ -301,7 +361,8 @@ def learn(env,
                 td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
                 if prioritized_replay:
                     new_priorities = np.abs(td_errors) + prioritized_replay_eps
-                    replay_buffer.update_priorities(batch_idxes, new_priorities)
+                    with replay_lock:
+                        replay_buffer.update_priorities(batch_idxes, new_priorities, num_writes)
 
             if t > learning_starts and t % target_network_update_freq == 0:
                 # Update target network periodically.
@@ -316,6 +377,9 @@ def learn(env,
                 logger.record_tabular("% time spent exploring", int(100 * exploration.value(t)))
                 logger.dump_tabular()
 
+            if checkpoint_freq is not None and t % checkpoint_freq == 0:
+                with replay_lock:
+                    replay_buffer.flush()
             if (checkpoint_freq is not None and t > learning_starts and
                     num_episodes > 100 and t % checkpoint_freq == 0):
                 if saved_mean_reward is None or mean_100ep_reward > saved_mean_reward:
@@ -325,6 +389,9 @@ def learn(env,
                     save_variables(model_file)
                     model_saved = True
                     saved_mean_reward = mean_100ep_reward
+        if prefetcher is not None:
+            prefetcher.close()
+        replay_buffer.flush()
         if model_saved:
             if print_freq is not None:
                 logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
@@ -0,0 +1,188 @@
+"""Samples per second of PrioritizedReplayBuffer against the implementation it replaced:
+the list backed segment trees and the per-transition sampling and update loops, copied
+below as they were before the trees moved to NumPy arrays.
+
+    python -m baselines.deepq.experiments.benchmark_replay_buffer --size 1000000
+"""
+import argparse
+import operator
+import random
+import time
+
+import numpy as np
+from gym.spaces import Box, Discrete
+
+from baselines.deepq.replay_buffer import PrioritizedReplayBuffer
+
+
+class ListSegmentTree(object):
+    """baselines.common.segment_tree.SegmentTree with its values in a list"""
+    def __init__(self, capacity, operation, neutral_element):
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
+        self._capacity = capacity
+        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._operation = operation
+
+    def _reduce_helper(self, start, end, node, node_start, node_end):
+        if start == node_start and end == node_end:
+            return self._value[node]
+        mid = (node_start + node_end) // 2
+        if end <= mid:
+            return self._reduce_helper(start, end, 2 * node, node_start, mid)
+        else:
+            if mid + 1 <= start:
+                return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
+            else:
+                return self._operation(
+                    self._reduce_helper(start, mid, 2 * node, node_start, mid),
+                    self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end)
+                )
+
+    def reduce(self, start=0, end=None):
+        if end is None:
+            end = self._capacity
+        if end < 0:
+            end += self._capacity
+        end -= 1
+        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+
+    def __setitem__(self, idx, val):
+        idx += self._capacity
+        self._value[idx] = val
+        idx //= 2
+        while idx >= 1:
+            self._value[idx] = self._operation(
+                self._value[2 * idx],
+                self._value[2 * idx + 1]
+            )
+            idx //= 2
+
+    def __getitem__(self, idx):
+        assert 0 <= idx < self._capacity
+        return self._value[self._capacity + idx]
+
+    def fill(self, values):
+        """set the leaves to values at once (not in the original, building 1M leaves one at a time is slow)"""
+        self._value[self._capacity:self._capacity + len(values)] = [float(v) for v in values]
+        for node in range(self._capacity - 1, 0, -1):
+            self._value[node] = self._operation(self._value[2 * node], self._value[2 * node + 1])
+
+
+class ListSumSegmentTree(ListSegmentTree):
+    def __init__(self, capacity):
+        super(ListSumSegmentTree, self).__init__(capacity, operator.add, 0.0)
+
+    def sum(self, start=0, end=None):
+        return super(ListSumSegmentTree, self).reduce(start, end)
+
+    def find_prefixsum_idx(self, prefixsum):
+        assert 0 <= prefixsum <= self.sum() + 1e-5
+        idx = 1
+        while idx < self._capacity:  # while non-leaf
+            if self._value[2 * idx] > prefixsum:
+                idx = 2 * idx
+            else:
+                prefixsum -= self._value[2 * idx]
+                idx = 2 * idx + 1
+        return idx - self._capacity
+
+
+class ListMinSegmentTree(ListSegmentTree):
+    def __init__(self, capacity):
+        super(ListMinSegmentTree, self).__init__(capacity, min, float('inf'))
+
+    def min(self, start=0, end=None):
+        return super(ListMinSegmentTree, self).reduce(start, end)
+
+
+class ReferencePrioritizedReplayBuffer(object):
+    """The priorities of buffer in list backed trees, sampled and updated by the original loops.
+    Transitions are read from buffer, so that both sides pay the same for them."""
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._alpha = buffer._alpha
+        self._max_priority = buffer._max_priority
+        capacity = buffer._it_sum._capacity
+        leaves = buffer._it_sum._value[capacity:capacity + len(buffer)]
+        self._it_sum = ListSumSegmentTree(capacity)
+        self._it_sum.fill(leaves)
+        self._it_min = ListMinSegmentTree(capacity)
+        self._it_min.fill(leaves)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def _sample_proportional(self, batch_size):
+        res = []
+        p_total = self._it_sum.sum(0, len(self) - 1)
+        every_range_len = p_total / batch_size
+        for i in range(batch_size):
+            mass = random.random() * every_range_len + i * every_range_len
+            idx = self._it_sum.find_prefixsum_idx(mass)
+            res.append(idx)
+        return res
+
+    def sample(self, batch_size, beta):
+        assert beta > 0
+
+        idxes = self._sample_proportional(batch_size)
+
+        weights = []
+        p_min = self._it_min.min() / self._it_sum.sum()
+        max_weight = (p_min * len(self)) ** (-beta)
+
+        for idx in idxes:
+            p_sample = self._it_sum[idx] / self._it_sum.sum()
+            weight = (p_sample * len(self)) ** (-beta)
+            weights.append(weight / max_weight)
+        weights = np.array(weights)
+        encoded_sample = self.buffer._encode_sample(idxes)
+        return tuple(list(encoded_sample) + [weights, idxes])
+
+    def update_priorities(self, idxes, priorities):
+        assert len(idxes) == len(priorities)
+        for idx, priority in zip(idxes, priorities):
+            assert priority > 0
+            assert 0 <= idx < len(self)
+            self._it_sum[idx] = priority ** self._alpha
+            self._it_min[idx] = priority ** self._alpha
+
+            self._max_priority = max(self._max_priority, priority)
+
+
+def samples_per_second(buffer, batch_size, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        idxes = buffer.sample(batch_size, 0.4)[-1]
+        buffer.update_priorities(idxes, np.random.random_sample(batch_size) + 1e-6)
+        count += batch_size
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 128, 512])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    observation_space = Box(low=-1, high=1, shape=(4,), dtype=np.float32)
+    buffer = PrioritizedReplayBuffer(args.size, alpha=0.6, observation_space=observation_space,
+                                     action_space=Discrete(2))
+    obs = np.zeros(4, dtype=np.float32)
+    for _ in range(args.size):
+        buffer.add(obs, 0, 0.0, obs, 0.0)
+    buffer.update_priorities(np.arange(args.size), np.random.random_sample(args.size) + 1e-6)
+    reference = ReferencePrioritizedReplayBuffer(buffer)
+
+    print('sample + update_priorities at {} transitions, samples/s'.format(args.size))
+    for batch_size in args.batch_sizes:
+        before = samples_per_second(reference, batch_size, args.seconds)
+        after = samples_per_second(buffer, batch_size, args.seconds)
+        print('batch {:4d}: list trees {:10.0f}  array trees {:10.0f}  x{:.1f}'.format(
+            batch_size, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
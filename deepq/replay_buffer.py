@@ -1,11 +1,12 @@
 import numpy as np
 import random
 
+from baselines.common import mmap_storage
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
 
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, observation_space=None, action_space=None, frame_stack=None, storage_dir=None):
         """Create Replay buffer.
 
         Parameters
@@ -13,24 +14,197 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        observation_space: gym.Space
+            if given together with action_space, the buffer preallocates typed
+            arrays for size transitions instead of keeping a list of tuples:
+            add writes in place and sample gathers a batch with one index draw
+            and fancy indexing. Observations are copied, so objects like
+            LazyFrames lose their frame sharing.
+        action_space: gym.Space
+            see observation_space
+        frame_stack: int
+            if given (with the spaces), observations are FrameStack stacks of frame_stack
+            frames along the last axis and every frame is stored once, in a ring of
+            size + frame_stack frames: a transition keeps the newest frame of obs_tp1,
+            the first transition of an episode also the frames of obs_t. Sampling
+            rebuilds both stacks from the frame_stack + 1 slots ending at the transition.
+            Transitions have to be added in the order they happened: obs_t is taken to be
+            the previous obs_tp1 unless the previous transition was done. The first
+            transitions of episodes take more than one slot, so a bit less than size
+            transitions fit.
+        storage_dir: str
+            if given (with the spaces), the arrays are np.memmap files in this directory
+            (see baselines.common.mmap_storage) and can be larger than memory. If the
+            directory holds a buffer of the same size and spaces, the buffer continues
+            from where it was at its last flush.
         """
-        self._storage = []
         self._maxsize = size
         self._next_idx = 0
+        self._num_writes = 0
+        self._frame_stack = frame_stack
+        self._storage_dir = storage_dir
+        if frame_stack is not None:
+            assert observation_space is not None and action_space is not None, 'frame_stack needs the spaces'
+            assert observation_space.shape[-1] % frame_stack == 0
+            # the oldest frame_stack slots are only the history of the newer ones
+            self._maxsize = size + frame_stack
+            self._storage = None
+            self._num_stored = 0
+            self._frame_channels = observation_space.shape[-1] // frame_stack
+            self._allocate(dict(
+                frames=((self._maxsize,) + observation_space.shape[:-1] + (self._frame_channels,),
+                        observation_space.dtype),
+                actions=((self._maxsize,) + action_space.shape, action_space.dtype),
+                rewards=((self._maxsize,), np.float32),
+                dones=((self._maxsize,), np.float32),
+                # slots a transition ends at whose frame_stack slots before are still its frames
+                sampleable=((self._maxsize,), bool)))
+            self._filled = False
+            self._episode_open = False
+        elif observation_space is not None and action_space is not None:
+            self._storage = None
+            self._num_stored = 0
+            self._allocate(dict(
+                obs_t=((size,) + observation_space.shape, observation_space.dtype),
+                actions=((size,) + action_space.shape, action_space.dtype),
+                rewards=((size,), np.float32),
+                obs_tp1=((size,) + observation_space.shape, observation_space.dtype),
+                dones=((size,), np.float32)))
+        else:
+            assert storage_dir is None, 'storage_dir needs the spaces'
+            self._storage = []
+
+        state = mmap_storage.load_state(storage_dir) if storage_dir is not None else None
+        if state is not None:
+            self._next_idx = state['next_idx']
+            self._num_stored = state['num_stored']
+        if state is not None and frame_stack is not None:
+            # adds after the last flush may have left transitions past next_idx, the slots
+            # _write_frame overwrites next have to be free of them
+            self._sampleable[(self._next_idx + np.arange(frame_stack)) % self._maxsize] = False
+            self._num_stored = int(np.count_nonzero(self._sampleable))
+            self._filled = state['filled'] or bool(self._sampleable[self._next_idx:].any())
+
+    def _allocate(self, specs):
+        """self._<name> for specs name -> (shape, dtype): zeros, or np.memmap files in storage_dir"""
+        if self._storage_dir is None:
+            self._arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+        else:
+            self._arrays = mmap_storage.open_arrays(self._storage_dir, specs)
+        for name, array in self._arrays.items():
+            setattr(self, '_' + name, array)
+
+    def _state(self):
+        state = dict(next_idx=self._next_idx, num_stored=self._num_stored)
+        if self._frame_stack is not None:
+            state['filled'] = self._filled
+        return state
+
+    def flush(self):
+        """Write the buffer out to storage_dir: a buffer opened on it later starts from here.
+
+        Does nothing without storage_dir.
+        """
+        if self._storage_dir is not None:
+            mmap_storage.save_state(self._storage_dir, self._state(), self._arrays.values())
+
+    @property
+    def num_writes(self):
+        """number of slots written so far, see PrioritizedReplayBuffer.update_priorities"""
+        return self._num_writes
+
+    def _written_since(self, idxes, num_writes):
+        """mask of the idxes written since there were num_writes"""
+        written = self._num_writes - num_writes
+        if written >= self._maxsize:
+            return np.ones(len(idxes), dtype=bool)
+        return (self._next_idx - 1 - idxes) % self._maxsize < written
 
     def __len__(self):
+        if self._storage is None:
+            return self._num_stored
         return len(self._storage)
 
     def add(self, obs_t, action, reward, obs_tp1, done):
+        """Store a transition, returns the index it is stored at"""
+        if self._frame_stack is not None:
+            return self._add_frames(obs_t, action, reward, obs_tp1, done)
+        if self._storage is None:
+            idx = self._next_idx
+            self._obs_t[idx] = obs_t
+            self._actions[idx] = action
+            self._rewards[idx] = reward
+            self._obs_tp1[idx] = obs_tp1
+            self._dones[idx] = done
+            self._num_stored = min(self._num_stored + 1, self._maxsize)
+            self._next_idx = (self._next_idx + 1) % self._maxsize
+            self._num_writes += 1
+            return idx
+
         data = (obs_t, action, reward, obs_tp1, done)
 
+        idx = self._next_idx
         if self._next_idx >= len(self._storage):
             self._storage.append(data)
         else:
             self._storage[self._next_idx] = data
         self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_writes += 1
+        return idx
+
+    def _add_frames(self, obs_t, action, reward, obs_tp1, done):
+        channels = self._frame_channels
+        if not self._episode_open:
+            obs_t = np.asarray(obs_t)
+            for i in range(self._frame_stack):
+                self._write_frame(obs_t[..., i * channels:(i + 1) * channels], False)
+        idx = self._write_frame(np.asarray(obs_tp1)[..., -channels:], True)
+        self._actions[idx] = action
+        self._rewards[idx] = reward
+        self._dones[idx] = done
+        self._episode_open = not done
+        return idx
+
+    def _write_frame(self, frame, sampleable):
+        idx = self._next_idx
+        self._frames[idx] = frame
+        self._set_sampleable(idx, sampleable)
+        # the slot frame_stack ahead lost the oldest frame of its stacks
+        self._set_sampleable((idx + self._frame_stack) % self._maxsize, False)
+        self._next_idx = (idx + 1) % self._maxsize
+        self._num_writes += 1
+        self._filled = self._filled or self._next_idx == 0
+        return idx
+
+    def _set_sampleable(self, idx, sampleable):
+        if self._sampleable[idx] != sampleable:
+            self._sampleable[idx] = sampleable
+            self._num_stored += 1 if sampleable else -1
+
+    def _sample_frame_idxes(self, batch_size):
+        assert len(self) > 0
+        high = self._maxsize if self._filled else self._next_idx
+        idxes = np.empty(0, dtype=np.int64)
+        while len(idxes) < batch_size:
+            candidates = np.random.randint(0, high, size=2 * batch_size)
+            idxes = np.concatenate([idxes, candidates[self._sampleable[candidates]]])
+        return idxes[:batch_size]
 
     def _encode_sample(self, idxes):
+        if self._frame_stack is not None:
+            idxes = np.asarray(idxes)
+            k, channels = self._frame_stack, self._frame_channels
+            # slots idx - k .. idx: obs_t is made of the first k frames, obs_tp1 of the last k
+            slots = (idxes[:, None] + np.arange(-k, 1)) % self._maxsize
+            frames = self._frames[slots]
+            stacks = np.moveaxis(frames, 1, -2).reshape(frames.shape[:1] + frames.shape[2:-1] + (-1,))
+            return (stacks[..., :k * channels], self._actions[idxes], self._rewards[idxes],
+                    stacks[..., channels:], self._dones[idxes])
+        if self._storage is None:
+            idxes = np.asarray(idxes)
+            return (self._obs_t[idxes], self._actions[idxes], self._rewards[idxes],
+                    self._obs_tp1[idxes], self._dones[idxes])
+
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         for i in idxes:
             data = self._storage[i]
@@ -64,12 +238,20 @@ class ReplayBuffer(object):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        if self._frame_stack is not None:
+            idxes = self._sample_frame_idxes(batch_size)
+        elif self._storage is None:
+            idxes = np.random.randint(0, len(self), size=batch_size)
+        else:
+            idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        if self._storage_dir is not None:
+            # in file order, neighbouring transitions share pages
+            idxes.sort()
         return self._encode_sample(idxes)
 
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, observation_space=None, action_space=None, frame_stack=None, storage_dir=None):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,39 +262,71 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        observation_space, action_space: gym.Space
+            preallocated storage, see ReplayBuffer.__init__
+        frame_stack: int
+            frame storage, see ReplayBuffer.__init__
+        storage_dir: str
+            storage in np.memmap files, priorities included, see ReplayBuffer.__init__
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, observation_space, action_space, frame_stack,
+                                                      storage_dir)
         assert alpha >= 0
         self._alpha = alpha
 
         it_capacity = 1
-        while it_capacity < size:
+        while it_capacity < self._maxsize:
             it_capacity *= 2
 
         self._it_sum = SumSegmentTree(it_capacity)
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
+        if storage_dir is not None:
+            trees = mmap_storage.open_arrays(storage_dir, dict(it_sum=((2 * it_capacity,), np.float64),
+                                                               it_min=((2 * it_capacity,), np.float64, np.inf)))
+            self._it_sum._value, self._it_min._value = trees['it_sum'], trees['it_min']
+            self._arrays.update(trees)
+            state = mmap_storage.load_state(storage_dir)
+            if state is not None:
+                self._max_priority = state['max_priority']
+            if state is not None and frame_stack is not None:
+                # the slots ReplayBuffer.__init__ freed
+                free = (self._next_idx + np.arange(frame_stack)) % self._maxsize
+                self._it_sum.update(free, 0.0)
+                self._it_min.update(free, np.inf)
 
     def add(self, *args, **kwargs):
         """See ReplayBuffer.store_effect"""
-        idx = self._next_idx
-        super().add(*args, **kwargs)
+        idx = super().add(*args, **kwargs)
         self._it_sum[idx] = self._max_priority ** self._alpha
         self._it_min[idx] = self._max_priority ** self._alpha
+        return idx
+
+    def _state(self):
+        state = super()._state()
+        state['max_priority'] = self._max_priority
+        return state
+
+    def _set_sampleable(self, idx, sampleable):
+        if self._sampleable[idx] and not sampleable:
+            self._it_sum[idx] = 0.0
+            self._it_min[idx] = float('inf')
+        super()._set_sampleable(idx, sampleable)
 
     def _sample_proportional(self, batch_size):
-        res = []
-        p_total = self._it_sum.sum(0, len(self._storage) - 1)
+        # one mass in each of batch_size equal ranges of the total priority, all looked up at once
+        if self._frame_stack is not None:
+            # transitions are spread over the ring, the other slots have priority 0
+            p_total = self._it_sum.sum()
+        else:
+            p_total = self._it_sum.sum(0, len(self) - 1)
         every_range_len = p_total / batch_size
-        for i in range(batch_size):
-            mass = random.random() * every_range_len + i * every_range_len
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        masses = (np.random.random_sample(batch_size) + np.arange(batch_size)) * every_range_len
+        return self._it_sum.find_prefixsum_idx(masses)
 
     def sample(self, batch_size, beta):
         """Sample a batch of experiences.
@@ -147,26 +361,23 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             Array of shape (batch_size,) and dtype np.float32
             denoting importance weight of each sampled transition
         idxes: np.array
-            Array of shape (batch_size,) and dtype np.int32
+            Array of shape (batch_size,) and dtype np.int64
             idexes in buffer of sampled experiences
         """
         assert beta > 0
 
         idxes = self._sample_proportional(batch_size)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
+        p_sum = self._it_sum.sum()
+        p_min = self._it_min.min() / p_sum
+        max_weight = (p_min * len(self)) ** (-beta)
 
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        p_samples = self._it_sum[idxes] / p_sum
+        weights = (p_samples * len(self)) ** (-beta) / max_weight
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
-    def update_priorities(self, idxes, priorities):
+    def update_priorities(self, idxes, priorities, num_writes=None):
         """Update priorities of sampled transitions.
 
         sets priority of transition at index idxes[i] in buffer
@@ -180,12 +391,32 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             List of updated priorities corresponding to
             transitions at the sampled idxes denoted by
             variable `idxes`.
+        num_writes: int
+            self.num_writes when idxes were sampled, for batches sampled ahead
+            (see baselines.common.prefetch): slots written since then hold other
+            transitions and keep their priority
         """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities, dtype=np.float64)
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        if len(idxes) == 0:
+            return
+        assert (priorities > 0).all()
+        if self._frame_stack is not None:
+            assert 0 <= idxes.min() and idxes.max() < self._maxsize
+            # slots that stopped being transitions since they were sampled keep priority 0
+            keep = self._sampleable[idxes]
+        else:
+            assert 0 <= idxes.min() and idxes.max() < len(self)
+            keep = None
+        if num_writes is not None:
+            fresh = ~self._written_since(idxes, num_writes)
+            keep = fresh if keep is None else keep & fresh
+        if keep is not None:
+            idxes, priorities = idxes[keep], priorities[keep]
+            if len(idxes) == 0:
+                return
+        self._it_sum.update(idxes, priorities ** self._alpha)
+        self._it_min.update(idxes, priorities ** self._alpha)
 
-            self._max_priority = max(self._max_priority, priority)
+        self._max_priority = max(self._max_priority, float(priorities.max()))
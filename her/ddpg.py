@@ -11,6 +11,7 @@ from baselines.her.normalizer import Normalizer
 from baselines.her.replay_buffer import ReplayBuffer
 from baselines.common.mpi_adam import MpiAdam
 from baselines.common import tf_util
+from baselines.common.prefetch import BatchPrefetcher, contiguous
 
 
 def dims_to_shapes(input_dims):
@@ -25,7 +26,7 @@ class DDPG(object):
                  Q_lr, pi_lr, norm_eps, norm_clip, max_u, action_l2, clip_obs, scope, T,
                  rollout_batch_size, subtract_goals, relative_goals, clip_pos_returns, clip_return,
                  bc_loss, q_filter, num_demo, demo_batch_size, prm_loss_weight, aux_loss_weight,
-                 sample_transitions, gamma, reuse=False, **kwargs):
+                 sample_transitions, gamma, prefetch=0, reuse=False, **kwargs):
         """Implementation of DDPG that is used in combination with Hindsight Experience Replay (HER).
             Added functionality to use demonstrations for training to Overcome exploration problem.
 
@@ -54,6 +55,7 @@ class DDPG(object):
             clip_return (float): clip returns to be in [-clip_return, clip_return]
             sample_transitions (function) function that samples from the replay buffer
             gamma (float): gamma used for Q learning updates
+            prefetch (int): number of training batches sampled ahead on a thread (see baselines.common.prefetch)
             reuse (boolean): whether or not the networks should be reused
             bc_loss: whether or not the behavior cloning loss should be used as an auxilliary loss
             q_filter: whether or not a filter on the q value update should be used when training with demonstartions
@@ -106,6 +108,11 @@ class DDPG(object):
         global DEMO_BUFFER
         DEMO_BUFFER = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions) #initialize the demo buffer; in the same way as the primary data buffer
 
+        # the buffers have their own locks, sampling needs no other
+        self.prefetcher = None
+        if self.prefetch:
+            self.prefetcher = BatchPrefetcher(lambda: contiguous(self._sample_batch(), np.float32), self.prefetch)
+
     def _random_action(self, n):
         return np.random.uniform(low=-self.max_u, high=self.max_u, size=(n, self.dimu))
 
@@ -261,6 +268,11 @@ class DDPG(object):
         self.pi_adam.update(pi_grad, self.pi_lr)
 
     def sample_batch(self):
+        if self.prefetcher is not None:
+            return self.prefetcher.get()
+        return self._sample_batch()
+
+    def _sample_batch(self):
         if self.bc_loss: #use demonstration buffer to sample as well if bc_loss flag is set TRUE
             transitions = self.buffer.sample(self.batch_size - self.demo_batch_size)
             global DEMO_BUFFER
@@ -420,7 +432,7 @@ class DDPG(object):
         """
         excluded_subnames = ['_tf', '_op', '_vars', '_adam', 'buffer', 'sess', '_stats',
                              'main', 'target', 'lock', 'env', 'sample_transitions',
-                             'stage_shapes', 'create_actor_critic']
+                             'stage_shapes', 'create_actor_critic', 'prefetcher']
 
         state = {k: v for k, v in self.__dict__.items() if all([not subname in k for subname in excluded_subnames])}
         state['buffer_size'] = self.buffer_size
@@ -33,6 +33,7 @@ DEFAULT_PARAMS = {
     'n_cycles': 50,  # per epoch
     'rollout_batch_size': 2,  # per mpi thread
     'n_batches': 40,  # training batches per cycle
+    'prefetch': 0,  # training batches sampled ahead on a thread, 0 samples them in the train step
     'batch_size': 256,  # per mpi thread, measured in transitions and reduced to even multiple of chunk_length.
     'n_test_rollouts': 10,  # number of test rollouts per epoch, each consists of rollout_batch_size rollouts
     'test_with_polyak': False,  # run test episodes with the target network
@@ -110,7 +111,7 @@ def prepare_params(kwargs):
                  'polyak',
                  'batch_size', 'Q_lr', 'pi_lr',
                  'norm_eps', 'norm_clip', 'max_u',
-                 'action_l2', 'clip_obs', 'scope', 'relative_goals']:
+                 'action_l2', 'clip_obs', 'scope', 'relative_goals', 'prefetch']:
         ddpg_params[name] = kwargs[name]
         kwargs['_' + name] = kwargs[name]
         del kwargs[name]